@@ -0,0 +1,45 @@
+"""Time KeyCompletion with and without the max_matches bound.
+
+Usage: python benchmarks/bench_complete.py [number-of-keys]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import records
+
+from gpgkeys.completions.key import KeyCompletion
+from gpgkeys.completions.index import KeyIndexBuilder
+
+PREFIXES = ('', '1', 'alice', 'carol cl', 'zzz')
+
+
+def build(n):
+    kc = KeyCompletion()
+    builder = KeyIndexBuilder()
+    for keyid, userid in records(n):
+        builder.add(keyid, userid, 'utf-8', kc.parse_names(userid))
+    kc.index = builder.build()
+    kc.update = lambda: None
+    return kc
+
+
+def main(n):
+    kc = build(n)
+    print('%d keys, %d key ids' % (n, len(kc.by_keyid)))
+    print('%-10s %8s %12s %12s %8s' % ('text', 'matches', 'all (ms)', 'bounded (ms)', 'speedup'))
+    for text in PREFIXES:
+        number = 10
+        kc.max_matches = sys.maxsize
+        t1 = timeit.timeit(lambda: kc(text), number=number) / number
+        count = len(kc(text))
+        kc.max_matches = KeyCompletion.max_matches
+        t2 = timeit.timeit(lambda: kc(text), number=number) / number
+        print('%-10r %8d %12.3f %12.3f %7.0fx' % (text, count, t1*1000, t2*1000, t1/t2))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
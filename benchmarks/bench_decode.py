@@ -0,0 +1,88 @@
+"""Compare decode_userid with the previous unescape/gpgdecode pair.
+
+Usage: python benchmarks/bench_decode.py [number-of-keys]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import records
+
+from gpgkeys.utils import char
+from gpgkeys.utils import decode
+from gpgkeys.utils import getpreferredencoding
+from gpgkeys.completions.key import decode_userid
+
+old_unescape_re = re.compile(br'([\\]x[0-9a-f]{2})')
+
+
+def old_unescape(text):
+    seen = {}
+    for m in old_unescape_re.finditer(text):
+        for g in m.groups():
+            if g not in seen:
+                text = text.replace(g, char(int(g[2:], 16)))
+                seen[g] = True
+    return text
+
+
+def old_gpgdecode(text):
+    try:
+        encoding = 'utf-8'
+        text = decode(text, encoding, errors='strict')
+    except UnicodeDecodeError:
+        try:
+            encoding = 'latin-1'
+            text = decode(text, encoding, errors='strict')
+        except UnicodeDecodeError:
+            encoding = getpreferredencoding()
+            text = decode(text, encoding)
+    return text, encoding
+
+
+def old_decode_userid(text):
+    return old_gpgdecode(old_unescape(text))
+
+
+def escape(userid):
+    return userid.encode('utf-8').replace(b':', b'\\x3a')
+
+
+def samples(n):
+    ascii = [escape(userid) for keyid, userid in records(n)]
+    escaped = [x.replace(b'a', b'\\xc3\\xa4') for x in ascii]
+    latin1 = [x.replace(b'a', b'\\xe4') for x in ascii]
+    # Signature listings repeat the signers' user ids over and over
+    repeated = ascii[:n//100 or 1] * 100
+    return (('ascii', ascii), ('utf-8 escaped', escaped),
+            ('latin-1 escaped', latin1), ('repeated', repeated))
+
+
+def run(func, texts):
+    for text in texts:
+        func(text)
+
+
+def main(n):
+    print('%d user ids per sample' % (2*n))
+    print('%-16s %10s %10s %10s %8s %8s' % (
+        'sample', 'old (ms)', 'cold (ms)', 'warm (ms)', 'cold', 'warm'))
+    for name, texts in samples(n):
+        for text in texts[:100]:
+            assert old_decode_userid(text) == decode_userid(text)
+        t1 = min(timeit.repeat(lambda: run(old_decode_userid, texts), number=1, repeat=3))
+        # Start every repetition with an empty cache
+        t2 = min(timeit.repeat(lambda: run(decode_userid, texts),
+                               setup=decode_userid.cache_clear, number=1, repeat=3))
+        # The cache holds the sample from the last repetition
+        t3 = min(timeit.repeat(lambda: run(decode_userid, texts), number=1, repeat=3))
+        print('%-16s %10.1f %10.1f %10.1f %7.1fx %7.1fx' % (
+            name, t1*1000, t2*1000, t3*1000, t1/t2, t1/t3))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,40 @@
+"""Time fetching keys from a local HKP stand-in with increasing concurrency.
+
+Usage: python benchmarks/bench_fetch.py [number-of-keys] [delay-ms]
+"""
+
+import sys
+import time
+import random
+
+from gpgkeys.fetch import Fetcher
+from gpgkeys.testing import HKPServer
+
+WORKERS = (1, 4, 16, 64)
+
+
+def main(n, delay):
+    rnd = random.Random(23)
+    keys = {}
+    for i in range(n):
+        fingerprint = '%040X' % rnd.getrandbits(160)
+        keys[fingerprint] = (b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n' + b'x' * 2000 +
+                             b'\n-----END PGP PUBLIC KEY BLOCK-----\n')
+    server = HKPServer(keys, delay / 1000.0).start()
+    try:
+        print('%d keys, %d ms per request' % (n, delay))
+        print('%8s %10s %10s' % ('workers', 'seconds', 'keys/s'))
+        for workers in WORKERS:
+            fetcher = Fetcher(server.url, workers)
+            start = time.time()
+            fetched = [x for x in fetcher.fetch_all(sorted(keys)) if x[2] is None]
+            elapsed = time.time() - start
+            assert len(fetched) == n
+            print('%8d %10.2f %10.0f' % (workers, elapsed, n / elapsed))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
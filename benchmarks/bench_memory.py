@@ -0,0 +1,81 @@
+"""Measure memory use of the key completion cache.
+
+Compares the compact KeyIndex with the previous layout of three
+dicts plus an encodings dict.
+
+Usage: python benchmarks/bench_memory.py [number-of-keys ...]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import records
+
+from gpgkeys.completions.key import KeyCompletion
+from gpgkeys.completions.index import PrefixIndex
+from gpgkeys.completions.index import KeyIndexBuilder
+
+parse_names = KeyCompletion().parse_names
+
+
+def build_dicts(records):
+    encodings = {}
+    by_keyid = PrefixIndex()
+    by_userid = PrefixIndex()
+    by_name = PrefixIndex()
+    for keyid, userid in records:
+        encodings.setdefault(userid, 'utf-8')
+        by_keyid.setdefault(keyid, (keyid, userid))
+        by_userid.setdefault(userid.lower(), userid)
+        for name in parse_names(userid):
+            encodings.setdefault(name, encodings[userid])
+            by_name.setdefault(name.lower(), name)
+    for map in (by_keyid, by_userid, by_name):
+        map.sortedkeys()
+    return encodings, by_keyid, by_userid, by_name
+
+
+def build_index(records):
+    builder = KeyIndexBuilder()
+    for keyid, userid in records:
+        builder.add(keyid, userid, 'utf-8', parse_names(userid))
+    return builder.build()
+
+
+def parse(raw):
+    # Create fresh strings like a keyring parser would
+    for keyid, userid in raw:
+        yield keyid.decode('ascii'), userid.decode('utf-8')
+
+
+def measure(build, raw):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    result = build(parse(raw))
+    elapsed = time.time() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def main(sizes):
+    mb = 1024.0 * 1024.0
+    print('%8s %9s %-10s %12s %12s %10s' % ('keys', 'user ids', 'layout', 'resident MB', 'peak MB', 'build (s)'))
+    for n in sizes:
+        raw = [(k.encode('ascii'), u.encode('utf-8')) for k, u in records(n, uids=6)]
+        for name, build in (('dicts', build_dicts), ('compact', build_index)):
+            result, current, peak, elapsed = measure(build, raw)
+            print('%8d %9d %-10s %12.1f %12.1f %10.2f' % (
+                n, len(raw), name, current/mb, peak/mb, elapsed))
+            del result
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [10000, 80000])
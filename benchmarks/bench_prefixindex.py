@@ -0,0 +1,51 @@
+"""Compare prefix search on PrefixIndex with a linear dict scan.
+
+Usage: python benchmarks/bench_prefixindex.py [number-of-keys]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import records
+
+from gpgkeys.completions.index import PrefixIndex
+
+PREFIXES = ('', '1', 'AB', 'alice', 'carol cl', 'zzz')
+
+
+def build(n):
+    plain, index = {}, PrefixIndex()
+    for keyid, userid in records(n):
+        for name in userid.split()[:2]:
+            plain.setdefault(name.lower(), name)
+            index.setdefault(name.lower(), name)
+        plain.setdefault(keyid, (keyid, userid))
+        index.setdefault(keyid, (keyid, userid))
+        plain.setdefault(userid.lower(), userid)
+        index.setdefault(userid.lower(), userid)
+    index.sortedkeys()
+    return plain, index
+
+
+def scan(map, text):
+    return [x for x in map if x.startswith(text)]
+
+
+def main(n):
+    plain, index = build(n)
+    print('%d keys, %d index entries' % (n, len(index)))
+    print('%-10s %8s %12s %12s %8s' % ('prefix', 'matches', 'scan (ms)', 'index (ms)', 'speedup'))
+    for prefix in PREFIXES:
+        number = 10
+        t1 = timeit.timeit(lambda: scan(plain, prefix), number=number) / number
+        t2 = timeit.timeit(lambda: index.startswith(prefix), number=number) / number
+        assert sorted(scan(plain, prefix)) == index.startswith(prefix)
+        print('%-10r %8d %12.3f %12.3f %7.0fx' % (
+            prefix, len(index.startswith(prefix)), t1*1000, t2*1000, t1/t2))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 80000)
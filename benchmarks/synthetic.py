@@ -0,0 +1,30 @@
+"""Synthetic key data for benchmarks."""
+
+import random
+
+FIRST = ('Alice', 'Bob', 'Carol', 'Dave', 'Eve', 'Frank', 'Grace', 'Heidi',
+         'Ivan', 'Judy', 'Mallory', 'Oscar', 'Peggy', 'Trent', 'Victor', 'Walter')
+LAST = ('Anderson', 'Baker', 'Clark', 'Davis', 'Evans', 'Fischer', 'Garcia',
+        'Huber', 'Ito', 'Jones', 'Keller', 'Lopez', 'Meyer', 'Novak', 'Olsen')
+DOMAINS = ('example.org', 'example.com', 'example.net', 'mail.example.de')
+
+
+def keys(n, uids=2, seed=23):
+    """Return a list of n (keyid, [userid, ...]) tuples."""
+    rnd = random.Random(seed)
+    result = []
+    for i in range(n):
+        keyid = '%08X' % rnd.getrandbits(32)
+        userids = []
+        for j in range(uids):
+            first, last = rnd.choice(FIRST), rnd.choice(LAST)
+            userids.append('%s %s%d <%s.%s%d@%s>' % (
+                first, last, i, first.lower(), last.lower(), j, rnd.choice(DOMAINS)))
+        result.append((keyid, userids))
+    return result
+
+
+def records(n, uids=2, seed=23):
+    """Return a list of (keyid, userid) records as yielded by read_keys."""
+    return [(keyid, userid) for keyid, userids in keys(n, uids, seed)
+            for userid in userids]
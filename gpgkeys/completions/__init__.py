@@ -1,4 +1,5 @@
 from __future__ import absolute_import
 
 from .key import KeyCompletion
+from .key import SecretKeyCompletion
 from .keyserver import KeyserverCompletion
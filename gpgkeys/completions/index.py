@@ -0,0 +1,885 @@
+import sys
+
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+
+class PrefixIndex(dict):
+    """A dictionary supporting fast prefix search on its keys.
+
+    Keys are kept in a sorted list which is rebuilt lazily after
+    the dictionary has been modified. Searches bisect into the list
+    and cost O(log n + k) where k is the number of matches.
+    """
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self, *args, **kw)
+        self._sorted = None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._sorted = None
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._sorted = None
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._sorted = None
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kw):
+        dict.update(self, *args, **kw)
+        self._sorted = None
+
+    def pop(self, *args):
+        self._sorted = None
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._sorted = None
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self._sorted = None
+
+    def sortedkeys(self):
+        """Return the keys as sorted list."""
+        if self._sorted is None:
+            self._sorted = sorted(dict.keys(self))
+        return self._sorted
+
+    def startswith(self, prefix):
+        """Return the keys starting with ``prefix`` in sorted order."""
+        keys = self.sortedkeys()
+        lo = bisect_left(keys, prefix)
+        # Keys starting with prefix form a contiguous run; bisect
+        # for its end as well.
+        hi, end = lo, len(keys)
+        while hi < end:
+            mid = (hi + end) // 2
+            if keys[mid].startswith(prefix):
+                hi = mid + 1
+            else:
+                end = mid
+        return keys[lo:hi]
+
+
+if sys.version_info[0] >= 3:
+    def tobytes(string):
+        return string.encode('utf-8', 'surrogatepass')
+
+    def tostring(data):
+        return data.decode('utf-8', 'surrogatepass')
+else:
+    def tobytes(string):
+        return string
+
+    def tostring(data):
+        return data
+
+
+def frombytes(typecode, data):
+    """Create an array from its machine representation."""
+    a = array(typecode)
+    if sys.version_info[0] >= 3:
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+
+def asbytes(a):
+    """Return the machine representation of an array."""
+    if sys.version_info[0] >= 3:
+        return a.tobytes()
+    return a.tostring()
+
+
+class StringTable(object):
+    """A compact, read-only sequence of strings.
+
+    The strings are stored back to back in a single UTF-8 encoded byte
+    string and cost little more than their encoded length. If the table
+    is sorted, it can be searched by prefix.
+    """
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, strings=()):
+        offsets = array('I', [0])
+        data = bytearray()
+        for string in strings:
+            data += tobytes(string)
+            offsets.append(len(data))
+        self.data = bytes(data)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return tostring(self.raw(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw(self, i):
+        """Return the encoded string at index ``i``."""
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+    def slice(self, lo, hi):
+        """Return the strings from index ``lo`` to ``hi`` as list."""
+        data, offsets = self.data, self.offsets
+        return [tostring(data[offsets[i]:offsets[i+1]]) for i in range(lo, hi)]
+
+    def find(self, string):
+        """Return the index of ``string`` in a sorted table or -1."""
+        raw = tobytes(string)
+        i = bisect_left(RawView(self), raw)
+        if i < len(self) and self.raw(i) == raw:
+            return i
+        return -1
+
+    def search(self, prefix):
+        """Return the range of strings starting with ``prefix`` in a sorted table."""
+        raw = tobytes(prefix)
+        view = RawView(self)
+        lo = bisect_left(view, raw)
+        hi, end = lo, len(self)
+        while hi < end:
+            mid = (hi + end) // 2
+            if view[mid].startswith(raw):
+                hi = mid + 1
+            else:
+                end = mid
+        return lo, hi
+
+    def dump(self):
+        return (self.data, asbytes(self.offsets))
+
+    @classmethod
+    def load(cls, state):
+        table = cls()
+        table.data = state[0]
+        table.offsets = frombytes('I', state[1])
+        return table
+
+
+class RawView(object):
+    """Sequence of encoded strings for bisecting a StringTable."""
+    __slots__ = ('table',)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        return self.table.raw(i)
+
+
+class CompactIndex(object):
+    """A compact prefix index.
+
+    Maps a sorted StringTable of keys to integer references into
+    a table of values. Keys added after the index was built go to
+    a small PrefixIndex on top, keys removed from the table are
+    remembered in the set of removed keys.
+    """
+    __slots__ = ('keys', 'refs', 'values', 'delta', 'removed')
+
+    def __init__(self, keys=None, refs=None, values=None, delta=None, removed=None):
+        self.keys = keys if keys is not None else StringTable()
+        self.refs = refs if refs is not None else array('i')
+        self.values = values if values is not None else StringTable()
+        self.delta = delta if delta is not None else PrefixIndex()
+        self.removed = removed if removed is not None else set()
+
+    def __len__(self):
+        return len(self.keys) - len(self.removed) + len(self.delta)
+
+    def __iter__(self):
+        if self.delta or self.removed:
+            return iter(sorted(chain(self.live(self.keys), self.delta)))
+        return iter(self.keys)
+
+    def __contains__(self, key):
+        return key in self.delta or self.ref(key) >= 0
+
+    def __getitem__(self, key):
+        ref = self.ref(key)
+        if ref < 0:
+            return self.delta[key]
+        return self.values[ref]
+
+    def get(self, key, default=None):
+        ref = self.ref(key)
+        if ref < 0:
+            return self.delta.get(key, default)
+        return self.values[ref]
+
+    def ref(self, key):
+        """Return the value reference of ``key`` or -1."""
+        i = self.keys.find(key)
+        if i < 0 or key in self.removed:
+            return -1
+        return self.refs[i]
+
+    def add(self, key, value):
+        """Add ``key`` unless it exists."""
+        if key not in self:
+            self.delta[key] = value
+
+    def remove(self, key):
+        """Remove ``key`` if it exists."""
+        self.delta.pop(key, None)
+        if self.keys.find(key) >= 0:
+            self.removed.add(key)
+
+    def live(self, keys):
+        """Return ``keys`` without the removed keys."""
+        if self.removed:
+            return [x for x in keys if x not in self.removed]
+        return keys
+
+    def startswith(self, prefix):
+        """Return the keys starting with ``prefix`` in sorted order."""
+        lo, hi = self.keys.search(prefix)
+        keys = self.live(self.keys.slice(lo, hi))
+        if self.delta:
+            keys = sorted(keys + self.delta.startswith(prefix))
+        return keys
+
+    def count(self, prefix):
+        """Return the number of keys starting with ``prefix``."""
+        lo, hi = self.keys.search(prefix)
+        count = hi - lo
+        if self.removed:
+            count -= sum(1 for x in self.removed if x.startswith(prefix))
+        if self.delta:
+            count += len(self.delta.startswith(prefix))
+        return count
+
+    def head(self, prefix, n):
+        """Return the first ``n`` keys starting with ``prefix``."""
+        lo, hi = self.keys.search(prefix)
+        # Enough to make up for removed keys
+        keys = self.live(self.keys.slice(lo, min(hi, lo + n + len(self.removed))))[:n]
+        if self.delta:
+            keys = sorted(keys + self.delta.startswith(prefix))[:n]
+        return keys
+
+    def last(self, prefix):
+        """Return the last key starting with ``prefix`` or None."""
+        lo, hi = self.keys.search(prefix)
+        keys = self.live(self.keys.slice(max(lo, hi - 1 - len(self.removed)), hi))[-1:]
+        if self.delta:
+            keys += self.delta.startswith(prefix)[-1:]
+        return max(keys) if keys else None
+
+    def copy(self):
+        """Return a copy sharing the compact tables."""
+        return CompactIndex(self.keys, self.refs, self.values, PrefixIndex(self.delta),
+                            set(self.removed))
+
+    def dump(self):
+        return (self.keys.dump(), asbytes(self.refs), dict(self.delta), sorted(self.removed))
+
+    @classmethod
+    def load(cls, state, values):
+        return cls(StringTable.load(state[0]), frombytes('i', state[1]), values,
+                   PrefixIndex(state[2]), set(state[3]))
+
+
+class CertificateTable(object):
+    """The certificates an index was built from.
+
+    Maps fingerprints to the digest of the keyring data and a checksum
+    of the indexed content of each certificate, so that changes to
+    a keyring can be applied without rebuilding the index.
+    """
+    __slots__ = ('fingerprints', 'digests', 'checksums', 'delta', 'removed')
+
+    def __init__(self, fingerprints=None, digests=None, checksums=None, delta=None, removed=None):
+        self.fingerprints = fingerprints if fingerprints is not None else StringTable()
+        self.digests = digests if digests is not None else StringTable()
+        self.checksums = checksums if checksums is not None else array('I')
+        self.delta = delta if delta is not None else {}
+        self.removed = removed if removed is not None else set()
+
+    def __len__(self):
+        return len(self.fingerprints) - len(self.removed) + sum(
+            1 for x in self.delta if self.index(x) < 0)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.delta or self.index(fingerprint) >= 0
+
+    def index(self, fingerprint):
+        """Return the position of ``fingerprint`` in the compact tables or -1."""
+        if fingerprint in self.removed:
+            return -1
+        return self.fingerprints.find(fingerprint)
+
+    def known(self):
+        """Return a dictionary mapping known digests to fingerprints."""
+        known = {}
+        for fingerprint, digest in zip(self.fingerprints, self.digests):
+            if fingerprint not in self.removed:
+                known[digest] = fingerprint
+        for fingerprint, (digest, checksum) in self.delta.items():
+            known[digest] = fingerprint
+        return known
+
+    def checksum(self, fingerprint):
+        """Return the content checksum of ``fingerprint`` or None."""
+        if fingerprint in self.delta:
+            return self.delta[fingerprint][1]
+        i = self.index(fingerprint)
+        if i < 0:
+            return None
+        return self.checksums[i]
+
+    def add(self, fingerprint, digest, checksum):
+        """Add or update a certificate."""
+        self.delta[fingerprint] = (digest, checksum)
+
+    def remove(self, fingerprint):
+        """Remove a certificate if it exists."""
+        self.delta.pop(fingerprint, None)
+        if self.fingerprints.find(fingerprint) >= 0:
+            self.removed.add(fingerprint)
+
+    def copy(self):
+        """Return a copy sharing the compact tables."""
+        return CertificateTable(self.fingerprints, self.digests, self.checksums,
+                                dict(self.delta), set(self.removed))
+
+    def dump(self):
+        return (self.fingerprints.dump(), self.digests.dump(),
+                asbytes(self.checksums), self.delta, sorted(self.removed))
+
+    @classmethod
+    def load(cls, state):
+        return cls(StringTable.load(state[0]), StringTable.load(state[1]),
+                   frombytes('I', state[2]), state[3], set(state[4]))
+
+
+class KeyRows(object):
+    """The records each certificate added to a KeyIndex.
+
+    Rows are aligned with the fingerprints of the certificate table.
+    A row holds the position in by_keyid of the key id the certificate
+    added or -1, the references of the user ids it added, and the
+    positions in by_subkey of the subkey ids it added.
+    """
+    __slots__ = ('keyids', 'userid_offsets', 'userids', 'subkey_offsets', 'subkeys')
+
+    def __init__(self):
+        self.keyids = array('i')
+        self.userid_offsets = array('I', [0])
+        self.userids = array('i')
+        self.subkey_offsets = array('I', [0])
+        self.subkeys = array('i')
+
+    def __len__(self):
+        return len(self.keyids)
+
+    def __getitem__(self, i):
+        return (self.keyids[i],
+                self.userids[self.userid_offsets[i]:self.userid_offsets[i+1]],
+                self.subkeys[self.subkey_offsets[i]:self.subkey_offsets[i+1]])
+
+    def append(self, keyid, userids, subkeys):
+        self.keyids.append(keyid)
+        self.userids.extend(userids)
+        self.userid_offsets.append(len(self.userids))
+        self.subkeys.extend(subkeys)
+        self.subkey_offsets.append(len(self.subkeys))
+
+    def dump(self):
+        return tuple(asbytes(getattr(self, x)) for x in self.__slots__)
+
+    @classmethod
+    def load(cls, state):
+        rows = cls()
+        for name, data in zip(cls.__slots__, state):
+            setattr(rows, name, frombytes(getattr(rows, name).typecode, data))
+        return rows
+
+
+class KeyIndex(object):
+    """The key completion cache.
+
+    Key ids, long key ids, fingerprints, subkey ids, lower-cased
+    user ids, and lower-cased names map to entries of the user id
+    and name tables by integer reference. Encodings are stored as
+    small integer codes, and each user id refers back to the key id
+    it was first seen with.
+
+    Records added after the index was built are kept in plain
+    dictionaries on top of the compact tables, removed records in
+    sets of removed keys. The rows of each certificate and the number
+    of user ids using each name allow removing certificates without
+    scanning the index.
+    """
+    __slots__ = ('encodings', 'userids', 'userid_codes', 'names', 'name_codes',
+                 'owners', 'by_keyid', 'by_longid', 'by_fingerprint', 'by_subkey',
+                 'by_userid', 'by_name', 'added_userids', 'added_names', 'certs',
+                 'trigrams', 'rows', 'name_uses', 'added_rows', 'added_uses', 'pending')
+
+    def __init__(self):
+        self.encodings = []
+        self.userids = StringTable()
+        self.userid_codes = array('B')
+        self.names = StringTable()
+        self.name_codes = array('B')
+        self.owners = array('i')
+        self.by_keyid = CompactIndex(values=self.userids)
+        self.by_longid = CompactIndex(values=self.userids)
+        self.by_fingerprint = CompactIndex(values=self.userids)
+        self.by_subkey = CompactIndex(values=self.userids)
+        self.by_userid = CompactIndex(values=self.userids)
+        self.by_name = CompactIndex(values=self.names)
+        self.added_userids = {}
+        self.added_names = {}
+        self.certs = CertificateTable()
+        self.trigrams = None
+        self.rows = KeyRows()
+        self.name_uses = array('I')
+        self.added_rows = {}
+        self.added_uses = {}
+        self.pending = None
+
+    def __len__(self):
+        """Return the number of user ids."""
+        return len(self.userids) - len(self.by_userid.removed) + len(self.added_userids)
+
+    def add(self, keyid, userid, encoding, names=()):
+        """Add a record to the built index. Existing keys are kept."""
+        lower = userid.lower()
+        pending = self.pending
+        if pending is None or pending[0] != keyid:
+            # Key id, first user id, whether the key id was added, and
+            # user ids added for the current key
+            pending = self.pending = [keyid, None, False, []]
+        if lower not in self.by_userid:
+            self.by_userid.add(lower, userid)
+            self.added_userids[userid] = (keyid, encoding)
+            pending[3].append(userid)
+            for name in names:
+                if name.lower() not in self.by_name:
+                    self.by_name.add(name.lower(), name)
+                    self.added_names[name] = encoding
+                self.added_uses[name.lower()] = self.added_uses.get(name.lower(), 0) + 1
+        if pending[1] is None:
+            pending[1] = self.by_userid[lower]
+        if keyid not in self.by_keyid:
+            self.by_keyid.add(keyid, pending[1])
+            pending[2] = True
+
+    def add_key(self, keyid, longid, fingerprint, subkeys=()):
+        """Add the long key id, fingerprint, and subkey ids of a key.
+
+        Records added since the previous key are remembered as the
+        rows of certificate ``fingerprint``.
+        """
+        pending, self.pending = self.pending, None
+        if pending is None or pending[0] != keyid:
+            pending = [keyid, self.by_keyid.get(keyid), False, []]
+        userid = pending[1]
+        if userid is not None:
+            self.by_longid.add(longid, userid)
+            added = []
+            if fingerprint:
+                self.by_fingerprint.add(fingerprint, userid)
+            for subkey in subkeys:
+                if subkey not in self.by_subkey:
+                    self.by_subkey.add(subkey, userid)
+                    added.append(subkey)
+            if fingerprint:
+                self.added_rows[fingerprint] = (keyid if pending[2] else None, pending[3], added)
+
+    def remove_key(self, fingerprint, longid):
+        """Remove the records added by certificate ``fingerprint``.
+
+        Returns the removed user ids.
+        """
+        rows = self.added_rows.pop(fingerprint, None)
+        if rows is not None:
+            keyid, userids, subkeys = rows
+            for userid in userids:
+                del self.added_userids[userid]
+                self.by_userid.remove(userid.lower())
+        else:
+            i = self.certs.index(fingerprint)
+            if i < 0 or i >= len(self.rows):
+                return []
+            keyid, refs, subkeys = self.rows[i]
+            keyid = self.by_keyid.keys[keyid] if keyid >= 0 else None
+            userids = [self.userids[x] for x in refs]
+            for userid in userids:
+                self.by_userid.remove(userid.lower())
+            subkeys = [self.by_subkey.keys[x] for x in subkeys]
+        for subkey in subkeys:
+            self.by_subkey.remove(subkey)
+        if keyid is not None:
+            self.by_keyid.remove(keyid)
+        self.by_longid.remove(longid)
+        self.by_fingerprint.remove(fingerprint)
+        return list(userids)
+
+    def release_names(self, names):
+        """Release the ``names`` of a removed user id.
+
+        Names no user id uses anymore are removed.
+        """
+        for name in names:
+            lower = name.lower()
+            self.added_uses[lower] = self.added_uses.get(lower, 0) - 1
+            i = self.by_name.keys.find(lower)
+            uses = self.name_uses[i] if i >= 0 else 0
+            if uses + self.added_uses[lower] <= 0:
+                self.added_names.pop(self.by_name.get(lower), None)
+                self.by_name.remove(lower)
+
+    def copy(self):
+        """Return a copy sharing the compact tables.
+
+        Records added to the copy do not show in this index.
+        """
+        index = KeyIndex.__new__(KeyIndex)
+        for name in self.__slots__:
+            setattr(index, name, getattr(self, name))
+        for name in ('by_keyid', 'by_longid', 'by_fingerprint', 'by_subkey', 'by_userid', 'by_name'):
+            setattr(index, name, getattr(self, name).copy())
+        index.added_userids = dict(self.added_userids)
+        index.added_names = dict(self.added_names)
+        index.certs = self.certs.copy()
+        index.added_rows = dict(self.added_rows)
+        index.added_uses = dict(self.added_uses)
+        index.pending = None
+        return index
+
+    def substrings(self):
+        """Return the TrigramIndex of lower-cased user ids.
+
+        The trigram index is built on first use unless it was loaded
+        with the index.
+        """
+        if self.trigrams is None:
+            self.trigrams = TrigramIndex(self.by_userid.keys)
+        return self.trigrams
+
+    def find(self, text, similar=False):
+        """Return (keyid, userid) tuples of user ids containing ``text``.
+
+        If ``similar`` is true and no user id contains ``text``,
+        return user ids sharing most of its trigrams instead.
+        """
+        trigrams = self.substrings()
+        text = text.lower()
+        found = trigrams.search(text)
+        if not found and similar:
+            found = trigrams.similar(text)
+        result = []
+        removed = self.by_userid.removed
+        for i in found:
+            if removed and self.by_userid.keys[i] in removed:
+                continue
+            ref = self.by_userid.refs[i]
+            result.append((self.by_keyid.keys[self.owners[ref]], self.userids[ref]))
+        if self.added_userids:
+            # Few enough to scan
+            added = [(userid.lower(), keyid, userid)
+                     for userid, (keyid, encoding) in self.added_userids.items()
+                     if text in userid.lower()]
+            result.extend((keyid, userid) for lower, keyid, userid in sorted(added))
+        return result
+
+    def encoding(self, text):
+        """Return the source encoding of user id or name ``text``."""
+        for map, codes in ((self.by_userid, self.userid_codes),
+                           (self.by_name, self.name_codes)):
+            ref = map.ref(text.lower())
+            if ref >= 0 and map.values[ref] == text:
+                return self.encodings[codes[ref]]
+        if text in self.added_userids:
+            return self.added_userids[text][1]
+        return self.added_names.get(text)
+
+    def dump(self):
+        """Return the index as tuple of strings for marshalling."""
+        return (tuple(self.encodings),
+                self.userids.dump(), asbytes(self.userid_codes),
+                self.names.dump(), asbytes(self.name_codes), asbytes(self.owners),
+                self.by_keyid.dump(), self.by_userid.dump(), self.by_name.dump(),
+                self.by_longid.dump(), self.by_fingerprint.dump(), self.by_subkey.dump(),
+                self.added_userids, self.added_names, self.certs.dump(),
+                self.trigrams.dump() if self.trigrams is not None else None,
+                self.rows.dump(), asbytes(self.name_uses), self.added_rows, self.added_uses)
+
+    @classmethod
+    def load(cls, state):
+        """Create an index from the result of dump."""
+        index = cls()
+        index.encodings = list(state[0])
+        index.userids = StringTable.load(state[1])
+        index.userid_codes = frombytes('B', state[2])
+        index.names = StringTable.load(state[3])
+        index.name_codes = frombytes('B', state[4])
+        index.owners = frombytes('i', state[5])
+        index.by_keyid = CompactIndex.load(state[6], index.userids)
+        index.by_userid = CompactIndex.load(state[7], index.userids)
+        index.by_name = CompactIndex.load(state[8], index.names)
+        index.by_longid = CompactIndex.load(state[9], index.userids)
+        index.by_fingerprint = CompactIndex.load(state[10], index.userids)
+        index.by_subkey = CompactIndex.load(state[11], index.userids)
+        index.added_userids = state[12]
+        index.added_names = state[13]
+        index.certs = CertificateTable.load(state[14])
+        if state[15] is not None:
+            index.trigrams = TrigramIndex.load(state[15], index.by_userid.keys)
+        index.rows = KeyRows.load(state[16])
+        index.name_uses = frombytes('I', state[17])
+        index.added_rows = state[18]
+        index.added_uses = state[19]
+        return index
+
+
+class KeyIndexBuilder(object):
+    """Collect (keyid, userid) records and build a KeyIndex.
+
+    The first record wins if keys collide.
+    """
+
+    def __init__(self):
+        self.encodings = {}
+        self.userids = {}
+        self.userid_codes = array('B')
+        self.names = {}
+        self.name_codes = array('B')
+        self.owners = []
+        self.by_keyid = {}
+        self.by_longid = {}
+        self.by_fingerprint = {}
+        self.by_subkey = {}
+        self.by_userid = {}
+        self.by_name = {}
+        self.certs = {}
+        self.rows = {}
+        self.name_uses = {}
+        self.pending = None
+
+    def add(self, keyid, userid, encoding, names=()):
+        """Add a record. ``names`` is only consumed if userid is new."""
+        pending = self.pending
+        if pending is None or pending[0] != keyid:
+            # Key id, first user id, whether the key id was added, and
+            # user ids added for the current key
+            pending = self.pending = [keyid, None, False, []]
+        ref = self.userids.get(userid)
+        if ref is None:
+            ref = self.userids[userid] = len(self.userids)
+            code = self.encodings.setdefault(encoding, len(self.encodings))
+            self.userid_codes.append(code)
+            self.owners.append(keyid)
+            lower = userid.lower()
+            new = lower not in self.by_userid
+            if new:
+                self.by_userid[lower] = ref
+                pending[3].append(ref)
+            for name in names:
+                if name not in self.names:
+                    self.names[name] = len(self.names)
+                    self.name_codes.append(code)
+                self.by_name.setdefault(name.lower(), self.names[name])
+                if new:
+                    self.name_uses[name.lower()] = self.name_uses.get(name.lower(), 0) + 1
+        if pending[1] is None:
+            pending[1] = ref
+        if keyid not in self.by_keyid:
+            self.by_keyid[keyid] = pending[1]
+            pending[2] = True
+
+    def add_key(self, keyid, longid, fingerprint, subkeys=()):
+        """Add the long key id, fingerprint, and subkey ids of a key.
+
+        Must be called after the key's user ids have been added.
+        Keys without user ids are ignored. Records added since the
+        previous key are remembered as the rows of certificate
+        ``fingerprint``.
+        """
+        pending, self.pending = self.pending, None
+        if pending is None or pending[0] != keyid:
+            pending = [keyid, self.by_keyid.get(keyid), False, []]
+        ref = pending[1]
+        if ref is not None:
+            self.by_longid.setdefault(longid, ref)
+            added = []
+            if fingerprint:
+                self.by_fingerprint.setdefault(fingerprint, ref)
+            for subkey in subkeys:
+                if subkey not in self.by_subkey:
+                    self.by_subkey[subkey] = ref
+                    added.append(subkey)
+            if fingerprint:
+                self.rows[fingerprint] = (keyid if pending[2] else None, pending[3], added)
+
+    def add_cert(self, fingerprint, digest, checksum):
+        """Remember the digest and content checksum of a certificate."""
+        self.certs[fingerprint] = (digest, checksum)
+
+    def build(self):
+        """Return the KeyIndex. The builder is emptied in the process."""
+        index = KeyIndex()
+        index.encodings = sorted(self.encodings, key=self.encodings.get)
+        index.userids = self.table('userids')
+        index.userid_codes = self.userid_codes
+        index.names = self.table('names')
+        index.name_codes = self.name_codes
+        index.by_keyid = self.compact('by_keyid', index.userids)
+        index.by_longid = self.compact('by_longid', index.userids)
+        index.by_fingerprint = self.compact('by_fingerprint', index.userids)
+        index.by_subkey = self.compact('by_subkey', index.userids)
+        index.by_userid = self.compact('by_userid', index.userids)
+        index.by_name = self.compact('by_name', index.names)
+        positions = dict((x, i) for i, x in enumerate(index.by_keyid.keys))
+        index.owners = array('i', [positions[x] for x in self.owners])
+        self.owners = []
+        fingerprints = sorted(self.certs)
+        index.certs = CertificateTable(StringTable(fingerprints),
+            StringTable([self.certs[x][0] for x in fingerprints]),
+            array('I', [self.certs[x][1] for x in fingerprints]))
+        self.certs = {}
+        subkeys = dict((x, i) for i, x in enumerate(index.by_subkey.keys))
+        for fingerprint in fingerprints:
+            keyid, refs, added = self.rows.get(fingerprint, (None, (), ()))
+            index.rows.append(positions[keyid] if keyid is not None else -1,
+                              refs, [subkeys[x] for x in added])
+        self.rows = {}
+        index.name_uses = array('I', [self.name_uses.get(x, 0) for x in index.by_name.keys])
+        self.name_uses = {}
+        return index
+
+    def table(self, attr):
+        # Release each dict as soon as it is converted to keep peak
+        # memory low.
+        refs = getattr(self, attr)
+        setattr(self, attr, {})
+        strings = [None] * len(refs)
+        for string, ref in refs.items():
+            strings[ref] = string
+        del refs
+        return StringTable(strings)
+
+    def compact(self, attr, values):
+        map = getattr(self, attr)
+        setattr(self, attr, {})
+        keys = sorted(map)
+        refs = array('i', [map[x] for x in keys])
+        del map
+        return CompactIndex(StringTable(keys), refs, values)
+
+
+class TrigramIndex(object):
+    """A substring index over a table of strings.
+
+    Maps each trigram to the sorted list of strings containing it.
+    Strings are padded at the end so that every position starts a
+    trigram and queries shorter than three characters work too.
+    """
+    __slots__ = ('strings', 'grams', 'offsets', 'postings')
+
+    pad = '\0\0'
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+        postings = {}
+        for i, string in enumerate(self.strings):
+            string += self.pad
+            for gram in set(string[j:j+3] for j in range(len(string) - 2)):
+                try:
+                    postings[gram].append(i)
+                except KeyError:
+                    postings[gram] = array('i', [i])
+        grams = sorted(postings)
+        self.grams = StringTable(grams)
+        self.offsets = array('I', [0])
+        self.postings = array('i')
+        for gram in grams:
+            self.postings.extend(postings.pop(gram))
+            self.offsets.append(len(self.postings))
+
+    def posting(self, i):
+        """Return the posting list of trigram number ``i``."""
+        return self.postings[self.offsets[i]:self.offsets[i+1]]
+
+    def candidates(self, text):
+        """Return the sorted indexes of strings that may contain ``text``."""
+        if len(text) < 3:
+            # Union of all trigrams starting with text
+            lo, hi = self.grams.search(text)
+            result = set()
+            for i in range(lo, hi):
+                result.update(self.posting(i))
+            return sorted(result)
+        lists = []
+        for gram in set(text[j:j+3] for j in range(len(text) - 2)):
+            i = self.grams.find(gram)
+            if i < 0:
+                return []
+            lists.append(self.posting(i))
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            other = set(other)
+            result = [x for x in result if x in other]
+            if not result:
+                break
+        return list(result)
+
+    def search(self, text):
+        """Return the indexes of strings containing ``text``."""
+        strings = self.strings
+        return [i for i in self.candidates(text) if text in strings[i]]
+
+    def dump(self):
+        """Return the index without its strings for marshalling."""
+        return (self.grams.dump(), asbytes(self.offsets), asbytes(self.postings))
+
+    @classmethod
+    def load(cls, state, strings):
+        """Create an index of ``strings`` from the result of dump."""
+        index = cls.__new__(cls)
+        index.strings = strings
+        index.grams = StringTable.load(state[0])
+        index.offsets = frombytes('I', state[1])
+        index.postings = frombytes('i', state[2])
+        return index
+
+    def similar(self, text, threshold=0.5):
+        """Return the indexes of strings sharing most trigrams with ``text``.
+
+        Results are ordered by descending number of shared trigrams.
+        """
+        grams = set(text[j:j+3] for j in range(len(text) - 2))
+        if not grams:
+            return []
+        counts = {}
+        for gram in grams:
+            i = self.grams.find(gram)
+            if i >= 0:
+                for x in self.posting(i):
+                    counts[x] = counts.get(x, 0) + 1
+        minimum = max(1, int(len(grams) * threshold + 0.5))
+        result = [x for x in counts if counts[x] >= minimum]
+        result.sort(key=lambda x: (-counts[x], x))
+        return result
@@ -1,9 +1,15 @@
 import os
 import sys
 import re
+import zlib
+import codecs
+import threading
 import subprocess
 
+from rl import completer
 from rl import completion
+from rl import readline
+from rl import print_exc
 
 from gpgkeys.config import GNUPGEXE
 from gpgkeys.config import GNUPGHOME
@@ -11,14 +17,33 @@ from gpgkeys.config import GNUPGHOME
 from gpgkeys.utils import getpreferredencoding
 from gpgkeys.utils import decode
 from gpgkeys.utils import encode
-from gpgkeys.utils import char
+from gpgkeys.utils import lrucache
+
+from gpgkeys.keyring import KeyringError
+from gpgkeys.keyring import Certificate
+from gpgkeys.keyring import find_keyring
+from gpgkeys.keyring import read_keyring
+from gpgkeys.keyring import scan_keyring
+
+from gpgkeys.watch import Watcher
+from gpgkeys.timing import timed
+from gpgkeys.timing import current
+from gpgkeys.stats import stats
 
 from kmd.quoting import backslash_dequote_string
 from kmd.quoting import quote_string
 
+from .index import KeyIndex
+from .index import KeyIndexBuilder
+from .index import tobytes
+
+from .snapshot import identity
+from .snapshot import snapshot_file
+from .snapshot import load_snapshot
+from .snapshot import save_snapshot
+
 keyid_re = re.compile(r'^[0-9A-F]+$', re.I)
 userid_re = re.compile(r'^(.+?)\s*(?:\((.*)\))*\s*(?:<(.*)>)*$')
-unescape_re = re.compile(br'([\\]x[0-9a-f]{2})')
 
 
 def unescape(text):
@@ -27,13 +52,11 @@ def unescape(text):
     The string is quoted like a C string to avoid control characters.
     The colon is encoded as '\x3a'.
     """
-    seen = {}
-    for m in unescape_re.finditer(text):
-        for g in m.groups():
-            if g not in seen:
-                text = text.replace(g, char(int(g[2:], 16)))
-                seen[g] = True
-    return text
+    # GnuPG escapes all special characters, including the backslash,
+    # as \xNN so we can decode them in a single pass.
+    if b'\\' not in text:
+        return text
+    return codecs.escape_decode(text)[0]
 
 
 def gpgdecode(text):
@@ -42,18 +65,47 @@ def gpgdecode(text):
     Returns decoded string and source encoding.
     """
     try:
-        encoding = 'utf-8'
+        # Covers ASCII which is by far the most common case
+        return text.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        encoding = 'latin-1'
         text = decode(text, encoding, errors='strict')
     except UnicodeDecodeError:
-        try:
-            encoding = 'latin-1'
-            text = decode(text, encoding, errors='strict')
-        except UnicodeDecodeError:
-            encoding = getpreferredencoding()
-            text = decode(text, encoding)
+        encoding = getpreferredencoding()
+        text = decode(text, encoding)
     return text, encoding
 
 
+@lrucache(8192)
+def decode_userid(text, escaped=True):
+    """Decode a user id, unescaping it first if ``escaped`` is true.
+
+    Returns user id and source encoding. Results are cached since user
+    ids tend to repeat in signature listings.
+    """
+    if escaped:
+        text = unescape(text)
+    userid, encoding = gpgdecode(text)
+    if sys.version_info[0] < 3:
+        userid = encode(userid)
+    return userid, encoding
+
+
+def hexstring(text):
+    """Convert a hex field of ``gpg --with-colons`` output to native string."""
+    return str(text.decode('ascii')).upper()
+
+
+def checksum(cert):
+    """Return a checksum of the indexed content of ``cert``."""
+    fields = [cert.longid] + list(cert.subkeys)
+    for userid, encoding in cert.userids:
+        fields.extend((userid, encoding))
+    return zlib.crc32(tobytes('\0'.join(fields))) & 0xffffffff
+
+
 class KeyCompletion(object):
     """Perform key id and user name completion
 
@@ -61,102 +113,443 @@ class KeyCompletion(object):
     its completion cache.
     """
 
+    # Seconds to wait for a warmup in progress
+    warmup_timeout = 1.0
+
+    # Complete user ids by substring if nothing else matches
+    substring = False
+
+    # Format at most this many matches per completion; the rest
+    # are produced when the user asks to display all of them
+    max_matches = 100
+
+    # Seconds a completion may wait for a cache refresh before it
+    # answers from the previous cache; None waits for the refresh
+    latency_budget = None
+
+    # Rebuild the cache instead of patching it if more certificates
+    # changed, or if more records would be kept outside the compact
+    # tables
+    max_patch = 100
+    max_delta = 1000
+
+    # The gpg command listing the keys
+    listing = '--list-keys'
+
+    # Name in completion statistics
+    name = 'key'
+
+    # Files in GNUPGHOME which invalidate the cache when changed
+    watched = ('pubring.kbx', 'pubring.gpg', 'gpg.conf', 'common.conf', 'public-keys.d')
+
     def __init__(self):
-        self.pubring = os.path.join(GNUPGHOME, 'pubring.gpg')
-        self.secring = os.path.join(GNUPGHOME, 'secring.gpg')
-        self.mtimes = (0, 0)
-        self.encodings = {}
-        self.by_keyid = {}
-        self.by_userid = {}
-        self.by_name = {}
+        self.home = GNUPGHOME
+        self.snapshot = snapshot_file(GNUPGHOME)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.watcher = None
+        self.index = KeyIndex()
+        self.omitted = None
+
+    @property
+    def by_keyid(self):
+        return self.index.by_keyid
+
+    @property
+    def by_longid(self):
+        return self.index.by_longid
+
+    @property
+    def by_fingerprint(self):
+        return self.index.by_fingerprint
+
+    @property
+    def by_subkey(self):
+        return self.index.by_subkey
+
+    @property
+    def by_userid(self):
+        return self.index.by_userid
+
+    @property
+    def by_name(self):
+        return self.index.by_name
 
     def __call__(self, text):
-        self.update()
-        self.quote_results = False
-        matches = []
-        if not text or keyid_re.match(text):
-            matches = self.complete(self.by_keyid, text.upper())
-        if not matches:
-            if completion.found_quote:
-                text = backslash_dequote_string(text, completion.quote_character)
-            if completion.quote_character:
-                matches = self.complete(self.by_userid, text.lower())
+        with stats.measure(self.name):
+            self.refresh()
+            # A warmup may swap in a new index at any time
+            index = self.index
+            self.quote_results = False
+            self.omitted = None
+            matches = []
+            if not text or keyid_re.match(text):
+                matches = self.complete_keyid(index, text.upper())
             if not matches:
-                matches = self.complete(self.by_name, text.lower())
-            if not matches and not completion.quote_character and completion.found_quote:
-                matches = self.complete(self.by_userid, text.lower())
-        single_match = len(matches) == 1
-        if single_match:
-            matches = [self.recode(x) for x in matches]
+                if completion.found_quote:
+                    text = backslash_dequote_string(text, completion.quote_character)
+                if completion.quote_character:
+                    matches = self.complete(index, index.by_userid, text.lower())
+                if not matches:
+                    matches = self.complete(index, index.by_name, text.lower())
+                if not matches and not completion.quote_character and completion.found_quote:
+                    matches = self.complete(index, index.by_userid, text.lower())
+                if not matches and self.substring and text:
+                    matches = self.complete_substring(index, text)
+            single_match = len(matches) == 1
+            if single_match:
+                matches = [self.recode(index, x) for x in matches]
+            if self.quote_results:
+                matches = [quote_string(x, single_match, completion.quote_character)
+                           for x in matches]
+            return matches
+
+    def complete(self, index, map, text):
+        count = map.count(text)
+        if count > self.max_matches:
+            # Readline inserts the longest common prefix of the matches,
+            # which for sorted matches is that of the first and the last.
+            self.omitted = (count, lambda: [self.format(index, map, x) for x in map.startswith(text)])
+            keys = map.head(text, self.max_matches - 1) + [map.last(text)]
+        else:
+            keys = map.startswith(text)
+        return [self.format(index, map, x) for x in keys]
+
+    def complete_keyid(self, index, text):
+        # Short key ids come first; longer input falls through to
+        # long key ids, fingerprints, and subkey ids
+        for map in (index.by_keyid, index.by_longid, index.by_fingerprint, index.by_subkey):
+            matches = self.complete(index, map, text)
+            if matches:
+                return matches
+        return []
+
+    def complete_substring(self, index, text):
+        found = index.find(text)
+        if len(found) > self.max_matches:
+            self.omitted = (len(found), lambda: [userid for keyid, userid in found])
+            matches = [userid for keyid, userid in found[:self.max_matches - 1] + found[-1:]]
+        else:
+            matches = [userid for keyid, userid in found]
+        if completion.completion_type != '?':
+            self.quote_results = True
+        return matches
+
+    def expand(self):
+        """Return all matches of a completion cut short by max_matches."""
+        count, produce = self.omitted
+        matches = produce()
         if self.quote_results:
-            matches = [quote_string(x, single_match, completion.quote_character)
+            matches = [quote_string(x, False, completion.quote_character)
                        for x in matches]
-        return matches
+        return sorted(set(matches))
 
-    def complete(self, map, text):
-        return [self.format(map, x) for x in map if x.startswith(text)]
+    @print_exc
+    def display_matches(self, substitution, matches, longest_match_length):
+        """Display completion matches.
 
-    def format(self, map, text):
-        if map is self.by_keyid:
-            if completion.completion_type == '?':
-                text = '%s %s' % map[text]
-        else:
+        Works like readline's builtin display but reports the total
+        number of matches, and only produces omitted matches if the
+        user wants to see all possibilities.
+        """
+        num_matches = len(matches)
+        if self.omitted is not None:
+            num_matches = self.omitted[0]
+        if num_matches >= completer.query_items > 0:
+            sys.stdout.write('\nDisplay all %d possibilities? (y or n)' % num_matches)
+            sys.stdout.flush()
+            while True:
+                c = readline.read_key()
+                if c in 'yY ':
+                    break
+                if c in 'nN\x7f':
+                    sys.stdout.write('\n')
+                    completion.redisplay(force=True)
+                    return
+        if self.omitted is not None:
+            matches = self.expand()
+            longest_match_length = max(len(x) for x in matches)
+        completion.display_match_list(substitution, matches, longest_match_length)
+        completion.redisplay(force=True)
+
+    def format(self, index, map, text):
+        if map is index.by_userid or map is index.by_name:
             text = '%s' % map[text]
             if completion.completion_type != '?':
                 self.quote_results = True
+        else:
+            if completion.completion_type == '?':
+                text = '%s %s' % (text, map[text])
         return text
 
+    def warmup(self):
+        """Start updating the completion cache in a background thread."""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._warmup, name='gpgkeys-warmup')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _warmup(self):
+        try:
+            self.update()
+        except Exception:
+            # The next foreground update will report the problem
+            pass
+
+    def wait(self, timeout=None):
+        """Wait for a warmup in progress.
+
+        Returns False if the warmup is still running after ``timeout``
+        seconds, True otherwise.
+        """
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+            self.thread = None
+        return True
+
+    def refresh(self):
+        """Bring the completion cache up to date.
+
+        With a latency budget, a refresh taking longer than the budget
+        completes in a background thread while completions keep using
+        the previous cache.
+        """
+        budget = self.latency_budget
+        if budget is None or not len(self.index):
+            if self.wait(self.warmup_timeout):
+                self.update()
+        elif self.wait(budget) and self.changed():
+            self.warmup()
+            self.wait(budget)
+
+    def close(self):
+        """Release the keyring watcher."""
+        with self.lock:
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+
+    def changed(self):
+        """Return True if the keyrings changed since the last update."""
+        with self.lock:
+            if self.watcher is None:
+                self.watcher = Watcher(self.home, self.watched)
+            return self.watcher.changed()
+
+    @timed('refresh')
     def update(self):
-        mtimes = (os.stat(self.pubring).st_mtime, os.stat(self.secring).st_mtime)
-        if self.mtimes != mtimes:
-            self.encodings = {}
-            self.by_keyid = {}
-            self.by_userid = {}
-            self.by_name = {}
-            for keyid, userid in self.read_keys():
-                self.by_keyid.setdefault(keyid, (keyid, userid))
-                self.by_userid.setdefault(userid.lower(), userid)
-                for name in self.parse_names(userid):
-                    self.by_name.setdefault(name.lower(), name)
-            self.mtimes = mtimes
+        name = self.name + '.update'
+        with stats.measure(name), self.lock:
+            if self.watcher is None:
+                self.watcher = Watcher(self.home, self.watched)
+            if self.watcher.changed():
+                stats.count(name, 'misses')
+                timing = current()
+                if timing is not None:
+                    timing.updates.append(self.name)
+                self.load()
+                self.watcher.reset()
+            else:
+                stats.count(name, 'hits')
+
+    def load(self):
+        # Snapshots can only be validated against the default keyring
+        keyring = find_keyring(self.home)
+        ident = keyring and identity(keyring)
+        if not ident:
+            self.rebuild()
+        elif self.patch(keyring):
+            self.save_snapshot(ident)
+        elif not self.load_snapshot(ident):
+            self.rebuild()
+            self.save_snapshot(ident)
+        elif self.substring and self.index.trigrams is None:
+            self.index.substrings()
+            self.save_snapshot(ident)
+
+    def find(self, text, similar=False):
+        """Return (keyid, userid) tuples of user ids containing ``text``.
+
+        If ``similar`` is true and nothing matches, return similar
+        user ids instead.
+        """
+        self.wait()
+        self.update()
+        return self.index.find(text, similar)
+
+    def rebuild(self):
+        stats.count(self.name + '.update', 'rebuilds')
+        builder = KeyIndexBuilder()
+        for cert in self.read_keys():
+            keyid = cert.keyid
+            for userid, encoding in cert.userids:
+                builder.add(keyid, userid, encoding, self.parse_names(userid))
+            builder.add_key(keyid, cert.longid, cert.fingerprint, cert.subkeys)
+            if cert.digest is not None:
+                builder.add_cert(cert.fingerprint, cert.digest, checksum(cert))
+        index = builder.build()
+        if self.substring:
+            # Substring completion needs the trigram index on the first
+            # TAB; build it now so it is saved with the snapshot.
+            # Otherwise find builds it when first used.
+            index.substrings()
+        self.index = index
+
+    def patch(self, keyring):
+        """Apply changes of ``keyring`` to the current index.
+
+        Only certificates whose keyring data changed are parsed.
+        Certificates which were removed are removed from the index,
+        certificates whose user ids or subkeys changed are removed and
+        added again. Returns False if the index needs a rebuild instead,
+        i.e. if too many certificates changed or too many records have
+        accumulated outside the compact tables.
+        """
+        index = self.index
+        certs = index.certs
+        if not len(certs):
+            return False
+        known = certs.known()
+        seen = set()
+        added = []
+        changed = []
+        updated = []
+        try:
+            for digest, cert in scan_keyring(keyring, known):
+                if cert is None:
+                    seen.add(known[digest])
+                    continue
+                cert.userids = [decode_userid(x, False) for x in cert.userids]
+                old = certs.checksum(cert.fingerprint)
+                if old is None:
+                    added.append(cert)
+                    continue
+                seen.add(cert.fingerprint)
+                if old == checksum(cert):
+                    updated.append(cert)
+                else:
+                    changed.append(cert)
+        except (KeyringError, EnvironmentError, ValueError):
+            return False
+        removed = set(known.values()) - seen
+        if len(added) + len(changed) + len(removed) > self.max_patch:
+            return False
+        count = (len(index.added_userids) + len(index.by_userid.removed) + len(removed) +
+                 sum(len(x.userids) for x in added + changed))
+        if count > self.max_delta:
+            return False
+        # Completions may be reading the current index
+        index = index.copy()
+        certs = index.certs
+        for cert in updated:
+            certs.add(cert.fingerprint, cert.digest, checksum(cert))
+        for fingerprint in sorted(removed) + [x.fingerprint for x in changed]:
+            self.remove_cert(index, Certificate(fingerprint))
+        for cert in added + changed:
+            keyid = cert.keyid
+            for userid, encoding in cert.userids:
+                index.add(keyid, userid, encoding, self.parse_names(userid))
+            index.add_key(keyid, cert.longid, cert.fingerprint, cert.subkeys)
+            certs.add(cert.fingerprint, cert.digest, checksum(cert))
+        self.index = index
+        return True
+
+    def remove_cert(self, index, cert):
+        """Remove certificate ``cert`` from ``index``.
+
+        Names are removed when no remaining user id contains them.
+        """
+        for userid in index.remove_key(cert.fingerprint, cert.longid):
+            index.release_names(self.parse_names(userid))
+        index.certs.remove(cert.fingerprint)
+
+    def load_snapshot(self, ident):
+        data = load_snapshot(self.snapshot, ident)
+        if data is None:
+            return False
+        try:
+            self.index = KeyIndex.load(data)
+        except (TypeError, ValueError, IndexError):
+            return False
+        return True
+
+    def save_snapshot(self, ident):
+        return save_snapshot(self.snapshot, ident, self.index.dump())
 
     def read_keys(self):
-        process = subprocess.Popen(GNUPGEXE+' --list-keys --with-colons --fixed-list-mode',
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdoutdata, stderrdata = process.communicate()
-        return self.parse_keys(stdoutdata)
+        keyring = find_keyring(self.home)
+        if keyring is not None:
+            # Read the keyring directly if we can
+            try:
+                return list(self.parse_keyring(keyring))
+            except (KeyringError, EnvironmentError, ValueError):
+                pass
+        return self.list_keys()
+
+    def list_keys(self):
+        # Stream the listing so memory stays bounded and indexing
+        # overlaps with gpg producing output.
+        devnull = open(os.devnull, 'wb')
+        try:
+            process = subprocess.Popen(GNUPGEXE+' %s --with-colons --with-fingerprint --fixed-list-mode' % self.listing,
+                shell=True, stdout=subprocess.PIPE, stderr=devnull, bufsize=65536)
+        finally:
+            devnull.close()
+        try:
+            for record in self.parse_keys(process.stdout):
+                yield record
+        finally:
+            process.stdout.close()
+            process.wait()
 
-    def parse_keys(self, stdoutdata):
-        # Process stdoutdata as byte string since we must run
+    def parse_keys(self, lines):
+        # Process lines as byte strings since we must run
         # unescape before decoding.
-        keyid = ''
-        key_enc = ''
-        for line in stdoutdata.strip().split(b'\n'):
-            if line[:3] == b'pub':
+        cert = None
+        for line in lines:
+            if line[:3] in (b'pub', b'sec'):
+                if cert is not None:
+                    yield cert
+                fields = line.split(b':')
+                cert = None
+                if self.usable(fields):
+                    cert = Certificate('', hexstring(fields[4]))
+            elif cert is None:
+                continue
+            elif line[:3] == b'fpr':
+                # The first fpr record belongs to the primary key
+                if not cert.fingerprint:
+                    fields = line.split(b':')
+                    cert.fingerprint = hexstring(fields[9])
+            elif line[:3] == b'uid':
                 fields = line.split(b':')
-                keyid = fields[4][8:]
-                keyid, key_enc = gpgdecode(keyid)
-                if sys.version_info[0] < 3:
-                    keyid = encode(keyid)
-            if line[:3] == b'uid':
+                cert.userids.append(decode_userid(fields[9]))
+            elif line[:3] in (b'sub', b'ssb'):
                 fields = line.split(b':')
-                userid = unescape(fields[9])
-                userid, user_enc = gpgdecode(userid)
-                if sys.version_info[0] < 3:
-                    userid = encode(userid)
-                self.encodings.setdefault(userid, user_enc)
-                yield (keyid, userid)
+                cert.subkeys.append(hexstring(fields[4]))
+        if cert is not None:
+            yield cert
+
+    def usable(self, fields):
+        return True
+
+    def parse_keyring(self, keyring):
+        for cert in read_keyring(keyring):
+            cert.userids = [decode_userid(x, False) for x in cert.userids]
+            yield cert
 
     def parse_names(self, userid):
         m = userid_re.match(userid)
         if m is not None:
             for name in m.group(1).split():
                 if len(name) > 1 and not (len(name) == 2 and name[-1] == '.'):
-                    self.encodings.setdefault(name, self.encodings[userid])
                     yield name
 
-    def recode(self, text):
-        encoding = self.encodings.get(text)
+    def recode(self, index, text):
+        encoding = index.encoding(text)
         if encoding is None:
             return text
         if sys.version_info[0] >= 3:
@@ -165,3 +558,34 @@ class KeyCompletion(object):
         else:
             return encode(decode(text), encoding)
 
+
+
+class SecretKeyCompletion(KeyCompletion):
+    """Perform secret key id and user name completion
+
+    Offers only keys which can make signatures. Watches the secret
+    keyring and private key directory for changes.
+    """
+
+    listing = '--list-secret-keys'
+
+    name = 'secretkey'
+
+    watched = ('pubring.kbx', 'pubring.gpg', 'secring.gpg', 'private-keys-v1.d', 'gpg.conf',
+               'common.conf', 'public-keys.d')
+
+    def load(self):
+        # There are few secret keys, listing them is cheap
+        self.rebuild()
+
+    def read_keys(self):
+        return self.list_keys()
+
+    def usable(self, fields):
+        # Skip expired, revoked, invalid, and disabled keys, keys
+        # whose primary secret key is a stub, and keys which can
+        # neither sign nor certify
+        if fields[1][:1] in (b'e', b'r', b'i', b'd') or fields[14:15] == [b'#']:
+            return False
+        capabilities = fields[11] if len(fields) > 11 else b''
+        return b's' in capabilities or b'c' in capabilities
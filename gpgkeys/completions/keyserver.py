@@ -1,6 +1,8 @@
 import os
 
 from gpgkeys.config import GNUPGCONF
+from gpgkeys.watch import Watcher
+from gpgkeys.stats import stats
 
 
 class KeyserverCompletion(object):
@@ -12,18 +14,30 @@ class KeyserverCompletion(object):
 
     def __init__(self):
         self.gpgconf = GNUPGCONF
-        self.mtime = 0
+        self.watcher = None
         self.servers = []
 
     def __call__(self, text):
         self.update()
         return [x for x in self.servers if x.startswith(text)]
 
+    def close(self):
+        """Release the gpg.conf watcher."""
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
     def update(self):
-        mtime = os.stat(self.gpgconf).st_mtime
-        if self.mtime != mtime:
-            self.mtime = mtime
-            self.servers = list(self.read_servers())
+        with stats.measure('keyserver.update'):
+            if self.watcher is None:
+                directory, name = os.path.split(self.gpgconf)
+                self.watcher = Watcher(directory, (name,))
+            if self.watcher.changed():
+                stats.count('keyserver.update', 'misses')
+                self.servers = list(self.read_servers())
+                self.watcher.reset()
+            else:
+                stats.count('keyserver.update', 'hits')
 
     def read_servers(self):
         if os.path.isfile(self.gpgconf):
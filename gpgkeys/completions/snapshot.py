@@ -0,0 +1,96 @@
+"""Persist the key completion cache across sessions.
+
+Snapshots are stored in $XDG_CACHE_HOME/gpgkeys and are only
+valid as long as the keyring files they were built from have not
+changed. Keyring files are identified by path, inode, size, and
+modification time.
+"""
+
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+
+from gpgkeys.config import CACHEHOME
+from gpgkeys.config import GNUPGHOME
+
+MAGIC = 'gpgkeys-snapshot'
+VERSION = 8
+
+
+def snapshot_file(home=GNUPGHOME):
+    """Return the snapshot filename for GnuPG home directory ``home``."""
+    if sys.version_info[0] >= 3:
+        home = home.encode('utf-8', 'surrogateescape')
+    digest = hashlib.sha1(home).hexdigest()
+    return os.path.join(CACHEHOME, 'keys-%s.snapshot' % digest[:16])
+
+
+def identity(*filenames):
+    """Return a tuple identifying the current state of ``filenames``.
+
+    Files that do not exist are included as such.
+    """
+    result = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            result.append((filename, 0, 0, 0.0))
+        else:
+            result.append((filename, st.st_ino, st.st_size, st.st_mtime))
+    return tuple(result)
+
+
+def load_snapshot(filename, ident):
+    """Return the data stored in snapshot ``filename``.
+
+    Returns None if the snapshot does not exist, is corrupt, was written
+    by a different version, or does not match ``ident``.
+    """
+    try:
+        f = open(filename, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        try:
+            # Much faster than marshal.load(f)
+            magic, version, saved, data = marshal.loads(f.read())
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    if magic != MAGIC or version != VERSION or saved != ident:
+        return None
+    return data
+
+
+def save_snapshot(filename, ident, data):
+    """Atomically write ``data`` to snapshot ``filename``.
+
+    Returns True on success, False otherwise.
+    """
+    dirname = os.path.dirname(filename) or os.curdir
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        fd, tempname = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    except (IOError, OSError):
+        return False
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump((MAGIC, VERSION, ident, data), f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tempname, filename)
+    except (IOError, OSError, ValueError):
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+        return False
+    return True
@@ -12,3 +12,7 @@ GNUPGHOME = os.environ.get('GNUPGHOME', '~/.gnupg')
 GNUPGHOME = os.path.abspath(os.path.expanduser(GNUPGHOME))
 
 GNUPGCONF = os.path.join(GNUPGHOME, 'gpg.conf')
+
+CACHEHOME = os.environ.get('XDG_CACHE_HOME', '~/.cache')
+CACHEHOME = os.path.abspath(os.path.expanduser(CACHEHOME))
+CACHEHOME = os.path.join(CACHEHOME, 'gpgkeys')
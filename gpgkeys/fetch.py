@@ -0,0 +1,193 @@
+"""Fetch keys from HKP keyservers concurrently."""
+
+from __future__ import absolute_import
+
+import os
+import re
+import time
+import socket
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import URLError
+    from urllib.error import HTTPError
+    from urllib.parse import urlsplit
+except ImportError:
+    from urllib2 import urlopen
+    from urllib2 import URLError
+    from urllib2 import HTTPError
+    from urlparse import urlsplit
+
+from .utils import parallel_map
+
+# The keyserver used if none is configured
+DEFAULT_KEYSERVER = 'hkps://keys.openpgp.org'
+
+# Keyserver schemes and their HTTP scheme and default port
+SCHEMES = {
+    'hkp': ('http', 11371),
+    'hkps': ('https', 443),
+    'http': ('http', 80),
+    'https': ('https', 443),
+}
+
+# Screening fetched keys needs --import-options show-only
+SHOW_ONLY_VERSION = (2, 1, 14)
+
+version_re = re.compile(br'^gpg \(GnuPG[^)]*\) (\d+)\.(\d+)\.(\d+)', re.M)
+
+keyid_re = re.compile(r'^(0x)?([0-9A-F]{8}|[0-9A-F]{16}|[0-9A-F]{32}|[0-9A-F]{40}|[0-9A-F]{64})$', re.I)
+
+
+class FetchError(Exception):
+    """Fetching a key failed."""
+
+
+def keyserver_url(keyserver):
+    """Return the HTTP base URL of ``keyserver``."""
+    if '://' not in keyserver:
+        keyserver = 'hkp://' + keyserver
+    parts = urlsplit(keyserver)
+    if parts.scheme not in SCHEMES or not parts.hostname:
+        raise FetchError('unsupported keyserver: %s' % keyserver)
+    scheme, port = SCHEMES[parts.scheme]
+    host = parts.hostname
+    if ':' in host:
+        host = '[%s]' % host
+    return '%s://%s:%d' % (scheme, host, parts.port or port)
+
+
+def find_keyserver(home):
+    """Return the keyserver configured in ``home`` or the default."""
+    keyserver = None
+    for name in ('gpg.conf', 'dirmngr.conf'):
+        filename = os.path.join(home, name)
+        if os.path.isfile(filename):
+            with open(filename, 'rt') as f:
+                for line in f:
+                    tokens = line.split()
+                    if len(tokens) > 1 and tokens[0] == 'keyserver':
+                        keyserver = tokens[1]
+        if keyserver is not None:
+            return keyserver
+    return DEFAULT_KEYSERVER
+
+
+def normalize(keyid):
+    """Return ``keyid`` as 0x-prefixed upper-case hex string."""
+    keyid = keyid.replace(' ', '')
+    m = keyid_re.match(keyid)
+    if m is None:
+        raise FetchError('not a key id or fingerprint')
+    return '0x' + m.group(2).upper()
+
+
+def gnupg_version(output):
+    """Return the version in ``gpg --version`` output as tuple of ints.
+
+    Returns an empty tuple if the version cannot be found.
+    """
+    m = version_re.search(output)
+    if m is None:
+        return ()
+    return tuple(int(x) for x in m.groups())
+
+
+def fingerprints(listing):
+    """Return the primary key fingerprints in gpg's colon ``listing``."""
+    result = []
+    primary = False
+    for line in listing.split(b'\n'):
+        fields = line.split(b':')
+        if fields[0] == b'pub':
+            primary = True
+        elif fields[0] == b'fpr' and primary and len(fields) > 9:
+            result.append(fields[9].decode('ascii').upper())
+            primary = False
+    return result
+
+
+def screen(keyid, listing):
+    """Check that the colon ``listing`` of fetched key data holds the
+    key ``keyid`` and nothing else.
+
+    Raises FetchError otherwise.
+    """
+    found = fingerprints(listing)
+    if not found:
+        raise FetchError('no key data')
+    if len(found) > 1:
+        raise FetchError('keyserver returned %d keys' % len(found))
+    if not found[0].endswith(normalize(keyid)[2:]):
+        raise FetchError('keyserver returned key %s' % found[0])
+
+
+class Fetcher(object):
+    """Fetch keys from an HKP keyserver on a pool of threads.
+
+    Failed requests are retried with exponential backoff unless the
+    keyserver reports that the key does not exist.
+    """
+
+    # Seconds to wait for a keyserver response
+    timeout = 30.0
+
+    # Number of retries after the first attempt
+    retries = 3
+
+    # Seconds before the first retry, doubled for every further retry
+    backoff = 0.5
+
+    def __init__(self, keyserver, workers=4):
+        self.url = keyserver_url(keyserver)
+        self.workers = workers
+
+    def fetch_all(self, keyids):
+        """Yield (keyid, data, error) for each of ``keyids`` in order.
+
+        ``data`` is the armored key or None if ``error`` describes
+        why fetching failed.
+        """
+        return parallel_map(self.try_fetch, keyids, self.workers)
+
+    def try_fetch(self, keyid):
+        try:
+            return keyid, self.fetch(keyid), None
+        except FetchError as e:
+            return keyid, None, str(e)
+
+    def fetch(self, keyid):
+        """Return the armored key ``keyid``.
+
+        Raises FetchError if the key cannot be fetched.
+        """
+        search = normalize(keyid)
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                return self.get(search)
+            except HTTPError as e:
+                if e.code == 404:
+                    raise FetchError('not found')
+                if e.code < 500 and e.code != 429:
+                    raise FetchError('HTTP error %d' % e.code)
+                error = 'HTTP error %d' % e.code
+            except URLError as e:
+                error = str(e.reason)
+            except (socket.error, socket.timeout) as e:
+                error = str(e) or e.__class__.__name__
+        raise FetchError(error)
+
+    def get(self, search):
+        url = '%s/pks/lookup?op=get&options=mr&search=%s' % (self.url, search)
+        response = urlopen(url, timeout=self.timeout)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+        if b'-----BEGIN PGP PUBLIC KEY BLOCK-----' not in data:
+            raise FetchError('no key data')
+        return data
@@ -16,27 +16,64 @@ __version__ = pkg_resources.get_distribution('gpgkeys').version
 
 import os
 import sys
+import copy
 import getopt
+import tempfile
 import subprocess
 import kmd
 import term
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from rl import completer
+
 from .parser import splitargs
 from .parser import parseargs
+from .parser import splitcommand
+from .parser import splitbackground
 from .parser import parseword
+from .parser import dequote
+from .parser import quote
 
 from .utils import decode
 from .utils import surrogateescape
 from .utils import ignoresignals
 from .utils import savettystate
 from .utils import conditional
+from .utils import getargmax
+from .utils import chunkargs
+from .utils import parallel_map
 
 from kmd.completions import FilenameCompletion
 from kmd.completions import CommandCompletion
 from .completions import KeyCompletion
+from .completions import SecretKeyCompletion
 from .completions import KeyserverCompletion
 
+from .fetch import Fetcher
+from .fetch import FetchError
+from .fetch import find_keyserver
+from .fetch import fingerprints
+from .fetch import screen
+from .fetch import normalize
+from .fetch import gnupg_version
+from .fetch import SHOW_ONLY_VERSION
+
+from .jobs import Job
+
+from .timing import Timing
+from .timing import Process
+from .timing import current
+
+from .stats import stats
+
+from .trace import Trace
+
 from .config import GNUPGEXE
+from .config import GNUPGHOME
 from .config import UMASK
 
 GLOBAL  = []
@@ -51,6 +88,7 @@ SERVER  = ['--keyserver']
 EXPERT  = ['--expert']
 SECRET  = ['--secret']
 DELETE  = ['--secret-and-public']
+STATS   = ['--json']
 
 
 class GPGKeys(kmd.Kmd):
@@ -69,13 +107,28 @@ class GPGKeys(kmd.Kmd):
     doc_header = 'Available commands (type help <topic>):'
     alias_header = 'Shortcut commands (type help <topic>):'
 
+    # Bytes available for a gpg command line; None asks the system
+    arg_max = None
+
+    # Records every command if not None
+    trace = None
+
     def __init__(self, completekey='TAB', stdin=None, stdout=None, stderr=None,
-                 quote_char='\\', verbose=False):
+                 quote_char='\\', verbose=False, substring=False, budget=None, jobs=1,
+                 timing=False):
         super(GPGKeys, self).__init__(completekey, stdin, stdout, stderr)
         self.quote_char = quote_char
         self.verbose = verbose
+        self.jobs = jobs
+        self.timing = timing
+        self.completekeyid = KeyCompletion()
+        self.completekeyid.substring = substring
+        self.completekeyid.latency_budget = budget
+        self.completesecretkeyid = SecretKeyCompletion()
+        self.completesecretkeyid.latency_budget = budget
         self.is_looping = False
         self.rc = 0
+        self.bgjobs = []
         self.aliases['e'] = 'edit'
         self.aliases['ls'] = 'list'
         self.aliases['ll'] = 'listsig'
@@ -87,11 +140,22 @@ class GPGKeys(kmd.Kmd):
         # Setup completions
         self.completefilename = FilenameCompletion(self.quote_char)
         self.completecommand = CommandCompletion()
-        self.completekeyid = KeyCompletion()
         self.completekeyserver = KeyserverCompletion()
+        # Build the key cache while the user is typing
+        self.warmup()
+
+    def warmup(self):
+        """Update the key caches in the background."""
+        if self.completekey and self.use_rawinput and self.stdin.isatty():
+            self.completekeyid.warmup()
+            self.completesecretkeyid.warmup()
 
     def postloop(self):
         self.is_looping = False
+        # Release inotify descriptors; preloop replaces the completers
+        self.completekeyid.close()
+        self.completesecretkeyid.close()
+        self.completekeyserver.close()
         super(GPGKeys, self).postloop()
 
     def input(self, prompt):
@@ -102,32 +166,594 @@ class GPGKeys(kmd.Kmd):
 
     def onecmd(self, line):
         self.rc = 0
+        command, background = splitbackground(line)
+        # Shell escapes keep the '&' so /bin/sh runs them in the background
+        if background and self.commandname(command)[0] != 'shell':
+            return self.startjob(command)
+        if (self.timing or self.trace) and line.strip() and current() is None:
+            if self.commandname(line)[0] != 'time':
+                return self.timecmd(line, self.timing)
         return super(GPGKeys, self).onecmd(line)
 
+    def postcmd(self, stop, line):
+        self.reportjobs()
+        return stop
+
+    def complete(self, text, state):
+        if state == 0:
+            # Forget matches omitted by the previous completion
+            self.completekeyid.omitted = None
+            self.completesecretkeyid.omitted = None
+        match = super(GPGKeys, self).complete(text, state)
+        if state == 0 and self.completekey and self.use_rawinput:
+            self.setdisplayhook()
+        return match
+
+    def setdisplayhook(self):
+        """Display matches ourselves only if key matches were omitted.
+
+        Everything else keeps readline's display and paging.
+        """
+        if self.completekeyid.omitted is None and self.completesecretkeyid.omitted is None:
+            completer.display_matches_hook = None
+        else:
+            completer.display_matches_hook = self.display_matches
+
+    def display_matches(self, substitution, matches, longest_match_length):
+        """Display key matches with the completer which found them."""
+        keycompletion = self.completekeyid
+        if self.completesecretkeyid.omitted is not None:
+            keycompletion = self.completesecretkeyid
+        keycompletion.display_matches(substitution, matches, longest_match_length)
+
     def run(self, args=None):
+        if args is None:
+            args = sys.argv[1:]
+        if not args and not self.stdin.isatty():
+            try:
+                if self.stdin is sys.stdin:
+                    # Allow surrogates in input like self.input does
+                    try:
+                        with surrogateescape():
+                            self.stdin = sys.stdin
+                            rcs = self.batch(self.stdin)
+                    finally:
+                        self.stdin = sys.stdin
+                else:
+                    rcs = self.batch(self.stdin)
+                # Fail if any line failed
+                self.rc = max(rcs or [0])
+            except KeyboardInterrupt:
+                self.stdout.write('\n')
+                self.rc = 1
+            return self.rc
         rc = super(GPGKeys, self).run(args)
         if rc == 1: # KeyboardInterrupt
             self.rc = rc
+        elif self.bgjobs:
+            try:
+                self.rc = self.waitjobs()
+            except KeyboardInterrupt:
+                self.stdout.write('\n')
+                self.rc = 1
         return self.rc
 
+    # Batch mode
+
+    # Commands whose arguments can be combined into one gpg invocation
+    batch_commands = ('recv', 'send', 'export', 'del', 'refresh')
+
+    # The gpg status naming the keys a combined command succeeded for
+    batch_status = {'recv': b'IMPORT_OK', 'refresh': b'IMPORT_OK', 'export': b'EXPORTED'}
+
+    # gpg status lines are collected here if not None
+    gpgstatus = None
+
+    # False while commands are read from stdin, which @- would consume
+    stdinargs = True
+
+    def batch(self, lines):
+        """Execute command lines read from a file or pipe.
+
+        Consecutive commands of the same kind and with the same options
+        are combined into one gpg invocation. Returns the list of
+        per-line return codes. If the invocation fails, combined lines
+        whose key ids gpg reports as received or exported return 0,
+        the others share the return code of the invocation.
+        """
+        rcs = []
+        group = []
+        key = None
+        saved = 0
+        self.is_looping = True
+        self.stdinargs = lines is not sys.stdin and lines is not self.stdin
+        try:
+            for line in lines:
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+                linekey = self.batchkey(line)
+                if group and linekey != key:
+                    rcs.extend(self.runbatch(group))
+                    saved += len(group) - 1
+                    group = []
+                if linekey is not None:
+                    group.append(line)
+                    key = linekey
+                else:
+                    stop = self.onecmd(line)
+                    rcs.append(self.rc)
+                    if stop:
+                        break
+            if group:
+                rcs.extend(self.runbatch(group))
+                saved += len(group) - 1
+            self.waitjobs()
+        finally:
+            self.is_looping = False
+            self.stdinargs = True
+        if self.verbose and saved:
+            self.stderr.write('gpgkeys: %d commands in %d gpg invocations, %d saved\n' % (
+                len(rcs), len(rcs) - saved, saved))
+        return rcs
+
+    def batchkey(self, line):
+        """Return what ``line`` must share with lines it is combined with,
+        or None if it cannot be combined.
+        """
+        name, arg = self.commandname(line)
+        if name not in self.batch_commands:
+            return None
+        args = parseargs(arg)
+        # Separate invocations would overwrite the output file
+        if not args.ok or not args.args or args.pipe or args.output:
+            return None
+        return name, args.options, args.secret, args.secret_and_public
+
+    def runbatch(self, lines):
+        """Execute ``lines`` as one command and return their return codes."""
+        line = lines[0]
+        for x in lines[1:]:
+            cmd, arg, x = self.parseline(x)
+            line += ' ' + ' '.join(parseargs(arg).args)
+        self.gpgstatus = []
+        try:
+            self.onecmd(line)
+        finally:
+            status, self.gpgstatus = self.gpgstatus, None
+        if self.rc == 0:
+            return [0] * len(lines)
+        name = self.commandname(line)[0]
+        keyword = self.batch_status.get(name)
+        found = set()
+        for x in status:
+            fields = x.split()
+            if len(fields) > 2 and fields[1] == keyword:
+                found.add(fields[-1].decode('ascii').upper())
+        return [0 if self.succeeded(x, found) else self.rc for x in lines]
+
+    def succeeded(self, line, fingerprints):
+        """Return True if all key ids of ``line`` are in ``fingerprints``."""
+        args = parseargs(self.commandname(line)[1])
+        if not args.ok or not args.args:
+            return False
+        for arg in args.args:
+            try:
+                keyid = normalize(dequote(arg))[2:]
+            except FetchError:
+                # User ids cannot be told apart
+                return False
+            if not [x for x in fingerprints if x.endswith(keyid)]:
+                return False
+        return True
+
+    def commandname(self, line):
+        """Return the full command name of ``line`` and its arguments.
+
+        The name is None if there is no such command.
+        """
+        cmd, arg, line = self.parseline(line)
+        if not cmd:
+            return None, arg
+        try:
+            func = getattr(self, 'do_' + cmd)
+        except AttributeError:
+            return None, arg
+        return func.__name__[3:], arg
+
+    # Script mode
+
+    # Commands that only read the keyring and may run concurrently
+    readonly_commands = ('list', 'listsig', 'dump', 'fdump', 'export')
+
+    # Maximum number of commands running concurrently
+    script_jobs = 4
+
+    # Concurrent keyserver connections used by recv and refresh;
+    # with 1 gpg fetches the keys
+    jobs = 1
+
+    # Seconds to wait for a keyserver response and number of retries
+    # per key; None uses the Fetcher defaults
+    fetch_timeout = None
+    fetch_retries = None
+
+    # The GnuPG version as tuple of ints; read on first use
+    gnupg_version = None
+
+    def runscript(self, lines):
+        """Execute the command lines of a script.
+
+        Consecutive read-only commands run concurrently, commands which
+        may change the keyring run one at a time in between. Output
+        appears in script order. Returns the return code of the last
+        command.
+
+        All lines are checked before the first one executes; if any
+        line is invalid, nothing is executed and 1 is returned.
+        """
+        lines = [x.rstrip('\r\n') for x in lines]
+        rc = 0
+        for number, line in enumerate(lines, 1):
+            error = self.checkline(line)
+            if error is not None:
+                self.stderr.write('gpgkeys: line %d: %s\n' % (number, error))
+                rc = 1
+        if rc:
+            self.rc = rc
+            return rc
+        lines = [x for x in lines if x.strip()]
+        self.is_looping = True
+        try:
+            i = 0
+            while i < len(lines):
+                group = self.parallelgroup(lines, i)
+                if len(group) > 1:
+                    for shell in parallel_map(self.runcaptured, group, self.script_jobs):
+                        self.writecaptured(shell)
+                        self.rc = shell.rc
+                    i += len(group)
+                else:
+                    stop = self.onecmd(lines[i])
+                    i += 1
+                    if stop:
+                        break
+            self.waitjobs()
+        finally:
+            self.is_looping = False
+        return self.rc
+
+    # Commands which parse their arguments as gpg options
+    parsed_commands = ('genkey', 'genrevoke', 'import', 'export', 'list', 'find',
+                       'listsig', 'checksig', 'edit', 'lsign', 'sign', 'del',
+                       'search', 'recv', 'send', 'refresh', 'fetch', 'dump', 'fdump')
+
+    def checkline(self, line):
+        """Return the error ``line`` would fail with, or None."""
+        line = splitbackground(line)[0]
+        line = self.parseline(line)[2]
+        if not line or line[0] == '#':
+            return None
+        name, arg = self.commandname(line)
+        if name is None:
+            return "unknown command '%s'" % splitargs(line)[0]
+        if name in ('bg', 'time'):
+            return self.checkline(arg)
+        if name in self.parsed_commands:
+            args = parseargs(arg)
+            if not args.ok:
+                return args.error
+        return None
+
+    def parallelgroup(self, lines, start):
+        """Return the lines from ``start`` on which may run concurrently."""
+        group = []
+        reads = set()
+        writes = set()
+        for line in lines[start:]:
+            files = self.parallelfiles(line)
+            if files is None:
+                break
+            # Stop at the first command depending on one in the group
+            if writes.intersection(files[0]) or (reads | writes).intersection(files[1]):
+                break
+            reads.update(files[0])
+            writes.update(files[1])
+            group.append(line)
+        return group
+
+    def parallelfiles(self, line):
+        """Return the files read and written by ``line``, or None if
+        ``line`` must not run concurrently with other commands.
+        """
+        name, arg = self.commandname(line)
+        if name not in self.readonly_commands:
+            return None
+        args = parseargs(arg)
+        # Pipes, redirects, and passphrase prompts need the terminal
+        if not args.ok or args.pipe or args.secret:
+            return None
+        if name == 'fdump':
+            if not args.args:
+                return None
+            return [self.abspath(x) for x in args.args], []
+        if args.output:
+            return [], [self.abspath(args.output)]
+        return [], []
+
+    def abspath(self, filename):
+        return os.path.abspath(os.path.expanduser(dequote(filename)))
+
+    def runcaptured(self, line, detached=False):
+        """Execute ``line`` in a copy of the shell collecting its output.
+
+        If ``detached`` is true, subprocesses do not receive signals
+        from the terminal.
+        """
+        shell = copy.copy(self)
+        shell.stdout = StringIO()
+        shell.stderr = StringIO()
+        shell.captured = []
+        shell.detached = detached
+        shell.bgjobs = []
+        shell.onecmd(line)
+        return shell
+
+    def writecaptured(self, shell):
+        """Write the output collected by runcaptured."""
+        self.stderr.write(shell.stderr.getvalue())
+        self.stdout.write(shell.stdout.getvalue())
+        for stream, data in shell.captured:
+            stream = self.stdout if stream is shell.stdout else self.stderr
+            if data:
+                stream.flush()
+                buffer = getattr(stream, 'buffer', None)
+                if buffer is not None:
+                    buffer.write(data)
+                    buffer.flush()
+                else:
+                    stream.write(decode(data))
+
+    # Job control
+
+    # Commands that prompt for input and cannot run in the background
+    interactive_commands = ('genkey', 'genrevoke', 'edit', 'lsign', 'sign', 'del')
+
+    def startjob(self, line):
+        """Execute ``line`` on a background thread."""
+        name = self.commandname(line)[0]
+        if name in self.interactive_commands:
+            self.stderr.write('gpgkeys: %s cannot run in the background\n' % name)
+            self.rc = 1
+            return
+        if self.captured is not None:
+            # Already in the background
+            return self.onecmd(line)
+        number = max([x.number for x in self.bgjobs] or [0]) + 1
+        job = Job(number, line, self.runjob)
+        self.bgjobs.append(job)
+        job.start()
+        self.stdout.write('[%d] %s\n' % (number, line))
+
+    def runjob(self, line):
+        return self.runcaptured(line, detached=True)
+
+    def findjob(self, spec):
+        """Return the job numbered ``spec`` or the most recent job."""
+        if not spec:
+            return self.bgjobs[-1] if self.bgjobs else None
+        try:
+            number = int(spec.lstrip('%'))
+        except ValueError:
+            return None
+        for job in self.bgjobs:
+            if job.number == number:
+                return job
+
+    def finishjob(self, job, status=True):
+        """Write the output of the completed ``job``."""
+        self.bgjobs.remove(job)
+        if job.error is not None:
+            self.stderr.write('gpgkeys: %s\n' % (job.error,))
+        else:
+            self.writecaptured(job.shell)
+        if status:
+            self.stdout.write('[%d]  %-8s %s\n' % (job.number, job.status, job.line))
+        if self.commandname(job.line)[0] not in self.readonly_commands:
+            # The job may have changed the keyring
+            self.warmup()
+        return job.rc
+
+    def reportjobs(self):
+        """Write the output of completed jobs."""
+        for job in self.bgjobs[:]:
+            if job.done.is_set():
+                self.finishjob(job)
+
+    def waitjobs(self):
+        """Wait for all jobs and write their output."""
+        rc = 0
+        while self.bgjobs:
+            job = self.bgjobs[0]
+            job.wait()
+            rc = self.finishjob(job)
+        return rc
+
+    # Fetch keys concurrently
+
+    def canfetch(self, args):
+        """Return True if keys for ``args`` can be fetched concurrently.
+
+        Fetched keys are screened with gpg before they are imported,
+        which needs GnuPG 2.1.14 or later.
+        """
+        if self.jobs <= 1 or args.pipe:
+            return False
+        if self.gnupg_version is None:
+            rc, output = self.popen(GNUPGEXE, '--version',
+                                    **dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False))
+            self.gnupg_version = gnupg_version(output) if rc == 0 and output else ()
+        return self.gnupg_version >= SHOW_ONLY_VERSION
+
+    def refreshkeys(self, args):
+        """Refresh the keys matching ``args`` using self.jobs connections."""
+        fingerprints = self.listfingerprints(args)
+        if fingerprints is None:
+            return 2
+        return self.fetchkeys(fingerprints, args)
+
+    def listfingerprints(self, args):
+        """Return the fingerprints of the keys matching ``args``."""
+        rc, output = self.popen(GNUPGEXE, '--list-keys', '--with-colons', '--fixed-list-mode',
+                                *[dequote(x) for x in args.args],
+                                **dict(stdout=subprocess.PIPE, shell=False))
+        if rc != 0 or output is None:
+            return None
+        return fingerprints(output)
+
+    def fetchkeys(self, keyids, args):
+        """Fetch ``keyids`` from the keyserver and import them with one gpg
+        invocation. Returns 2 if any key could not be fetched.
+
+        Like gpg, imports only keys matching the requested key ids.
+        """
+        try:
+            keyserver = dequote(args.keyserver) if args.keyserver else find_keyserver(GNUPGHOME)
+            fetcher = Fetcher(keyserver, self.jobs)
+        except FetchError as e:
+            self.stderr.write('gpgkeys: %s\n' % e)
+            return 2
+        if self.fetch_timeout is not None:
+            fetcher.timeout = self.fetch_timeout
+        if self.fetch_retries is not None:
+            fetcher.retries = self.fetch_retries
+        if self.verbose:
+            self.stderr.write('gpgkeys: fetching %d keys from %s\n' % (len(keyids), fetcher.url))
+        keys = []
+        rc = 0
+        for keyid, data, error in parallel_map(self.screenkey, fetcher.fetch_all(keyids), self.jobs):
+            if error is not None:
+                self.stderr.write('gpgkeys: %s: %s\n' % (keyid, error))
+                rc = 2
+            else:
+                if self.verbose:
+                    self.stderr.write('gpgkeys: %s: fetched\n' % keyid)
+                keys.append(data)
+        if rc or self.verbose:
+            self.stderr.write('gpgkeys: fetched %d of %d keys\n' % (len(keys), len(keyids)))
+        if keys:
+            rc = max(rc, self.importkeys(keys, args))
+        return rc
+
+    def screenkey(self, result):
+        """Check that the data fetched for a key id holds that key only."""
+        keyid, data, error = result
+        if error is None:
+            listing = self.showkeys(data)
+            try:
+                if listing is None:
+                    raise FetchError('unusable key data')
+                screen(keyid, listing)
+            except FetchError as e:
+                return keyid, None, str(e)
+        return result
+
+    def showkeys(self, data):
+        """Return the colon listing of the armored key ``data``."""
+        fd, filename = tempfile.mkstemp(prefix='gpgkeys-', suffix='.asc')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            rc, output = self.popen(GNUPGEXE, '--with-colons', '--import-options', 'show-only',
+                                    '--import', filename,
+                                    **dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False))
+        finally:
+            os.remove(filename)
+        if rc != 0:
+            return None
+        return output
+
+    def importkeys(self, keys, args):
+        """Import the armored ``keys`` with one gpg invocation."""
+        fd, filename = tempfile.mkstemp(prefix='gpgkeys-', suffix='.asc')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for data in keys:
+                    f.write(data)
+            return self.gnupg('--import', *(args.options + (filename,)))
+        finally:
+            os.remove(filename)
+
     # Execute subprocesses
 
+    # Output of subprocesses goes here instead of to the terminal
+    # if not None
+    captured = None
+
+    # Run subprocesses in a session of their own
+    detached = False
+
     def has_pager(self, args):
         for x in ('less', 'more', 'most', 'view', 'man'):
             if x in args:
                 return True
 
     def popen(self, *args, **kw):
-        command = ' '.join(args)
+        # With shell=False ``args`` is the argument list and executed
+        # directly; otherwise ``args`` are joined into a shell command
         stdout = kw.get('stdout', None)
         stderr = kw.get('stderr', None)
-        with savettystate():
+        if kw.get('shell', True):
+            command = ' '.join(args)
+            argv = None
+        else:
+            command = ' '.join(quote(x) for x in args)
+            argv = list(args)
+        capture = self.captured is not None
+        if capture:
+            # Running concurrently with other commands; keep the
+            # terminal out of reach
+            stdout = stdout or subprocess.PIPE
+            stderr = stderr or subprocess.PIPE
+            stdin = open(os.devnull, 'rb')
+        else:
+            stdin = None
+        session = {}
+        if self.detached:
+            # Keep ^C at the prompt away from background jobs
+            if sys.version_info[0] >= 3:
+                session['start_new_session'] = True
+            else:
+                session['preexec_fn'] = os.setsid
+        with conditional(not capture, savettystate()):
             try:
-                process = subprocess.Popen(command, shell=True, stdout=stdout, stderr=stderr)
+                process = None
+                if argv is not None:
+                    try:
+                        process = Process(argv, stdin=stdin, stdout=stdout, stderr=stderr, **session)
+                    except OSError:
+                        # Let the shell report the error
+                        pass
+                if process is None:
+                    argv = ['/bin/sh', '-c', command]
+                    process = Process(command, shell=True, stdin=stdin, stdout=stdout, stderr=stderr,
+                                      **session)
                 stdoutdata, stderrdata = process.communicate()
+                timing = current()
+                if timing is not None:
+                    timing.add_process(argv, process)
+                if capture:
+                    if kw.get('stdout') is None:
+                        self.captured.append((self.stdout, stdoutdata))
+                        stdoutdata = None
+                    if kw.get('stderr') is None:
+                        self.captured.append((self.stderr, stderrdata))
                 return process.returncode, stdoutdata
             except KeyboardInterrupt:
                 return 1, None
+            finally:
+                if stdin is not None:
+                    stdin.close()
 
     def getoutput(self, *args, **kw):
         rc, output = self.popen(*args, **dict(kw, stdout=subprocess.PIPE))
@@ -140,13 +766,52 @@ class GPGKeys(kmd.Kmd):
         return ''
 
     def system(self, *args, **kw):
-        with conditional(self.has_pager(args), ignoresignals()):
+        # Signal handlers can only be changed in the main thread
+        with conditional(self.has_pager(args) and self.captured is None, ignoresignals()):
             return self.popen(*args, **kw)[0]
 
     def gnupg(self, *args, **kw):
         if self.verbose:
             self.stderr.write('gpgkeys: %s %s\n' % (GNUPGEXE, ' '.join(args)))
-        return self.system(GNUPGEXE, *args, **kw)
+        if self.gpgstatus is None:
+            return self.shellsystem(GNUPGEXE, *args, **kw)
+        fd, filename = tempfile.mkstemp(prefix='gpgkeys-', suffix='.status')
+        os.close(fd)
+        try:
+            rc = self.shellsystem(GNUPGEXE, '--status-file', filename, *args, **kw)
+            with open(filename, 'rb') as f:
+                self.gpgstatus.extend(f.read().splitlines())
+            return rc
+        finally:
+            os.remove(filename)
+
+    def shellsystem(self, executable, *args, **kw):
+        """Run ``executable`` with the shell words ``args``.
+
+        The shell is only involved if the words use shell features
+        other than quoting, e.g. pipes or redirects.
+        """
+        argv = splitcommand(' '.join(args))
+        if argv is None:
+            return self.system(quote(executable), *args, **kw)
+        return self.system(executable, *argv, **dict(kw, shell=False))
+
+    def gnupgchunks(self, command, args):
+        """Run gpg ``command`` with parsed ``args``.
+
+        Splits the arguments over several invocations if the command
+        line would exceed the system limit, and returns the highest
+        return code.
+        """
+        if args.pipe or args.output or not args.args:
+            # Pipes and output files must see a single invocation
+            return self.gnupg(command, *args.tuple)
+        fixed = ' '.join((GNUPGEXE, command) + args.options)
+        limit = (self.arg_max or getargmax()) - len(fixed) - 1
+        rc = 0
+        for chunk in chunkargs(args.args, limit):
+            rc = max(rc, self.gnupg(command, *(args.options + chunk)))
+        return rc
 
     # Commands
 
@@ -168,6 +833,9 @@ class GPGKeys(kmd.Kmd):
 
     def do_quit(self, args):
         """End the session (Usage: quit)"""
+        if self.bgjobs:
+            self.stderr.write('gpgkeys: waiting for %d background jobs\n' % len(self.bgjobs))
+            self.waitjobs()
         return True # Break the cmd loop
 
     def do_clear(self, args):
@@ -218,12 +886,12 @@ class GPGKeys(kmd.Kmd):
 
     def do_export(self, args):
         """Export keys to stdout or to a file (Usage: export [<keyspec>])"""
-        args = parseargs(args)
+        args = parseargs(args, files=True, stdin=self.stdinargs)
         if args.ok:
             command = '--export'
             if args.secret:
                 command = '--export-secret-keys'
-            self.rc = self.gnupg(command, *args.tuple)
+            self.rc = self.gnupgchunks(command, args)
         else:
             self.stderr.write('gpgkeys: %s\n' % args.error)
             self.rc = 1
@@ -240,6 +908,29 @@ class GPGKeys(kmd.Kmd):
             self.stderr.write('gpgkeys: %s\n' % args.error)
             self.rc = 1
 
+    def do_find(self, args):
+        """Search the local keyring for user ids containing text (Usage: find <text>)"""
+        args = parseargs(args)
+        if args.ok and args.pipe:
+            self.stderr.write('gpgkeys: find does not support pipes\n')
+            self.rc = 1
+        elif args.ok and args.args:
+            text = ' '.join(dequote(x) for x in args.args)
+            matches = self.completekeyid.find(text)
+            if not matches:
+                matches = self.completekeyid.find(text, similar=True)
+                if matches:
+                    self.stderr.write('gpgkeys: no exact matches, showing similar user ids\n')
+            for keyid, userid in matches:
+                self.stdout.write('%s %s\n' % (keyid, userid))
+            self.rc = 0 if matches else 1
+        elif args.ok:
+            self.stderr.write('gpgkeys: find requires a search text\n')
+            self.rc = 1
+        else:
+            self.stderr.write('gpgkeys: %s\n' % args.error)
+            self.rc = 1
+
     def do_listsig(self, args):
         """List keys with signatures (Usage: listsig [<keyspec>])"""
         args = parseargs(args)
@@ -302,7 +993,7 @@ class GPGKeys(kmd.Kmd):
 
     def do_del(self, args):
         """Delete a key from the keyring (Usage: del <keyspec>)"""
-        args = parseargs(args)
+        args = parseargs(args, files=True, stdin=self.stdinargs)
         if args.ok:
             if args.args:
                 command = '--delete-key'
@@ -310,7 +1001,7 @@ class GPGKeys(kmd.Kmd):
                     command = '--delete-secret-key'
                 if args.secret_and_public:
                     command = '--delete-secret-and-public-key'
-                self.rc = self.gnupg(command, *args.tuple)
+                self.rc = self.gnupgchunks(command, args)
             else:
                 self.do_help('del')
         else:
@@ -331,10 +1022,13 @@ class GPGKeys(kmd.Kmd):
 
     def do_recv(self, args):
         """Fetch keys from a keyserver (Usage: recv <keyids>)"""
-        args = parseargs(args)
+        args = parseargs(args, files=True, stdin=self.stdinargs)
         if args.ok:
             if args.args:
-                self.rc = self.gnupg('--recv-keys', *args.tuple)
+                if self.canfetch(args):
+                    self.rc = self.fetchkeys([dequote(x) for x in args.args], args)
+                else:
+                    self.rc = self.gnupgchunks('--recv-keys', args)
             else:
                 self.do_help('recv')
         else:
@@ -343,10 +1037,10 @@ class GPGKeys(kmd.Kmd):
 
     def do_send(self, args):
         """Send keys to a keyserver (Usage: send <keyids>)"""
-        args = parseargs(args)
+        args = parseargs(args, files=True, stdin=self.stdinargs)
         if args.ok:
             if args.args:
-                self.rc = self.gnupg('--send-keys', *args.tuple)
+                self.rc = self.gnupgchunks('--send-keys', args)
             else:
                 self.do_help('send')
         else:
@@ -355,9 +1049,12 @@ class GPGKeys(kmd.Kmd):
 
     def do_refresh(self, args):
         """Refresh keys from a keyserver (Usage: refresh [<keyspec>])"""
-        args = parseargs(args)
+        args = parseargs(args, files=True, stdin=self.stdinargs)
         if args.ok:
-            self.rc = self.gnupg('--refresh-keys', *args.tuple)
+            if self.canfetch(args):
+                self.rc = self.refreshkeys(args)
+            else:
+                self.rc = self.gnupgchunks('--refresh-keys', args)
         else:
             self.stderr.write('gpgkeys: %s\n' % args.error)
             self.rc = 1
@@ -404,6 +1101,102 @@ class GPGKeys(kmd.Kmd):
             self.stderr.write('gpgkeys: %s\n' % args.error)
             self.rc = 1
 
+    def do_time(self, args):
+        """Execute a command and report the time and resources used (Usage: time <command>)"""
+        if args.strip():
+            return self.timecmd(args.strip())
+        else:
+            self.do_help('time')
+
+    def timecmd(self, line, report=True):
+        """Execute ``line`` and report its timing to stderr."""
+        with Timing() as timing:
+            stop = super(GPGKeys, self).onecmd(line)
+        if report:
+            self.stderr.write('gpgkeys: %s\n' % timing.format())
+        if self.trace is not None:
+            self.trace.write(self.tracerecord(line, timing))
+        return stop
+
+    def tracerecord(self, line, timing):
+        """Return the trace record of ``line``."""
+        name, arg = self.commandname(line)
+        record = {
+            'line': line,
+            'command': name,
+            'args': None,
+            'argv': timing.commands,
+            'start': timing.started,
+            'end': timing.ended,
+            'real': timing.real,
+            'user': timing.user,
+            'sys': timing.sys,
+            'maxrss': timing.maxrss,
+            'parse': timing.parts['parse'],
+            'refresh': timing.parts['refresh'],
+            'rc': self.rc,
+            'written': timing.written,
+            'cache_updates': timing.updates,
+        }
+        if name is not None and name != 'shell':
+            args = parseargs(arg)
+            if args.ok:
+                record['args'] = {
+                    'options': list(args.options),
+                    'args': list(args.args),
+                    'pipe': list(args.pipe),
+                }
+        return record
+
+    def do_stats(self, args):
+        """Print completion statistics (Usage: stats [--json])"""
+        args = splitargs(args)
+        if args == ('--json',):
+            stats.dump(self.stdout, __version__)
+        elif not args:
+            for line in stats.format():
+                self.stdout.write('%s\n' % line)
+        else:
+            self.do_help('stats')
+
+    def do_bg(self, args):
+        """Run a command in the background (Usage: bg <command>)"""
+        if args.strip():
+            self.startjob(args.strip())
+        else:
+            self.do_help('bg')
+
+    def do_jobs(self, args):
+        """List background jobs (Usage: jobs)"""
+        self.reportjobs()
+        for job in self.bgjobs:
+            self.stdout.write('[%d]  %-8s %s\n' % (job.number, job.status, job.line))
+
+    def do_fg(self, args):
+        """Wait for a background job and print its output (Usage: fg [<job>])"""
+        job = self.findjob(args.strip())
+        if job is None:
+            self.stderr.write('gpgkeys: fg: no such job\n')
+            self.rc = 1
+            return
+        self.stdout.write('%s\n' % job.line)
+        try:
+            job.wait()
+        except KeyboardInterrupt:
+            # Leave the job running
+            self.stdout.write('\n')
+            self.rc = 1
+        else:
+            self.rc = self.finishjob(job, status=False)
+
+    def do_wait(self, args):
+        """Wait for all background jobs and print their output (Usage: wait)"""
+        try:
+            self.rc = self.waitjobs()
+        except KeyboardInterrupt:
+            self.stdout.write('\n')
+            self.rc = 1
+
     def do_shell(self, args):
         """Execute a shell command or start an interactive shell (Usage: ! [<command>])"""
         args = splitargs(args)
@@ -480,13 +1273,14 @@ class GPGKeys(kmd.Kmd):
 
     def completebase(self, word, default):
         """Complete after pipes and input/output redirects."""
-        if word.pipepos:
-            if not word.isfilename:
-                return self.completecommand(word.text)
-            return self.completefilename(word.text)
-        if word.filepos:
-            return self.completefilename(word.text)
-        return default(word.text)
+        with stats.measure('completebase'):
+            if word.pipepos:
+                if not word.isfilename:
+                    return self.completecommand(word.text)
+                return self.completefilename(word.text)
+            if word.filepos:
+                return self.completefilename(word.text)
+            return default(word.text)
 
     def completeoption(self, text, options):
         """Complete from a list of options."""
@@ -526,6 +1320,12 @@ class GPGKeys(kmd.Kmd):
             return self.completeoption(word.text, GLOBAL + LIST + SECRET)
         return self.completebase(word, self.completekeyid)
 
+    def complete_find(self, text, line, begidx, endidx):
+        word = parseword(line, begidx, endidx)
+        if word.isoption:
+            return self.completeoption(word.text, GLOBAL)
+        return self.completebase(word, self.completekeyid)
+
     def complete_listsig(self, text, line, begidx, endidx):
         word = parseword(line, begidx, endidx)
         if word.isoption:
@@ -543,7 +1343,7 @@ class GPGKeys(kmd.Kmd):
         if word.isoption:
             return self.completeoption(word.text, GLOBAL + KEY + SIGN + EXPERT)
         if word.follows('--local-user'):
-            return self.completekeyid(word.text)
+            return self.completesecretkeyid(word.text)
         return self.completebase(word, self.completekeyid)
 
     def complete_lsign(self, text, line, begidx, endidx):
@@ -551,7 +1351,7 @@ class GPGKeys(kmd.Kmd):
         if word.isoption:
             return self.completeoption(word.text, GLOBAL + KEY + SIGN)
         if word.follows('--local-user'):
-            return self.completekeyid(word.text)
+            return self.completesecretkeyid(word.text)
         return self.completebase(word, self.completekeyid)
 
     def complete_sign(self, text, line, begidx, endidx):
@@ -559,7 +1359,7 @@ class GPGKeys(kmd.Kmd):
         if word.isoption:
             return self.completeoption(word.text, GLOBAL + KEY + SIGN)
         if word.follows('--local-user'):
-            return self.completekeyid(word.text)
+            return self.completesecretkeyid(word.text)
         return self.completebase(word, self.completekeyid)
 
     def complete_del(self, text, line, begidx, endidx):
@@ -618,6 +1418,12 @@ class GPGKeys(kmd.Kmd):
             return self.completeoption(word.text, GLOBAL)
         return self.completebase(word, self.completefilename)
 
+    def complete_stats(self, text, line, begidx, endidx):
+        word = parseword(line, begidx, endidx)
+        if word.isoption:
+            return self.completeoption(word.text, STATS)
+        return []
+
     def complete_shell(self, text, line, begidx, endidx):
         word = parseword(line, begidx, endidx)
         if word.isoption:
@@ -695,6 +1501,15 @@ class GPGKeys(kmd.Kmd):
 def main(args=None):
     quote_char = '\\'
     verbose = False
+    substring = False
+    budget = None
+    script = None
+    jobs = 1
+    timeout = None
+    retries = None
+    timing = False
+    statsfile = None
+    tracefile = None
     help = False
     version = False
 
@@ -702,7 +1517,9 @@ def main(args=None):
         args = sys.argv[1:]
 
     try:
-        options, args = getopt.getopt(args, 'hq:vV', ('help', 'quote-char=', 'verbose', 'version'))
+        options, args = getopt.getopt(args, 'b:f:hj:q:svV',
+            ('budget=', 'file=', 'help', 'jobs=', 'quote-char=', 'retries=', 'stats=',
+             'substring', 'timeout=', 'timing', 'trace=', 'verbose', 'version'))
     except getopt.GetoptError as e:
         print('gpgkeys:', e, file=sys.stderr)
         return 1
@@ -710,6 +1527,41 @@ def main(args=None):
     for name, value in options:
         if name in ('-q', '--quote-char'):
             quote_char = value
+        elif name in ('-b', '--budget'):
+            try:
+                budget = int(value) / 1000.0
+            except ValueError:
+                print('gpgkeys: invalid budget:', value, file=sys.stderr)
+                return 1
+        elif name in ('-f', '--file'):
+            script = value
+        elif name in ('-j', '--jobs'):
+            try:
+                jobs = max(int(value), 1)
+            except ValueError:
+                print('gpgkeys: invalid number of jobs:', value, file=sys.stderr)
+                return 1
+        elif name == '--timeout':
+            try:
+                timeout = float(value)
+            except ValueError:
+                print('gpgkeys: invalid timeout:', value, file=sys.stderr)
+                return 1
+        elif name == '--retries':
+            try:
+                retries = max(int(value), 0)
+            except ValueError:
+                print('gpgkeys: invalid number of retries:', value, file=sys.stderr)
+                return 1
+        elif name == '--timing':
+            timing = True
+        elif name == '--stats':
+            # Commands may change the working directory
+            statsfile = os.path.abspath(os.path.expanduser(value))
+        elif name == '--trace':
+            tracefile = value
+        elif name in ('-s', '--substring'):
+            substring = True
         elif name in ('-v', '--verbose'):
             verbose = True
         elif name in ('-h', '--help'):
@@ -720,12 +1572,23 @@ def main(args=None):
     if help:
         print("""\
 Usage: gpgkeys [options] [command [options] [args]]
+       gpgkeys [options] -f script
 
 A GnuPG shell
 
 Options:
+  -b, --budget MS     Complete from the previous key cache if refreshing
+                      takes longer than MS milliseconds.
+  -f, --file FILE     Execute the commands in FILE.
+  -j, --jobs N        Fetch keys with N concurrent keyserver connections.
+      --timeout SECS  With -j, give up on a keyserver request after SECS.
+      --retries N     With -j, retry failed keyserver requests N times.
   -q, --quote-char    Select the default quoting style.
+  -s, --substring     Complete user ids by substring.
   -v, --verbose       Print gpg/gpg2 command lines.
+      --timing        Report the time and resources used by each command.
+      --stats FILE    Write completion statistics to FILE on exit.
+      --trace FILE    Append a JSON record per command to FILE.
   -h, --help          Print this help message and exit.
   -V, --version       Print the version string and exit.
 
@@ -735,8 +1598,50 @@ Type '%s' to start the interactive shell.\n""" % sys.argv[0], file=sys.stderr)
         print('gpgkeys', __version__)
         return 0
 
-    shell = GPGKeys(quote_char=quote_char, verbose=verbose)
-    return shell.run(args)
+    shell = GPGKeys(quote_char=quote_char, verbose=verbose, substring=substring,
+                    budget=budget, jobs=jobs, timing=timing)
+    shell.fetch_timeout = timeout
+    shell.fetch_retries = retries
+    if script is not None:
+        if args:
+            print('gpgkeys: -f does not take a command', file=sys.stderr)
+            return 1
+        try:
+            if script == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(script) as f:
+                    lines = f.readlines()
+        except EnvironmentError as e:
+            print('gpgkeys: %s: %s' % (script, e.strerror), file=sys.stderr)
+            return 1
+    if tracefile is not None:
+        try:
+            shell.trace = Trace(open(tracefile, 'at'))
+        except EnvironmentError as e:
+            print('gpgkeys: %s: %s' % (tracefile, e.strerror), file=sys.stderr)
+            return 1
+    try:
+        if script is not None:
+            try:
+                return shell.runscript(lines)
+            except KeyboardInterrupt:
+                return 1
+        return shell.run(args)
+    finally:
+        if statsfile is not None:
+            savestats(statsfile)
+        if shell.trace is not None:
+            shell.trace.close()
+
+
+def savestats(filename):
+    """Write the completion statistics to ``filename`` as JSON."""
+    try:
+        with open(filename, 'wt') as f:
+            stats.dump(f, __version__)
+    except EnvironmentError as e:
+        print('gpgkeys: %s: %s' % (filename, e.strerror), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,53 @@
+"""Run commands in the background."""
+
+from __future__ import absolute_import
+
+import threading
+
+
+class Job(object):
+    """A command line executing on a background thread.
+
+    ``func`` is called with the command line and returns the shell
+    that executed it.
+    """
+
+    def __init__(self, number, line, func):
+        self.number = number
+        self.line = line
+        self.shell = None
+        self.error = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(func,), name='gpgkeys-job-%d' % number)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self, func):
+        try:
+            self.shell = func(self.line)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self):
+        # Wait in slices so KeyboardInterrupt gets through
+        while not self.done.wait(0.1):
+            pass
+
+    @property
+    def rc(self):
+        if self.shell is None:
+            return 1
+        return self.shell.rc
+
+    @property
+    def status(self):
+        if not self.done.is_set():
+            return 'Running'
+        if self.rc:
+            return 'Exit %d' % self.rc
+        return 'Done'
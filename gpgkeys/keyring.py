@@ -0,0 +1,284 @@
+"""Read OpenPGP keyrings without invoking gpg.
+
+Supports the keybox format (pubring.kbx) used by GnuPG >= 2.1 and
+the plain packet format (pubring.gpg) used by earlier versions.
+Only packet headers, public key and subkey packets, and user id
+packets are looked at; everything else is skipped.
+"""
+
+from __future__ import absolute_import
+
+import os
+import mmap
+import struct
+import hashlib
+import binascii
+
+from .config import GNUPGHOME
+
+# Packet tags
+PUBLIC_KEY = 6
+PUBLIC_SUBKEY = 14
+USER_ID = 13
+
+# Keybox blob types
+KBX_EMPTY = 0
+KBX_FIRST = 1
+KBX_OPENPGP = 2
+
+# gpg.conf options which make the default keyring insufficient
+KEYRING_OPTIONS = ('keyring', 'primary-keyring', 'no-default-keyring')
+
+
+class KeyringError(Exception):
+    """Raised when a keyring cannot be parsed."""
+
+
+class Certificate(object):
+    """A public key with its user ids and subkey ids.
+    """
+
+    def __init__(self, fingerprint, longid=None):
+        if longid is None:
+            if len(fingerprint) == 64:
+                # V5 and V6 key ids are the leftmost 64 bits
+                longid = fingerprint[:16]
+            else:
+                longid = fingerprint[-16:]
+        self.fingerprint = fingerprint
+        self.longid = longid
+        self.userids = []
+        self.subkeys = []
+        self.digest = None
+
+    @property
+    def keyid(self):
+        """The short (32 bit) key id."""
+        return self.longid[8:]
+
+
+def uses_keyboxd(home=GNUPGHOME):
+    """Return True if common.conf in ``home`` enables keyboxd.
+
+    GnuPG 2.4 then keeps the public keys in public-keys.d instead
+    of pubring.kbx.
+    """
+    commonconf = os.path.join(home, 'common.conf')
+    if os.path.isfile(commonconf):
+        f = open(commonconf, 'rt')
+        try:
+            for line in f:
+                tokens = line.split()
+                if tokens and tokens[0] == 'use-keyboxd':
+                    return True
+        finally:
+            f.close()
+    return False
+
+
+def find_keyring(home=GNUPGHOME):
+    """Return the path of the default public keyring in ``home``.
+
+    Returns None if the keyring does not exist, gpg.conf
+    configures additional keyrings, or keyboxd holds the keys.
+    """
+    if uses_keyboxd(home):
+        return None
+    gpgconf = os.path.join(home, 'gpg.conf')
+    if os.path.isfile(gpgconf):
+        f = open(gpgconf, 'rt')
+        try:
+            for line in f:
+                tokens = line.split()
+                if tokens and tokens[0] in KEYRING_OPTIONS:
+                    return None
+        finally:
+            f.close()
+    for name in ('pubring.kbx', 'pubring.gpg'):
+        path = os.path.join(home, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def read_keyring(filename):
+    """Yield the Certificates found in keyring ``filename``."""
+    for digest, cert in scan_keyring(filename):
+        yield cert
+
+
+def scan_keyring(filename, known=()):
+    """Yield (digest, cert) for each certificate in keyring ``filename``.
+
+    The digest changes whenever the certificate does. Certificates
+    whose digest is in ``known`` are not parsed and yielded as None.
+    """
+    f = open(filename, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if is_keybox(data):
+                blocks = split_keybox(data)
+            else:
+                blocks = split_keyblocks(data, 0, len(data))
+            try:
+                for digest, pos, end in blocks:
+                    if digest in known:
+                        yield digest, None
+                        continue
+                    for cert in parse_keyblock(data, pos, end):
+                        cert.digest = digest
+                        yield digest, cert
+            except struct.error as e:
+                raise KeyringError('%s: %s' % (filename, e))
+        finally:
+            data.close()
+    finally:
+        f.close()
+
+
+def is_keybox(data):
+    """Return True if ``data`` starts with a keybox header blob."""
+    return data[8:12] == b'KBXf'
+
+
+def split_keybox(data):
+    """Yield (digest, pos, end) for each keyblock in keybox ``data``."""
+    pos, end = 0, len(data)
+    while pos < end:
+        if pos + 6 > end:
+            raise KeyringError('truncated keybox blob at offset %d' % pos)
+        length, type = struct.unpack_from('>IB', data, pos)
+        if length < 6 or pos + length > end:
+            raise KeyringError('invalid keybox blob at offset %d' % pos)
+        if type == KBX_OPENPGP:
+            offset, size = struct.unpack_from('>II', data, pos + 8)
+            if offset + size > length:
+                raise KeyringError('invalid keyblock at offset %d' % pos)
+            # Use the blob checksum unless it is missing or overlaps
+            # the keyblock
+            checksum = data[pos+length-20:pos+length]
+            if offset + size <= length - 20 and checksum != b'\0' * 20:
+                digest = hexlify(checksum)
+            else:
+                digest = hexlify(hashlib.sha1(data[pos+offset:pos+offset+size]).digest())
+            yield digest, pos + offset, pos + offset + size
+        pos += length
+
+
+def split_keyblocks(data, pos, end):
+    """Yield (digest, pos, end) for each certificate in data[pos:end]."""
+    first = None
+    for tag, offset, start, stop in parse_packets(data, pos, end):
+        if tag == PUBLIC_KEY:
+            if first is not None:
+                yield hexlify(hashlib.sha1(data[first:offset]).digest()), first, offset
+            first = offset
+    if first is not None:
+        yield hexlify(hashlib.sha1(data[first:end]).digest()), first, end
+
+
+def parse_keyblock(data, pos, end):
+    """Yield the Certificates found in the packet sequence data[pos:end]."""
+    cert = None
+    for tag, offset, start, stop in parse_packets(data, pos, end):
+        if tag == PUBLIC_KEY:
+            if cert is not None:
+                yield cert
+            cert = parse_public_key(data[start:stop])
+        elif tag == USER_ID and cert is not None:
+            cert.userids.append(data[start:stop])
+        elif tag == PUBLIC_SUBKEY and cert is not None:
+            cert.subkeys.append(parse_public_key(data[start:stop]).longid)
+    if cert is not None:
+        yield cert
+
+
+def parse_packets(data, pos, end):
+    """Yield (tag, offset, start, stop) for each packet in data[pos:end].
+
+    ``offset`` is the position of the packet header and data[start:stop]
+    is the packet body.
+    """
+    while pos < end:
+        offset = pos
+        ctb, = struct.unpack_from('>B', data, pos)
+        pos += 1
+        if not ctb & 0x80:
+            raise KeyringError('invalid packet header at offset %d' % (pos-1))
+        if ctb & 0x40:
+            tag = ctb & 0x3f
+            length, pos = new_length(data, pos, end)
+        else:
+            tag = (ctb >> 2) & 0x0f
+            length, pos = old_length(data, pos, end, ctb & 0x03)
+        if pos + length > end:
+            raise KeyringError('truncated packet at offset %d' % pos)
+        yield tag, offset, pos, pos + length
+        pos += length
+
+
+def old_length(data, pos, end, lentype):
+    """Decode an old format packet length."""
+    if lentype == 0:
+        length, = struct.unpack_from('>B', data, pos)
+        return length, pos + 1
+    if lentype == 1:
+        length, = struct.unpack_from('>H', data, pos)
+        return length, pos + 2
+    if lentype == 2:
+        length, = struct.unpack_from('>I', data, pos)
+        return length, pos + 4
+    return end - pos, pos
+
+
+def new_length(data, pos, end):
+    """Decode a new format packet length."""
+    first, = struct.unpack_from('>B', data, pos)
+    if first < 192:
+        return first, pos + 1
+    if first < 224:
+        second, = struct.unpack_from('>B', data, pos + 1)
+        return ((first - 192) << 8) + second + 192, pos + 2
+    if first == 255:
+        length, = struct.unpack_from('>I', data, pos + 1)
+        return length, pos + 5
+    # Partial body lengths are not allowed for key material
+    raise KeyringError('unexpected partial body length at offset %d' % pos)
+
+
+def parse_public_key(body):
+    """Create a Certificate from a public key packet body."""
+    version, = struct.unpack_from('>B', body, 0)
+    if version == 4:
+        digest = hashlib.sha1(b'\x99' + struct.pack('>H', len(body)) + body)
+    elif version == 5:
+        digest = hashlib.sha256(b'\x9a' + struct.pack('>I', len(body)) + body)
+    elif version == 6:
+        digest = hashlib.sha256(b'\x9b' + struct.pack('>I', len(body)) + body)
+    elif version in (2, 3):
+        return parse_v3_public_key(body)
+    else:
+        raise KeyringError('unsupported key version %d' % version)
+    return Certificate(hexlify(digest.digest()))
+
+
+def parse_v3_public_key(body):
+    """Create a Certificate from a V3 (RSA) public key packet body."""
+    n, pos = read_mpi(body, 8)
+    e, pos = read_mpi(body, pos)
+    return Certificate(hexlify(hashlib.md5(n + e).digest()), hexlify(n[-8:]))
+
+
+def read_mpi(body, pos):
+    """Read a multiprecision integer; return its bytes and the new position."""
+    bits, = struct.unpack_from('>H', body, pos)
+    size = (bits + 7) // 8
+    return body[pos+2:pos+2+size], pos + 2 + size
+
+
+def hexlify(data):
+    """Return upper case hex digits as native string."""
+    return str(binascii.hexlify(data).decode('ascii')).upper()
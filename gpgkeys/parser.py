@@ -2,30 +2,114 @@ from __future__ import absolute_import
 
 import os
 import sys
+import shlex
 import getopt
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from .scanner import QUOTECHARS
 from .scanner import find_unquoted
 from .scanner import rfind_unquoted
+from .scanner import char_is_quoted
 
 from .splitter import split
 from .splitter import closequote
 from .splitter import splitpipe
 
+from .timing import timed
+
 
 def splitargs(args):
     """Split the command line into tokens."""
     return closequote(split(args))
 
 
-def parseargs(args):
-    """Parse the command line."""
+@timed('parse')
+def parseargs(args, files=False, stdin=True):
+    """Parse the command line.
+
+    If ``files`` is true, @path arguments are replaced by the lines
+    of the file at path, or of stdin if path is '-'. If ``stdin`` is
+    false, '@-' is an error.
+    """
     mine, pipe = splitpipe(splitargs(args))
     args = Args()
     args.parse(mine)
     args.pipe = pipe
+    if files and args.ok:
+        args.expand(stdin)
     return args
 
 
+def readargs(lines):
+    """Yield the lines of ``lines`` as shell-quoted arguments.
+
+    Skips empty lines and comments.
+    """
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield quote(line)
+
+
+def dequote(token):
+    """Remove shell quoting from a token."""
+    return ' '.join(shlex.split(token))
+
+
+# Characters with a meaning to the shell other than quoting
+SHELLCHARS = ('|', '&', ';', '<', '>', '(', ')', '$', '`', '*', '?', '[', '{', '~', '#', '\n')
+
+
+def splitcommand(command):
+    """Split a command line into an argument list like the shell would.
+
+    Returns None if the command uses shell features other than quoting,
+    e.g. pipes, redirects, variables, or wildcards.
+    """
+    skip_next = False
+    quote_char = ''
+    for c in command:
+        if skip_next:
+            skip_next = False
+        elif quote_char == "'":
+            if c == quote_char:
+                quote_char = ''
+        elif c == '\\':
+            if quote_char:
+                return None
+            skip_next = True
+        elif quote_char == '"':
+            if c == quote_char:
+                quote_char = ''
+            elif c in ('$', '`'):
+                return None
+        elif c in QUOTECHARS:
+            quote_char = c
+        elif c in SHELLCHARS:
+            return None
+    if skip_next or quote_char:
+        return None
+    return shlex.split(command)
+
+
+def splitbackground(line):
+    """Remove a trailing '&' from the command line.
+
+    Returns the line and True if it should run in the background.
+    """
+    stripped = line.rstrip()
+    end = len(stripped) - 1
+    if end > 0 and stripped[end] == '&' and stripped[end-1] not in ('&', '>', '|'):
+        command = stripped[:end].rstrip()
+        if command and not char_is_quoted(stripped, end):
+            return command, True
+    return line, False
+
+
 def parseword(line, begidx, endidx):
     """Parse the completion word."""
     word = Word()
@@ -108,6 +192,34 @@ class Args(object):
                     self.ask_cert_level = True
             self.args = tuple(args)
 
+    def expand(self, stdin=True):
+        """Replace @path arguments by the lines of the file at path.
+
+        Arguments naming no existing file are kept, so gpg's @ syntax
+        for email addresses keeps working. '@-' reads stdin unless
+        ``stdin`` is false.
+        """
+        args = []
+        for arg in self.args:
+            if arg.startswith('@') and len(arg) > 1:
+                filename = os.path.expanduser(dequote(arg[1:]))
+                if filename == '-':
+                    if not stdin:
+                        self.error = '@-: commands are read from stdin'
+                        return
+                    args.extend(readargs(sys.stdin))
+                    continue
+                if os.path.isfile(filename):
+                    try:
+                        with open(filename) as f:
+                            args.extend(readargs(f))
+                    except EnvironmentError as e:
+                        self.error = '%s: %s' % (filename, e.strerror)
+                        return
+                    continue
+            args.append(arg)
+        self.args = tuple(args)
+
     @property
     def ok(self):
         return self.error is None
@@ -0,0 +1,123 @@
+"""Count completion calls and measure their latency."""
+
+from __future__ import absolute_import
+
+import math
+import json
+import threading
+
+from collections import deque
+
+from .timing import clock
+
+
+class Counter(object):
+    """Calls, events, and recent latencies of one completer."""
+
+    # Number of latency samples kept
+    max_samples = 10000
+
+    def __init__(self):
+        self.calls = 0
+        self.events = {}
+        self.samples = deque(maxlen=self.max_samples)
+
+
+class Stats(object):
+    """Completion statistics by completer name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter()
+        return counter
+
+    def measure(self, name):
+        """Return a context manager adding a call to ``name``."""
+        return _Measure(self, name)
+
+    def add(self, name, seconds):
+        with self.lock:
+            counter = self.counter(name)
+            counter.calls += 1
+            counter.samples.append(seconds)
+
+    def count(self, name, event):
+        with self.lock:
+            counter = self.counter(name)
+            counter.events[event] = counter.events.get(event, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+
+    def summary(self):
+        """Return a dictionary of statistics by completer name.
+
+        Latencies are in milliseconds.
+        """
+        result = {}
+        with self.lock:
+            for name, counter in self.counters.items():
+                samples = sorted(counter.samples)
+                entry = dict(counter.events)
+                entry['calls'] = counter.calls
+                for p in (50, 95, 99):
+                    entry['p%d' % p] = percentile(samples, p) * 1000
+                hits = entry.get('hits', 0)
+                misses = entry.get('misses', 0)
+                if hits + misses:
+                    entry['hit_ratio'] = float(hits) / (hits + misses)
+                result[name] = entry
+        return result
+
+    def format(self):
+        """Return the statistics as lines of a table."""
+        lines = ['%-18s %7s %7s %7s %6s %8s %8s %8s %8s' % (
+            'completer', 'calls', 'hits', 'misses', 'hit%', 'rebuilds', 'p50', 'p95', 'p99')]
+        for name, entry in sorted(self.summary().items()):
+            if 'hit_ratio' in entry:
+                ratio = '%.0f%%' % (entry['hit_ratio'] * 100)
+                hits, misses = entry.get('hits', 0), entry.get('misses', 0)
+                rebuilds = entry.get('rebuilds', 0)
+            else:
+                ratio = hits = misses = rebuilds = '-'
+            lines.append('%-18s %7d %7s %7s %6s %8s %6.2fms %6.2fms %6.2fms' % (
+                name, entry['calls'], hits, misses, ratio, rebuilds,
+                entry['p50'], entry['p95'], entry['p99']))
+        return lines
+
+    def dump(self, file, version=None):
+        """Write the statistics to ``file`` as JSON."""
+        data = {'version': version, 'completers': self.summary()}
+        json.dump(data, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def percentile(samples, p):
+    """Return the ``p``-th percentile of sorted ``samples``."""
+    if not samples:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(samples)))
+    return samples[max(rank, 1) - 1]
+
+
+class _Measure(object):
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, *ignored):
+        self.stats.add(self.name, clock() - self.start)
+
+
+# Statistics of this process
+stats = Stats()
@@ -1,5 +1,20 @@
+import time
+import threading
 import rl.testing
 
+try:
+    from http.server import HTTPServer
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit
+    from urllib.parse import parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit
+    from urlparse import parse_qs
+
 
 def reset():
     rl.testing.reset()
@@ -8,3 +23,79 @@ def reset():
 class JailSetup(rl.testing.JailSetup):
     pass
 
+
+class HKPServer(object):
+    """A local stand-in for an HKP keyserver.
+
+    Serves ``keys``, a dictionary mapping fingerprints to key data.
+    Responses are delayed by ``delay`` seconds, and the first
+    ``failures`` requests fail with 503 Service Unavailable.
+    """
+
+    def __init__(self, keys=None, delay=0, failures=0):
+        self.keys = keys if keys is not None else {}
+        self.delay = delay
+        self.failures = failures
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return 'hkp://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _HKPHandler)
+        self.server.hkp = self
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), name='gpgkeys-hkp')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def lookup(self, search):
+        """Return (status, data) of a get request for ``search``."""
+        with self.lock:
+            self.requests.append(search)
+            if self.failures > 0:
+                self.failures -= 1
+                return 503, b''
+        if self.delay:
+            time.sleep(self.delay)
+        search = search.upper()
+        if search.startswith('0X'):
+            search = search[2:]
+        for fingerprint, data in self.keys.items():
+            if search and fingerprint.upper().endswith(search):
+                return 200, data
+        return 404, b''
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on slow responses are expected
+        pass
+
+
+class _HKPHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path != '/pks/lookup' or query.get('op') != ['get']:
+            status, data = 501, b''
+        else:
+            status, data = self.server.hkp.lookup(query.get('search', [''])[0])
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/pgp-keys')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,402 @@
+import unittest
+import os
+import sys
+import time
+import subprocess
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gpgkeys.gpgkeys import GPGKeys
+from gpgkeys.config import GNUPGEXE
+from gpgkeys.utils import getargmax
+from gpgkeys.utils import chunkargs
+
+
+class FakeGPGKeys(GPGKeys):
+    """Record gpg invocations instead of running gpg."""
+
+    def __init__(self, *args, **kw):
+        GPGKeys.__init__(self, *args, **kw)
+        self.calls = []
+        self.results = {}
+
+    def gnupg(self, *args, **kw):
+        self.calls.append(' '.join(args))
+        return self.results.get(args[0], 0)
+
+
+class StatusGPGKeys(FakeGPGKeys):
+    """Report the key ids in status as received or exported."""
+
+    status = ()
+
+    def gnupg(self, *args, **kw):
+        if self.gpgstatus is not None:
+            self.gpgstatus.extend(self.status)
+        return FakeGPGKeys.gnupg(self, *args, **kw)
+
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.umask = os.umask(0o022)
+        self.stderr = StringIO()
+        self.shell = FakeGPGKeys(stdout=StringIO(), stderr=self.stderr, verbose=True)
+
+    def tearDown(self):
+        os.umask(self.umask)
+
+    def batch(self, text):
+        return self.shell.batch(StringIO(text))
+
+    def test_combine(self):
+        rcs = self.batch('recv 0x1111\nrecv 0x2222\n\nrecv 0x3333\n')
+        self.assertEqual(self.shell.calls, ['--recv-keys 0x1111 0x2222 0x3333'])
+        self.assertEqual(rcs, [0, 0, 0])
+        self.assertEqual(self.stderr.getvalue(), 'gpgkeys: 3 commands in 1 gpg invocations, 2 saved\n')
+
+    def test_abbreviations(self):
+        self.batch('recv 0x1111\nrec 0x2222\nexport "Alice Smith"\nexp Bob\n')
+        self.assertEqual(self.shell.calls, ['--recv-keys 0x1111 0x2222', '--export "Alice Smith" Bob'])
+
+    def test_options_must_match(self):
+        self.batch('export --armor A\nexport --armor B\nexport C\nexport --secret D\n')
+        self.assertEqual(self.shell.calls, ['--export --armor A B', '--export C', '--export-secret-keys D'])
+
+    def test_not_combined(self):
+        self.batch('export A | less\nexport B\nexport --output a.gpg C\nexport --output a.gpg D\nrefresh\nrefresh\n')
+        self.assertEqual(self.shell.calls, ['--export A | less', '--export B',
+                                            '--export --output a.gpg C', '--export --output a.gpg D',
+                                            '--refresh-keys', '--refresh-keys'])
+
+    def test_other_commands_separate_groups(self):
+        self.batch('recv A\nlist\nrecv B\nsend C\nsend D\n')
+        self.assertEqual(self.shell.calls, ['--recv-keys A', '--list-keys', '--recv-keys B', '--send-keys C D'])
+
+    def test_return_codes(self):
+        self.shell.results['--recv-keys'] = 2
+        rcs = self.batch('list\nrecv A\nrecv B\nlist\n')
+        self.assertEqual(rcs, [0, 2, 2, 0])
+
+    def test_per_line_return_codes(self):
+        self.shell = StatusGPGKeys(stdout=StringIO(), stderr=StringIO())
+        self.shell.results['--recv-keys'] = 2
+        self.shell.status = [b'[GNUPG:] IMPORT_OK 0 ' + b'A' * 32 + b'11111111',
+                             b'[GNUPG:] NODATA 1']
+        rcs = self.batch('recv 0x11111111\nrecv 0x22222222\nrecv 11111111 22222222\nrecv Alice\n')
+        self.assertEqual(rcs, [0, 2, 2, 2])
+        self.shell.results['--export'] = 2
+        self.shell.status = [b'[GNUPG:] EXPORTED ' + b'B' * 32 + b'22222222']
+        rcs = self.batch('export 0x22222222\nexport 0x11111111\n')
+        self.assertEqual(rcs, [0, 2])
+        self.assertEqual(self.shell.gpgstatus, None)
+
+    def test_quit(self):
+        rcs = self.batch('recv A\nquit\nrecv B\n')
+        self.assertEqual(self.shell.calls, ['--recv-keys A'])
+        self.assertEqual(rcs, [0, 0])
+
+    def test_run(self):
+        self.shell.stdin = StringIO('del A\ndel B\n')
+        self.assertEqual(self.shell.run([]), 0)
+        self.assertEqual(self.shell.calls, ['--delete-key A B'])
+
+    def test_run_stdin_args(self):
+        self.shell.stdin = StringIO('recv @-\n0x11111111\n')
+        self.assertEqual(self.shell.run([]), 1)
+        self.assertEqual(self.shell.calls, [])
+        self.assertEqual(self.stderr.getvalue().splitlines()[0], 'gpgkeys: @-: commands are read from stdin')
+
+    def test_run_bad_keyid(self):
+        self.shell = StatusGPGKeys(stdout=StringIO(), stderr=StringIO())
+        self.shell.results['--recv-keys'] = 2
+        self.shell.status = [b'[GNUPG:] IMPORT_OK 0 ' + b'A' * 32 + b'11111111']
+        self.shell.stdin = StringIO('recv 0x11111111\nrecv 0x22222222\nlist\n')
+        self.assertEqual(self.shell.run([]), 2)
+        self.assertEqual(self.shell.calls, ['--recv-keys 0x11111111 0x22222222', '--list-keys'])
+
+    def test_run_undecodable(self):
+        process = subprocess.Popen([sys.executable, '-m', 'gpgkeys'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+        stdout, stderr = process.communicate(b'shell echo M\xfcller\n')
+        self.assertEqual(stderr, b'')
+        self.assertEqual(stdout, b'M\xfcller\n')
+        self.assertEqual(process.returncode, 0)
+
+
+class PopenTests(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = GPGKeys(stdout=StringIO(), stderr=StringIO())
+        # Keep the terminal out of reach
+        self.shell.captured = []
+
+    def test_argv_unchanged(self):
+        args = ('Alice Smith', "it's", '$HOME', '*', '| less', '')
+        rc, output = self.shell.popen(sys.executable, '-c', 'import sys; print(sys.argv[1:])',
+                                      *args, **dict(stdout=subprocess.PIPE, shell=False))
+        self.assertEqual(rc, 0)
+        self.assertEqual(output.decode('utf-8').strip(), repr(list(args)))
+
+    def test_missing_executable(self):
+        rc, output = self.shell.popen('gpgkeys-no-such-command', 'a b',
+                                      **dict(stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False))
+        self.assertEqual(rc, 127)
+
+    def test_shell_words(self):
+        calls = []
+        self.shell.system = lambda *args, **kw: calls.append((args, kw.get('shell', True)))
+        self.shell.shellsystem('gpg', '--list-keys', "'Alice Smith'")
+        self.shell.shellsystem('gpg', '--list-keys', '|', 'less')
+        self.assertEqual(calls, [(('gpg', '--list-keys', 'Alice Smith'), False),
+                                 (('gpg', '--list-keys', '|', 'less'), True)])
+
+
+class ChunkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.umask = os.umask(0o022)
+        self.shell = FakeGPGKeys(stdout=StringIO(), stderr=StringIO())
+        self.shell.arg_max = len(GNUPGEXE) + 50
+
+    def tearDown(self):
+        os.umask(self.umask)
+
+    def test_chunkargs(self):
+        self.assertEqual(list(chunkargs(['aaaa', 'bbbb', 'cccc'], 10)), [('aaaa', 'bbbb'), ('cccc',)])
+        self.assertEqual(list(chunkargs(['aaaaaaaaaaaa', 'bb'], 10)), [('aaaaaaaaaaaa',), ('bb',)])
+        self.assertEqual(list(chunkargs(['\xe4\xe4\xe4\xe4', 'bbbb'], 10)), [('\xe4\xe4\xe4\xe4',), ('bbbb',)])
+        self.assertEqual(list(chunkargs([], 10)), [])
+
+    def test_getargmax(self):
+        self.assertTrue(1024 <= getargmax() <= 131072)
+
+    def test_chunked(self):
+        keyids = ['0x%08X' % i for i in range(10)]
+        self.shell.onecmd('recv ' + ' '.join(keyids))
+        self.assertEqual(self.shell.calls, [
+            '--recv-keys ' + ' '.join(keyids[:3]),
+            '--recv-keys ' + ' '.join(keyids[3:6]),
+            '--recv-keys ' + ' '.join(keyids[6:9]),
+            '--recv-keys ' + keyids[9]])
+
+    def test_options_repeated(self):
+        keyids = ['0x%08X' % i for i in range(5)]
+        self.shell.onecmd('export --armor ' + ' '.join(keyids))
+        self.assertEqual(self.shell.calls, [
+            '--export --armor ' + ' '.join(keyids[:2]),
+            '--export --armor ' + ' '.join(keyids[2:4]),
+            '--export --armor ' + keyids[4]])
+
+    def test_highest_return_code(self):
+        results = [0, 2, 0]
+        self.shell.gnupg = lambda *args: results.pop(0)
+        self.shell.onecmd('del ' + ' '.join('0x%08X' % i for i in range(9)))
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(results, [])
+
+    def test_not_chunked(self):
+        args = ' '.join('0x%08X' % i for i in range(10))
+        self.shell.onecmd('export --output keys.gpg ' + args)
+        self.shell.onecmd('export %s | less' % args)
+        self.assertEqual(self.shell.calls, ['--export --output keys.gpg ' + args,
+                                            '--export %s | less' % args])
+
+
+class SlowGPGKeys(FakeGPGKeys):
+    """Write the gpg arguments after a delay given as first key id."""
+
+    def gnupg(self, *args, **kw):
+        self.calls.append(' '.join(args))
+        time.sleep(float(args[-1]) if args[-1][:1].isdigit() else 0)
+        self.stdout.write(' '.join(args) + '\n')
+        return self.results.get(args[0], 0)
+
+
+class ScriptTests(unittest.TestCase):
+
+    def setUp(self):
+        self.umask = os.umask(0o022)
+        self.stdout = StringIO()
+        self.shell = SlowGPGKeys(stdout=self.stdout, stderr=StringIO())
+
+    def tearDown(self):
+        os.umask(self.umask)
+
+    def test_parallelgroup(self):
+        lines = ['list', 'listsig A', 'export --output a.gpg', 'fdump b.gpg', 'export --output b.gpg']
+        self.assertEqual(self.shell.parallelgroup(lines, 0), lines[:4])
+        self.assertEqual(self.shell.parallelgroup(lines, 4), lines[4:])
+
+    def test_parallelgroup_serial(self):
+        lines = ['list', 'recv A', 'list', 'list | less', 'export --secret A', 'fdump', 'unknown']
+        self.assertEqual(self.shell.parallelgroup(lines, 0), ['list'])
+        for i in range(1, len(lines)):
+            self.assertEqual(self.shell.parallelgroup(lines, i), [] if i != 2 else ['list'])
+
+    def test_parallelgroup_same_output(self):
+        lines = ['export --output a.gpg A', 'export --output ./a.gpg B']
+        self.assertEqual(self.shell.parallelgroup(lines, 0), lines[:1])
+
+    def test_script_order(self):
+        rc = self.shell.runscript(['list 0.3\n', 'list 0.2\n', 'listsig 0.1\n', 'recv A\n', 'list 0.1\n', 'list 0\n'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(self.stdout.getvalue().splitlines(), [
+            '--list-keys 0.3', '--list-keys 0.2', '--list-sigs 0.1', '--recv-keys A',
+            '--list-keys 0.1', '--list-keys 0'])
+
+    def test_concurrent(self):
+        start = time.time()
+        self.shell.runscript(['list 0.2', 'list 0.2', 'list 0.2', 'list 0.2'])
+        self.assertTrue(time.time() - start < 0.6)
+
+    def test_return_code(self):
+        self.shell.results['--list-sigs'] = 2
+        self.assertEqual(self.shell.runscript(['list', 'listsig']), 2)
+        self.assertEqual(self.shell.runscript(['listsig', 'list']), 0)
+
+    def test_quit(self):
+        self.shell.runscript(['recv A', 'quit', 'recv B'])
+        self.assertEqual(self.shell.calls, ['--recv-keys A'])
+
+    def test_invalid_lines(self):
+        rc = self.shell.runscript(['recv A\n', '# comment\n', '\n', 'list --bogus\n',
+                                   'bg time unknown\n', 'list B &\n'])
+        self.assertEqual(rc, 1)
+        self.assertEqual(self.shell.calls, [])
+        self.assertEqual(self.shell.stderr.getvalue().splitlines(), [
+            'gpgkeys: line 4: option --bogus not recognized',
+            "gpgkeys: line 5: unknown command 'unknown'"])
+
+    def test_captured(self):
+        shell = GPGKeys(stdout=self.stdout, stderr=StringIO())
+        captured = shell.runcaptured('shell echo hello; echo world >&2')
+        self.assertEqual(self.stdout.getvalue(), '')
+        shell.writecaptured(captured)
+        self.assertEqual(self.stdout.getvalue(), 'hello\n')
+        self.assertEqual(shell.stderr.getvalue(), 'world\n')
+
+
+class JobTests(unittest.TestCase):
+
+    def setUp(self):
+        self.umask = os.umask(0o022)
+        self.stdout = StringIO()
+        self.shell = SlowGPGKeys(stdout=self.stdout, stderr=StringIO())
+        self.warmups = []
+        self.shell.warmup = lambda: self.warmups.append(True)
+
+    def tearDown(self):
+        os.umask(self.umask)
+
+    def test_background(self):
+        start = time.time()
+        self.shell.onecmd('list 0.2 &')
+        self.shell.onecmd('bg listsig 0.2')
+        self.assertTrue(time.time() - start < 0.2)
+        self.assertEqual(self.stdout.getvalue(), '[1] list 0.2\n[2] listsig 0.2\n')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.stdout.getvalue().splitlines()[2:], [
+            '--list-keys 0.2', '[1]  Done     list 0.2',
+            '--list-sigs 0.2', '[2]  Done     listsig 0.2'])
+        self.assertEqual(self.shell.bgjobs, [])
+
+    def test_jobs(self):
+        self.shell.onecmd('list 0.2 &')
+        self.shell.onecmd('list 0 &')
+        self.shell.bgjobs[1].wait()
+        self.shell.onecmd('jobs')
+        self.assertEqual(self.stdout.getvalue().splitlines()[2:], [
+            '--list-keys 0', '[2]  Done     list 0',
+            '[1]  Running  list 0.2'])
+
+    def test_fg(self):
+        self.shell.results['--list-sigs'] = 2
+        self.shell.onecmd('list 0 &')
+        self.shell.onecmd('listsig 0.1 &')
+        self.shell.onecmd('fg 2')
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(self.stdout.getvalue().splitlines()[2:], [
+            'listsig 0.1', '--list-sigs 0.1'])
+        self.shell.onecmd('fg %1')
+        self.assertEqual(self.shell.rc, 0)
+        self.shell.onecmd('fg')
+        self.assertEqual(self.shell.rc, 1)
+        self.assertEqual(self.shell.stderr.getvalue(), 'gpgkeys: fg: no such job\n')
+
+    def test_shell_escape(self):
+        commands = []
+        self.shell.system = lambda *args: commands.append(args)
+        self.shell.onecmd('!sleep 10 &')
+        self.shell.onecmd('shell sleep 20 &')
+        self.assertEqual(self.shell.bgjobs, [])
+        self.assertEqual(commands, [('sleep', '10', '&'), ('sleep', '20', '&')])
+
+    def test_postcmd(self):
+        self.shell.onecmd('list 0 &')
+        self.shell.bgjobs[0].wait()
+        self.shell.postcmd(None, 'list 0 &')
+        self.assertEqual(self.stdout.getvalue().splitlines()[1:], [
+            '--list-keys 0', '[1]  Done     list 0'])
+
+    def test_exit_status(self):
+        self.shell.results['--recv-keys'] = 2
+        self.shell.onecmd('recv 0 &')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(self.stdout.getvalue().splitlines()[-1], '[1]  Exit 2   recv 0')
+
+    def test_warmup(self):
+        self.shell.onecmd('list 0 &')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.warmups, [])
+        self.shell.onecmd('recv 0 &')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.warmups, [True])
+
+    def test_batch_waits(self):
+        rcs = self.shell.batch(['recv 0.1 &\n', 'list 0\n'])
+        self.assertEqual(rcs, [0, 0])
+        self.assertEqual(self.stdout.getvalue().splitlines(), [
+            '[1] recv 0.1', '--list-keys 0', '--recv-keys 0.1', '[1]  Done     recv 0.1'])
+
+    def test_interactive(self):
+        for line in ('edit 0 &', 'bg sign 0', 'bg lsig 0', 'del 0 &', 'genkey &', 'bg genrev 0'):
+            self.shell.rc = 0
+            self.shell.onecmd(line)
+            self.assertEqual(self.shell.rc, 1)
+        self.assertEqual(self.shell.bgjobs, [])
+        self.assertEqual(self.shell.calls, [])
+        self.assertEqual(self.shell.stderr.getvalue().splitlines()[:3], [
+            'gpgkeys: edit cannot run in the background',
+            'gpgkeys: sign cannot run in the background',
+            'gpgkeys: lsign cannot run in the background'])
+
+    def test_run_waits(self):
+        self.shell.results['--recv-keys'] = 2
+        self.assertEqual(self.shell.run(['bg', 'recv', '0.1']), 2)
+        self.assertEqual(self.shell.bgjobs, [])
+        self.assertEqual(self.stdout.getvalue().splitlines(), [
+            '[1] recv 0.1', '--recv-keys 0.1', '[1]  Exit 2   recv 0.1'])
+
+    def test_quit_waits(self):
+        self.shell.onecmd('recv 0.1 &')
+        self.assertEqual(self.shell.onecmd('quit'), True)
+        self.assertEqual(self.shell.bgjobs, [])
+        self.assertEqual(self.shell.stderr.getvalue(), 'gpgkeys: waiting for 1 background jobs\n')
+
+    def test_detached(self):
+        shell = GPGKeys(stdout=self.stdout, stderr=StringIO())
+        command = 'shell %s -c "import os; print(os.getsid(0))"' % sys.executable
+        captured = shell.runcaptured(command)
+        detached = shell.runcaptured(command, detached=True)
+        shell.writecaptured(captured)
+        shell.writecaptured(detached)
+        sids = self.stdout.getvalue().split()
+        self.assertEqual(sids[0], str(os.getsid(0)))
+        self.assertNotEqual(sids[1], str(os.getsid(0)))
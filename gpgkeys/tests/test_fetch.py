@@ -0,0 +1,308 @@
+import unittest
+import os
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gpgkeys.testing import JailSetup
+from gpgkeys.testing import HKPServer
+from gpgkeys.fetch import Fetcher
+from gpgkeys.fetch import FetchError
+from gpgkeys.fetch import keyserver_url
+from gpgkeys.fetch import find_keyserver
+from gpgkeys.fetch import normalize
+from gpgkeys.fetch import fingerprints
+from gpgkeys.fetch import screen
+from gpgkeys.fetch import gnupg_version
+from gpgkeys.fetch import DEFAULT_KEYSERVER
+from gpgkeys.utils import parallel_map
+
+from gpgkeys.tests.test_batch import FakeGPGKeys
+
+ALICE = '2527287DEDE53DC1FC1CD68F416FFE5ED11C78DF'
+BOB = '916E19F0E0037CFCBE922F38BAA5B175E12CFA6A'
+EVE = 'E54D8A5F3E0B1E8A2BBEDC5C78C97E743C8A2D90'
+
+
+def armored(name):
+    return (b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n' + name +
+            b'\n-----END PGP PUBLIC KEY BLOCK-----\n')
+
+
+def listing(*fprs):
+    lines = []
+    for fpr in fprs:
+        lines.append('pub:-:255:22:%s:1792274500:::-:::scSC:::::ed25519:::0:' % fpr[-16:])
+        lines.append('fpr:::::::::%s:' % fpr)
+        lines.append('sub:-:255:18:%s:1792274500::::::e:::::cv25519::' % ('0' * 16))
+        lines.append('fpr:::::::::%s:' % ('0' * 40))
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+# What show-only imports of the served key data list
+LISTINGS = {
+    armored(b'alice'): listing(ALICE),
+    armored(b'bob'): listing(BOB),
+    armored(b'eve'): listing(EVE),
+    armored(b'alice and eve'): listing(ALICE, EVE),
+}
+
+
+class KeyserverTests(JailSetup):
+
+    def test_keyserver_url(self):
+        self.assertEqual(keyserver_url('keys.example.org'), 'http://keys.example.org:11371')
+        self.assertEqual(keyserver_url('hkp://keys.example.org'), 'http://keys.example.org:11371')
+        self.assertEqual(keyserver_url('hkps://keys.example.org'), 'https://keys.example.org:443')
+        self.assertEqual(keyserver_url('hkp://127.0.0.1:8080'), 'http://127.0.0.1:8080')
+        self.assertEqual(keyserver_url('hkp://[::1]'), 'http://[::1]:11371')
+        self.assertRaises(FetchError, keyserver_url, 'ldap://keys.example.org')
+
+    def test_find_keyserver(self):
+        self.assertEqual(find_keyserver(self.tempdir), DEFAULT_KEYSERVER)
+        with open('dirmngr.conf', 'wt') as f:
+            f.write('keyserver hkp://dirmngr.example.org\n')
+        self.assertEqual(find_keyserver(self.tempdir), 'hkp://dirmngr.example.org')
+        with open('gpg.conf', 'wt') as f:
+            f.write('keyserver hkp://one.example.org\nkeyserver hkp://two.example.org\n')
+        self.assertEqual(find_keyserver(self.tempdir), 'hkp://two.example.org')
+
+    def test_normalize(self):
+        self.assertEqual(normalize('0xd11c78df'), '0xD11C78DF')
+        self.assertEqual(normalize('416FFE5ED11C78DF'), '0x416FFE5ED11C78DF')
+        self.assertEqual(normalize('2527 287D EDE5 3DC1 FC1C D68F 416F FE5E D11C 78DF'), '0x' + ALICE)
+        self.assertRaises(FetchError, normalize, 'Alice')
+
+
+class ScreenTests(unittest.TestCase):
+
+    def test_fingerprints(self):
+        self.assertEqual(fingerprints(listing(ALICE, BOB)), [ALICE, BOB])
+        self.assertEqual(fingerprints(b''), [])
+
+    def test_screen(self):
+        screen('0xD11C78DF', listing(ALICE))
+        screen('0x416FFE5ED11C78DF', listing(ALICE))
+        screen(ALICE.lower(), listing(ALICE))
+
+    def test_wrong_key(self):
+        self.assertRaises(FetchError, screen, '0x' + BOB, listing(EVE))
+        self.assertRaises(FetchError, screen, '0x' + BOB[-8:], listing(EVE))
+
+    def test_extra_keys(self):
+        self.assertRaises(FetchError, screen, '0xD11C78DF', listing(ALICE, EVE))
+
+    def test_no_keys(self):
+        self.assertRaises(FetchError, screen, '0xD11C78DF', b'')
+
+    def test_gnupg_version(self):
+        self.assertEqual(gnupg_version(b'gpg (GnuPG) 2.2.40\nlibgcrypt 1.10.1\n'), (2, 2, 40))
+        self.assertEqual(gnupg_version(b'gpg (GnuPG/MacGPG2) 2.2.24\n'), (2, 2, 24))
+        self.assertEqual(gnupg_version(b'gpg (GnuPG) 1.4.23\n'), (1, 4, 23))
+        self.assertEqual(gnupg_version(b'unknown\n'), ())
+
+
+class ParallelMapTests(unittest.TestCase):
+
+    def test_order(self):
+        self.assertEqual(list(parallel_map(lambda x: x * 2, range(20), 4)), list(range(0, 40, 2)))
+        self.assertEqual(list(parallel_map(lambda x: x, [], 4)), [])
+
+    def test_lazy(self):
+        taken = []
+        def items():
+            for i in range(100):
+                taken.append(i)
+                yield i
+        results = parallel_map(lambda x: x, items(), 2)
+        self.assertEqual(next(results), 0)
+        self.assertEqual(len(taken), 4)
+        results.close()
+
+    def test_error(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        results = parallel_map(fail, range(10), 2)
+        self.assertEqual([next(results) for i in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, results)
+
+
+class FetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HKPServer({ALICE: armored(b'alice'), BOB: armored(b'bob')}).start()
+        self.fetcher = Fetcher(self.server.url, 4)
+        self.fetcher.backoff = 0.01
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_fetch(self):
+        self.assertEqual(self.fetcher.fetch('0xD11C78DF'), armored(b'alice'))
+        self.assertEqual(self.fetcher.fetch(BOB), armored(b'bob'))
+        self.assertEqual(self.server.requests, ['0xD11C78DF', '0x' + BOB])
+
+    def test_not_found(self):
+        self.assertRaises(FetchError, self.fetcher.fetch, '0x12345678')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retry(self):
+        self.server.failures = 2
+        self.assertEqual(self.fetcher.fetch('0xD11C78DF'), armored(b'alice'))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_give_up(self):
+        self.server.failures = 10
+        self.fetcher.retries = 2
+        self.assertRaises(FetchError, self.fetcher.fetch, '0xD11C78DF')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        self.fetcher.timeout = 0.05
+        self.fetcher.retries = 1
+        self.assertRaises(FetchError, self.fetcher.fetch, '0xD11C78DF')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_fetch_all(self):
+        result = list(self.fetcher.fetch_all(['0xD11C78DF', '0x12345678', 'Bob', BOB]))
+        self.assertEqual(result, [
+            ('0xD11C78DF', armored(b'alice'), None),
+            ('0x12345678', None, 'not found'),
+            ('Bob', None, 'not a key id or fingerprint'),
+            (BOB, armored(b'bob'), None)])
+
+
+class FetchSetup(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.umask = os.umask(0o022)
+        self.server = HKPServer({ALICE: armored(b'alice'), BOB: armored(b'bob')}).start()
+        self.stderr = StringIO()
+        self.shell = FakeGPGKeys(stdout=StringIO(), stderr=self.stderr, jobs=4)
+        self.shell.listfingerprints = lambda args: [ALICE, '0' * 40, BOB]
+        self.shell.gnupg_version = (2, 2, 40)
+        self.shell.showkeys = LISTINGS.get
+        self.imported = []
+        gnupg = self.shell.gnupg
+        def record(*args):
+            with open(args[-1], 'rb') as f:
+                self.imported.append(f.read())
+            return gnupg(*args)
+        self.shell.gnupg = record
+
+    def tearDown(self):
+        self.server.stop()
+        os.umask(self.umask)
+        JailSetup.tearDown(self)
+
+
+class RefreshTests(FetchSetup):
+
+    def test_refresh(self):
+        self.shell.onecmd('refresh --keyserver %s' % self.server.url)
+        self.assertEqual(self.imported, [armored(b'alice') + armored(b'bob')])
+        self.assertEqual(len(self.shell.calls), 1)
+        self.assertTrue(self.shell.calls[0].startswith(
+            '--import --keyserver %s --keyserver-options no-honor-keyserver-url ' % self.server.url))
+        self.assertEqual(self.stderr.getvalue(),
+            'gpgkeys: %s: not found\ngpgkeys: fetched 2 of 3 keys\n' % ('0' * 40))
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(os.path.exists(self.shell.calls[0].split()[-1]), False)
+
+    def test_refresh_wrong_key(self):
+        self.server.keys[BOB] = armored(b'eve')
+        self.shell.onecmd('refresh --keyserver %s' % self.server.url)
+        self.assertEqual(self.imported, [armored(b'alice')])
+        self.assertEqual(self.stderr.getvalue().splitlines()[1:], [
+            'gpgkeys: %s: keyserver returned key %s' % (BOB, EVE),
+            'gpgkeys: fetched 1 of 3 keys'])
+        self.assertEqual(self.shell.rc, 2)
+
+    def test_refresh_extra_keys(self):
+        self.server.keys[ALICE] = armored(b'alice and eve')
+        self.shell.onecmd('refresh --keyserver %s' % self.server.url)
+        self.assertEqual(self.imported, [armored(b'bob')])
+        self.assertEqual(self.stderr.getvalue().splitlines()[0],
+            'gpgkeys: %s: keyserver returned 2 keys' % ALICE)
+
+    def test_refresh_sequential(self):
+        self.shell.jobs = 1
+        self.shell.gnupg = self.shell.__class__.gnupg.__get__(self.shell)
+        self.shell.onecmd('refresh')
+        self.assertEqual(self.shell.calls, ['--refresh-keys'])
+
+    def test_refresh_old_gnupg(self):
+        # No --import-options show-only to screen keys with
+        self.shell.gnupg_version = (2, 0, 22)
+        self.shell.gnupg = self.shell.__class__.gnupg.__get__(self.shell)
+        self.shell.onecmd('refresh --keyserver %s' % self.server.url)
+        self.assertEqual(len(self.shell.calls), 1)
+        self.assertTrue(self.shell.calls[0].startswith('--refresh-keys '))
+        self.assertEqual(self.server.requests, [])
+
+    def test_bad_keyserver(self):
+        self.shell.onecmd('refresh --keyserver ldap://keys.example.org')
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(self.imported, [])
+
+
+class RecvTests(FetchSetup):
+
+    def test_recv(self):
+        self.shell.onecmd('recv --keyserver %s 0xD11C78DF %s' % (self.server.url, BOB))
+        self.assertEqual(self.imported, [armored(b'alice') + armored(b'bob')])
+        self.assertEqual(self.shell.rc, 0)
+        self.assertEqual(self.stderr.getvalue(), '')
+
+    def test_recv_wrong_key(self):
+        self.server.keys[BOB] = armored(b'eve')
+        self.shell.onecmd('recv --keyserver %s 0xD11C78DF 0x%s' % (self.server.url, BOB))
+        self.assertEqual(self.imported, [armored(b'alice')])
+        self.assertEqual(self.stderr.getvalue().splitlines(), [
+            'gpgkeys: 0x%s: keyserver returned key %s' % (BOB, EVE),
+            'gpgkeys: fetched 1 of 2 keys'])
+        self.assertEqual(self.shell.rc, 2)
+
+    def test_recv_wrong_key_only(self):
+        self.server.keys[BOB] = armored(b'eve')
+        self.shell.onecmd('recv --keyserver %s %s' % (self.server.url, BOB[-8:]))
+        self.assertEqual(self.imported, [])
+        self.assertEqual(self.shell.calls, [])
+        self.assertEqual(self.shell.rc, 2)
+
+    def test_recv_status(self):
+        self.shell.verbose = True
+        self.shell.onecmd('recv --keyserver %s 0xD11C78DF 0x12345678' % self.server.url)
+        self.assertEqual(self.stderr.getvalue().splitlines()[1:4], [
+            'gpgkeys: 0xD11C78DF: fetched',
+            'gpgkeys: 0x12345678: not found',
+            'gpgkeys: fetched 1 of 2 keys'])
+        self.assertEqual(self.shell.rc, 2)
+
+    def test_recv_retries(self):
+        self.server.failures = 3
+        self.shell.fetch_retries = 1
+        self.shell.onecmd('recv --keyserver %s 0xD11C78DF' % self.server.url)
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(self.imported, [])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_recv_timeout(self):
+        self.server.delay = 0.5
+        self.shell.fetch_timeout = 0.05
+        self.shell.fetch_retries = 0
+        self.shell.onecmd('recv --keyserver %s 0xD11C78DF' % self.server.url)
+        self.assertEqual(self.shell.rc, 2)
+        self.assertEqual(self.imported, [])
+
+    def test_recv_file(self):
+        with open('keys.txt', 'wt') as f:
+            f.write('0xD11C78DF\n%s\n' % BOB)
+        self.shell.onecmd('recv --keyserver %s @keys.txt' % self.server.url)
+        self.assertEqual(self.imported, [armored(b'alice') + armored(b'bob')])
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import marshal
+
+from gpgkeys.completions.index import PrefixIndex
+from gpgkeys.completions.index import StringTable
+from gpgkeys.completions.index import KeyIndexBuilder
+from gpgkeys.completions.index import KeyIndex
+from gpgkeys.completions.index import CertificateTable
+from gpgkeys.completions.index import TrigramIndex
+
+
+class PrefixIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        for key in ('bob', 'alice', 'alfred', 'al', 'carol', 'alicia'):
+            self.index[key] = key.upper()
+
+    def test_is_dict(self):
+        self.assertTrue(isinstance(self.index, dict))
+        self.assertEqual(self.index['alice'], 'ALICE')
+        self.assertEqual(len(self.index), 6)
+
+    def test_sortedkeys(self):
+        self.assertEqual(self.index.sortedkeys(),
+            ['al', 'alfred', 'alice', 'alicia', 'bob', 'carol'])
+
+    def test_startswith(self):
+        self.assertEqual(self.index.startswith('al'),
+            ['al', 'alfred', 'alice', 'alicia'])
+        self.assertEqual(self.index.startswith('ali'), ['alice', 'alicia'])
+        self.assertEqual(self.index.startswith('alice'), ['alice'])
+        self.assertEqual(self.index.startswith('c'), ['carol'])
+
+    def test_startswith_empty_prefix(self):
+        self.assertEqual(self.index.startswith(''), self.index.sortedkeys())
+
+    def test_startswith_no_match(self):
+        self.assertEqual(self.index.startswith('alz'), [])
+        self.assertEqual(self.index.startswith('a0'), [])
+        self.assertEqual(self.index.startswith('zed'), [])
+        self.assertEqual(PrefixIndex().startswith('a'), [])
+
+    def test_setitem_invalidates(self):
+        self.index.sortedkeys()
+        self.index['alan'] = 'ALAN'
+        self.assertEqual(self.index.startswith('ala'), ['alan'])
+
+    def test_setdefault_invalidates(self):
+        self.index.sortedkeys()
+        self.assertEqual(self.index.setdefault('alan', 'ALAN'), 'ALAN')
+        self.assertEqual(self.index.setdefault('alan', 'OTHER'), 'ALAN')
+        self.assertEqual(self.index.startswith('ala'), ['alan'])
+
+    def test_delitem_invalidates(self):
+        self.index.sortedkeys()
+        del self.index['alice']
+        self.assertEqual(self.index.startswith('ali'), ['alicia'])
+
+    def test_clear_invalidates(self):
+        self.index.sortedkeys()
+        self.index.clear()
+        self.assertEqual(self.index.startswith(''), [])
+
+
+class StringTableTests(unittest.TestCase):
+
+    def setUp(self):
+        self.table = StringTable(['al', 'alfred', 'alice', 'alicia', 'bob', 'm\xe4dchen', 'zo\u20ac'])
+
+    def test_sequence(self):
+        self.assertEqual(len(self.table), 7)
+        self.assertEqual(self.table[0], 'al')
+        self.assertEqual(self.table[5], 'm\xe4dchen')
+        self.assertEqual(self.table[-1], 'zo\u20ac')
+        self.assertEqual(list(self.table)[:2], ['al', 'alfred'])
+
+    def test_find(self):
+        self.assertEqual(self.table.find('alice'), 2)
+        self.assertEqual(self.table.find('m\xe4dchen'), 5)
+        self.assertEqual(self.table.find('ali'), -1)
+        self.assertEqual(self.table.find('zzz'), -1)
+
+    def test_search(self):
+        self.assertEqual(self.table.search('al'), (0, 4))
+        self.assertEqual(self.table.search('ali'), (2, 4))
+        self.assertEqual(self.table.search(''), (0, 7))
+        self.assertEqual(self.table.search('m\xe4'), (5, 6))
+        self.assertEqual(self.table.search('c'), (5, 5))
+
+    def test_empty(self):
+        table = StringTable()
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.find('a'), -1)
+        self.assertEqual(table.search('a'), (0, 0))
+
+    def test_dump_load(self):
+        table = StringTable.load(marshal.loads(marshal.dumps(self.table.dump())))
+        self.assertEqual(list(table), list(self.table))
+
+
+class KeyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        builder = KeyIndexBuilder()
+        builder.add('AAAA1111', 'Alice Smith <alice@example.org>', 'utf-8', ['Alice', 'Smith'])
+        builder.add('AAAA1111', 'Alice S. <alice@example.com>', 'utf-8', ['Alice', 'S.'])
+        builder.add('BBBB2222', 'B\xf6b M\xfcller', 'latin-1', ['B\xf6b', 'M\xfcller'])
+        builder.add('CCCC3333', 'Alice Smith <alice@example.org>', 'latin-1', ['Alice', 'Smith'])
+        self.index = builder.build()
+
+    def test_by_keyid(self):
+        self.assertEqual(self.index.by_keyid.startswith(''), ['AAAA1111', 'BBBB2222', 'CCCC3333'])
+        self.assertEqual(self.index.by_keyid['AAAA1111'], 'Alice Smith <alice@example.org>')
+        self.assertEqual(self.index.by_keyid['CCCC3333'], 'Alice Smith <alice@example.org>')
+
+    def test_by_userid(self):
+        self.assertEqual(self.index.by_userid.startswith('alice'),
+            ['alice s. <alice@example.com>', 'alice smith <alice@example.org>'])
+        self.assertEqual(self.index.by_userid['b\xf6b m\xfcller'], 'B\xf6b M\xfcller')
+
+    def test_by_name(self):
+        self.assertEqual(self.index.by_name.startswith(''), ['alice', 'b\xf6b', 'm\xfcller', 's.', 'smith'])
+        self.assertEqual(self.index.by_name['smith'], 'Smith')
+        self.assertEqual(self.index.by_name.get('bob'), None)
+        self.assertRaises(KeyError, self.index.by_name.__getitem__, 'bob')
+
+    def test_encoding(self):
+        self.assertEqual(self.index.encoding('Alice Smith <alice@example.org>'), 'utf-8')
+        self.assertEqual(self.index.encoding('B\xf6b M\xfcller'), 'latin-1')
+        self.assertEqual(self.index.encoding('M\xfcller'), 'latin-1')
+        self.assertEqual(self.index.encoding('Smith'), 'utf-8')
+        self.assertEqual(self.index.encoding('smith'), None)
+        self.assertEqual(self.index.encoding('AAAA1111'), None)
+
+    def test_find(self):
+        self.assertEqual(self.index.find('example.org'), [
+            ('AAAA1111', 'Alice Smith <alice@example.org>')])
+        self.assertEqual(self.index.find('M\xfcLL'), [('BBBB2222', 'B\xf6b M\xfcller')])
+        self.assertEqual(self.index.find('mueller'), [])
+
+    def test_find_similar(self):
+        self.assertEqual(self.index.find('smitt'), [])
+        self.assertEqual(self.index.find('smitt', similar=True), [
+            ('AAAA1111', 'Alice Smith <alice@example.org>')])
+        self.assertEqual(self.index.find('jones', similar=True), [])
+        self.assertEqual(self.index.find('alice smyth', similar=True), [
+            ('AAAA1111', 'Alice Smith <alice@example.org>'),
+            ('AAAA1111', 'Alice S. <alice@example.com>')])
+
+    def test_dump_load(self):
+        index = KeyIndex.load(marshal.loads(marshal.dumps(self.index.dump())))
+        self.assertEqual(index.by_keyid['BBBB2222'], 'B\xf6b M\xfcller')
+        self.assertEqual(index.by_name.startswith('m'), ['m\xfcller'])
+        self.assertEqual(index.encoding('M\xfcller'), 'latin-1')
+        self.assertEqual(index.trigrams, None)
+
+    def test_dump_load_trigrams(self):
+        self.index.substrings()
+        index = KeyIndex.load(marshal.loads(marshal.dumps(self.index.dump())))
+        self.assertNotEqual(index.trigrams, None)
+        self.assertTrue(index.trigrams.strings is index.by_userid.keys)
+        self.assertEqual(index.find('example.com'), self.index.find('example.com'))
+
+    def test_empty(self):
+        index = KeyIndex()
+        self.assertEqual(index.by_keyid.startswith(''), [])
+        self.assertEqual(index.encoding('Alice'), None)
+
+    def test_add(self):
+        self.index.add('DDDD4444', 'Carol Clark', 'utf-8', ['Carol', 'Clark'])
+        self.index.add('AAAA1111', 'Alice Smith <alice@example.org>', 'latin-1', ['Alice', 'Smith'])
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.by_keyid.startswith(''), ['AAAA1111', 'BBBB2222', 'CCCC3333', 'DDDD4444'])
+        self.assertEqual(self.index.by_keyid['DDDD4444'], 'Carol Clark')
+        self.assertEqual(self.index.by_name.startswith('c'), ['carol', 'clark'])
+        self.assertEqual(self.index.encoding('Alice Smith <alice@example.org>'), 'utf-8')
+        self.assertEqual(self.index.encoding('Clark'), 'utf-8')
+        self.assertEqual(self.index.find('clar'), [('DDDD4444', 'Carol Clark')])
+
+    def test_add_dump_load(self):
+        self.index.add('DDDD4444', 'Carol Clark', 'utf-8', ['Carol', 'Clark'])
+        self.index.add_key('DDDD4444', 'EEEEFFFFDDDD4444', 'F' * 32 + 'DDDD4444')
+        index = KeyIndex.load(marshal.loads(marshal.dumps(self.index.dump())))
+        self.assertEqual(index.by_keyid['DDDD4444'], 'Carol Clark')
+        self.assertEqual(index.by_longid['EEEEFFFFDDDD4444'], 'Carol Clark')
+        self.assertEqual(index.encoding('Carol'), 'utf-8')
+
+    def build_certs(self):
+        builder = KeyIndexBuilder()
+        builder.add('AAAA1111', 'Alice Smith <alice@example.org>', 'utf-8', ['Alice', 'Smith'])
+        builder.add('AAAA1111', 'Alice S. <alice@example.com>', 'utf-8', ['Alice', 'S.'])
+        builder.add_key('AAAA1111', 'EEEEEEEEAAAA1111', 'E' * 32 + 'AAAA1111', ['FFFFFFFF00000000'])
+        builder.add_cert('E' * 32 + 'AAAA1111', 'digest1', 1)
+        builder.add('BBBB2222', 'B\xf6b M\xfcller', 'latin-1', ['B\xf6b', 'M\xfcller'])
+        builder.add_key('BBBB2222', 'EEEEEEEEBBBB2222', 'E' * 32 + 'BBBB2222')
+        builder.add_cert('E' * 32 + 'BBBB2222', 'digest2', 2)
+        builder.add('CCCC3333', 'Alice Smith <alice@example.org>', 'latin-1', ['Alice', 'Smith'])
+        builder.add('CCCC3333', 'Carl Smith', 'utf-8', ['Carl', 'Smith'])
+        builder.add_key('CCCC3333', 'EEEEEEEECCCC3333', 'E' * 32 + 'CCCC3333')
+        builder.add_cert('E' * 32 + 'CCCC3333', 'digest3', 3)
+        return builder.build()
+
+    def test_remove_key(self):
+        index = self.build_certs()
+        userids = index.remove_key('E' * 32 + 'AAAA1111', 'EEEEEEEEAAAA1111')
+        self.assertEqual(sorted(userids), ['Alice S. <alice@example.com>',
+                                           'Alice Smith <alice@example.org>'])
+        for userid in userids:
+            index.release_names(userid.split()[:2])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.by_keyid.startswith(''), ['BBBB2222', 'CCCC3333'])
+        self.assertEqual(index.by_userid.startswith('alice'), [])
+        self.assertEqual(index.by_longid.get('EEEEEEEEAAAA1111'), None)
+        self.assertEqual(index.by_subkey.get('FFFFFFFF00000000'), None)
+        self.assertEqual(index.find('alice'), [])
+        self.assertEqual(index.encoding('Alice S. <alice@example.com>'), None)
+        # Smith is still used by Carl Smith
+        self.assertEqual(index.by_name.startswith(''), ['b\xf6b', 'carl', 'm\xfcller', 'smith'])
+        # Added again
+        index.add('AAAA1111', 'Alice Smith <alice@example.org>', 'latin-1', ['Alice', 'Smith'])
+        index.add_key('AAAA1111', 'EEEEEEEEAAAA1111', 'E' * 32 + 'AAAA1111')
+        self.assertEqual(index.by_keyid['AAAA1111'], 'Alice Smith <alice@example.org>')
+        self.assertEqual(index.find('alice'), [('AAAA1111', 'Alice Smith <alice@example.org>')])
+        self.assertEqual(index.encoding('Alice'), 'latin-1')
+        loaded = KeyIndex.load(marshal.loads(marshal.dumps(index.dump())))
+        self.assertEqual(loaded.by_userid.startswith('alice'), ['alice smith <alice@example.org>'])
+        self.assertEqual(loaded.by_keyid['AAAA1111'], 'Alice Smith <alice@example.org>')
+        self.assertEqual(loaded.remove_key('E' * 32 + 'AAAA1111', 'EEEEEEEEAAAA1111'),
+                         ['Alice Smith <alice@example.org>'])
+        self.assertEqual(loaded.by_keyid.get('AAAA1111'), None)
+
+    def test_remove_key_names(self):
+        index = self.build_certs()
+        for userid in index.remove_key('E' * 32 + 'CCCC3333', 'EEEEEEEECCCC3333'):
+            index.release_names(userid.split()[:2])
+        # The user id Alice Smith belongs to AAAA1111
+        self.assertEqual(index.by_keyid.startswith(''), ['AAAA1111', 'BBBB2222'])
+        self.assertEqual(index.by_userid.startswith(''), ['alice s. <alice@example.com>',
+            'alice smith <alice@example.org>', 'b\xf6b m\xfcller'])
+        self.assertEqual(index.by_name.startswith(''), ['alice', 'b\xf6b', 'm\xfcller', 's.', 'smith'])
+
+    def test_remove_key_shared_keyid(self):
+        builder = KeyIndexBuilder()
+        builder.add('AAAA1111', 'Alice <alice@example.org>', 'utf-8', ['Alice'])
+        builder.add_key('AAAA1111', 'EEEEEEEEAAAA1111', 'E' * 32 + 'AAAA1111', ['FFFFFFFF00000001'])
+        builder.add_cert('E' * 32 + 'AAAA1111', 'digest1', 1)
+        builder.add('AAAA1111', 'Mallory <mallory@example.org>', 'utf-8', ['Mallory'])
+        builder.add_key('AAAA1111', 'DDDDDDDDAAAA1111', 'D' * 32 + 'AAAA1111', ['FFFFFFFF00000002'])
+        builder.add_cert('D' * 32 + 'AAAA1111', 'digest2', 2)
+        index = builder.build()
+        self.assertEqual(index.by_longid['DDDDDDDDAAAA1111'], 'Mallory <mallory@example.org>')
+        self.assertEqual(index.by_subkey['FFFFFFFF00000002'], 'Mallory <mallory@example.org>')
+        self.assertEqual(index.remove_key('D' * 32 + 'AAAA1111', 'DDDDDDDDAAAA1111'),
+                         ['Mallory <mallory@example.org>'])
+        self.assertEqual(index.by_keyid['AAAA1111'], 'Alice <alice@example.org>')
+        self.assertEqual(index.by_longid['EEEEEEEEAAAA1111'], 'Alice <alice@example.org>')
+        self.assertEqual(index.by_subkey.startswith(''), ['FFFFFFFF00000001'])
+        self.assertEqual(index.by_userid.startswith(''), ['alice <alice@example.org>'])
+
+    def test_remove_key_added(self):
+        self.index.add('DDDD4444', 'Carol Clark', 'utf-8', ['Carol', 'Clark'])
+        self.index.add_key('DDDD4444', 'EEEEFFFFDDDD4444', 'F' * 32 + 'DDDD4444', ['FFFFFFFF00000000'])
+        self.assertEqual(self.index.remove_key('F' * 32 + 'DDDD4444', 'EEEEFFFFDDDD4444'),
+                         ['Carol Clark'])
+        self.index.release_names(['Carol', 'Clark'])
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.by_keyid.get('DDDD4444'), None)
+        self.assertEqual(self.index.by_subkey.get('FFFFFFFF00000000'), None)
+        self.assertEqual(self.index.by_name.startswith('c'), [])
+        self.assertEqual(self.index.find('carol'), [])
+        self.assertEqual(self.index.remove_key('F' * 32 + 'DDDD4444', 'EEEEFFFFDDDD4444'), [])
+
+    def test_copy(self):
+        index = self.index.copy()
+        index.add('DDDD4444', 'Carol Clark', 'utf-8', ['Carol', 'Clark'])
+        self.assertEqual(index.by_keyid['DDDD4444'], 'Carol Clark')
+        self.assertEqual(index.by_keyid['AAAA1111'], 'Alice Smith <alice@example.org>')
+        self.assertEqual(self.index.by_keyid.get('DDDD4444'), None)
+        self.assertEqual(self.index.by_name.startswith('c'), [])
+        self.assertEqual(self.index.encoding('Carol'), None)
+
+
+class CompactIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        builder = KeyIndexBuilder()
+        for name in ('anna', 'bert', 'bob', 'carl'):
+            builder.add(name.upper(), name, 'utf-8')
+        self.index = builder.build().by_userid
+        self.index.add('bea', 'bea')
+        self.index.add('dora', 'dora')
+
+    def test_merged(self):
+        self.assertEqual(list(self.index), ['anna', 'bea', 'bert', 'bob', 'carl', 'dora'])
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(self.index['bea'], 'bea')
+        self.assertEqual(self.index['bob'], 'bob')
+        self.assertTrue('dora' in self.index)
+
+    def test_remove(self):
+        self.index.remove('bert')
+        self.index.remove('bea')
+        self.index.remove('carl')
+        self.index.remove('xyz')
+        self.assertEqual(list(self.index), ['anna', 'bob', 'dora'])
+        self.assertEqual(len(self.index), 3)
+        self.assertFalse('bert' in self.index)
+        self.assertEqual(self.index.get('bert'), None)
+        self.assertEqual(self.index.startswith('b'), ['bob'])
+        self.assertEqual(self.index.count('b'), 1)
+        self.assertEqual(self.index.head('', 2), ['anna', 'bob'])
+        self.assertEqual(self.index.last('c'), None)
+        self.assertEqual(self.index.last(''), 'dora')
+        # Added again on top
+        self.index.add('bert', 'bert')
+        self.assertEqual(self.index.startswith('b'), ['bert', 'bob'])
+        self.assertEqual(self.index.count('b'), 2)
+        self.assertEqual(self.index['bert'], 'bert')
+
+    def test_remove_copy(self):
+        index = self.index.copy()
+        index.remove('bob')
+        self.assertEqual(index.startswith('b'), ['bea', 'bert'])
+        self.assertEqual(self.index.startswith('b'), ['bea', 'bert', 'bob'])
+
+    def test_startswith(self):
+        self.assertEqual(self.index.startswith('b'), ['bea', 'bert', 'bob'])
+        self.assertEqual(self.index.count('b'), 3)
+        self.assertEqual(self.index.head('b', 2), ['bea', 'bert'])
+        self.assertEqual(self.index.last('b'), 'bob')
+        self.assertEqual(self.index.last('d'), 'dora')
+        self.assertEqual(self.index.last('x'), None)
+
+
+class CertificateTableTests(unittest.TestCase):
+
+    def setUp(self):
+        builder = KeyIndexBuilder()
+        builder.add_cert('B' * 40, '2' * 40, 2)
+        builder.add_cert('A' * 40, '1' * 40, 1)
+        self.certs = builder.build().certs
+
+    def test_certs(self):
+        self.assertEqual(len(self.certs), 2)
+        self.assertEqual(self.certs.checksum('A' * 40), 1)
+        self.assertEqual(self.certs.checksum('C' * 40), None)
+        self.assertEqual(self.certs.known(), {'1' * 40: 'A' * 40, '2' * 40: 'B' * 40})
+
+    def test_add(self):
+        self.certs.add('A' * 40, '3' * 40, 1)
+        self.certs.add('C' * 40, '4' * 40, 3)
+        self.assertEqual(len(self.certs), 3)
+        self.assertTrue('C' * 40 in self.certs)
+        self.assertEqual(self.certs.checksum('C' * 40), 3)
+        self.assertEqual(set(self.certs.known()), set(['1' * 40, '3' * 40, '2' * 40, '4' * 40]))
+
+    def test_remove(self):
+        self.certs.add('C' * 40, '4' * 40, 3)
+        self.certs.remove('A' * 40)
+        self.certs.remove('C' * 40)
+        self.assertEqual(len(self.certs), 1)
+        self.assertFalse('A' * 40 in self.certs)
+        self.assertEqual(self.certs.checksum('A' * 40), None)
+        self.assertEqual(self.certs.known(), {'2' * 40: 'B' * 40})
+        certs = CertificateTable.load(marshal.loads(marshal.dumps(self.certs.dump())))
+        self.assertEqual(len(certs), 1)
+        # Added again
+        self.certs.add('A' * 40, '5' * 40, 1)
+        self.assertEqual(len(self.certs), 2)
+        self.assertEqual(self.certs.checksum('A' * 40), 1)
+
+
+class TrigramIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.strings = StringTable(['alice', 'alicia', 'bob', 'malice'])
+        self.index = TrigramIndex(self.strings)
+
+    def test_search(self):
+        self.assertEqual(self.index.search('lic'), [0, 1, 3])
+        self.assertEqual(self.index.search('alice'), [0, 3])
+        self.assertEqual(self.index.search('malice'), [3])
+        self.assertEqual(self.index.search('licia'), [1])
+        self.assertEqual(self.index.search('xyz'), [])
+
+    def test_search_short(self):
+        self.assertEqual(self.index.search('b'), [2])
+        self.assertEqual(self.index.search('ce'), [0, 3])
+        self.assertEqual(self.index.search('a'), [0, 1, 3])
+        self.assertEqual(self.index.search(''), [0, 1, 2, 3])
+
+    def test_candidates_are_superset(self):
+        # 'ali' and 'lic' occur in all three but 'alic' only in two
+        self.assertEqual(self.index.candidates('alica'), [])
+        self.assertEqual(self.index.candidates('alici'), [1])
+
+    def test_similar(self):
+        self.assertEqual(self.index.similar('alise'), [])
+        self.assertEqual(self.index.similar('malise'), [3])
+        self.assertEqual(self.index.similar('alicea'), [0, 3, 1])
+        self.assertEqual(self.index.similar('al'), [])
+
+    def test_dump_load(self):
+        index = TrigramIndex.load(marshal.loads(marshal.dumps(self.index.dump())), self.strings)
+        self.assertEqual(index.search('lic'), [0, 1, 3])
+        self.assertEqual(index.similar('alicea'), [0, 3, 1])
+
+    def test_empty(self):
+        index = TrigramIndex()
+        self.assertEqual(index.search('alice'), [])
+        self.assertEqual(index.search('a'), [])
+        self.assertEqual(index.similar('alice'), [])
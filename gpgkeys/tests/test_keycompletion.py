@@ -0,0 +1,622 @@
+import unittest
+import os
+import threading
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from os.path import join, isfile
+
+from rl import completer
+
+from gpgkeys.testing import JailSetup
+from gpgkeys.gpgkeys import GPGKeys
+from gpgkeys.completions.key import KeyCompletion
+from gpgkeys.completions.key import SecretKeyCompletion
+from gpgkeys.completions.index import KeyIndex
+from gpgkeys.completions.index import KeyIndexBuilder
+from gpgkeys.completions.snapshot import identity
+from gpgkeys.completions.snapshot import load_snapshot
+from gpgkeys.completions.snapshot import save_snapshot
+
+from gpgkeys.tests.test_keyring import FPR
+from gpgkeys.tests.test_keyring import SUBKEY
+from gpgkeys.tests.test_keyring import SUBFPR
+from gpgkeys.tests.test_keyring import keyblock
+from gpgkeys.tests.test_keyring import keybox
+
+KEYID = FPR[-8:]
+
+
+class KeyringSetup(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith <alice@example.org>',)))
+        self.write('secring.gpg', b'')
+
+    def write(self, name, data):
+        f = open(name, 'wb')
+        f.write(data)
+        f.close()
+
+    def touch(self, name, delta=10):
+        st = os.stat(name)
+        os.utime(name, (st.st_atime + delta, st.st_mtime + delta))
+
+    def keycompletion(self):
+        kc = KeyCompletion()
+        kc.home = self.tempdir
+        kc.snapshot = join(self.tempdir, 'cache', 'keys.snapshot')
+        return kc
+
+
+COLONS = b"""\
+tru::1:1792274500:0:3:1:5
+pub:u:1024:1:416FFE5ED11C78DF:1792274500:::u:::scESC::::::::0:
+fpr:::::::::2527287DEDE53DC1FC1CD68F416FFE5ED11C78DF:
+uid:u::::1792274500::4A80C31B2E76EE98556467C4F514786A02EBD79E::Alice Example <alice@example.org>::::::::::0:
+uid:u::::1792274500::4EA89D28301474DC9C7B51780F82C3DD55E42076::Alice\\x3a Second <a2@example.org>::::::::::0:
+sub:u:255:18:E40779F5BCB8723B:1792274500::::::e:::::cv25519::
+fpr:::::::::A8B60AD877D476D28B1604F3E40779F5BCB8723B:
+pub:u:1024:1:BAA5B175E12CFA6A:1792274500:::u:::scSC::::::::0:
+fpr:::::::::916E19F0E0037CFCBE922F38BAA5B175E12CFA6A:
+uid:u::::1792274500::F9E2D418174C448B080D1F7318954AAA429477AE::B\xf6b M\xfcller <bob@example.com>::::::::::0:
+"""
+
+
+class ParseKeysTests(unittest.TestCase):
+
+    def test_parse_keys(self):
+        kc = KeyCompletion()
+        certs = list(kc.parse_keys(COLONS.splitlines(True)))
+        self.assertEqual([x.keyid for x in certs], ['D11C78DF', 'E12CFA6A'])
+        self.assertEqual(certs[0].userids, [
+            ('Alice Example <alice@example.org>', 'utf-8'),
+            ('Alice: Second <a2@example.org>', 'utf-8')])
+        self.assertEqual(certs[1].userids, [
+            ('B\xf6b M\xfcller <bob@example.com>', 'latin-1')])
+
+    def test_parse_key_ids(self):
+        kc = KeyCompletion()
+        certs = list(kc.parse_keys(COLONS.splitlines(True)))
+        self.assertEqual(certs[0].longid, '416FFE5ED11C78DF')
+        self.assertEqual(certs[0].fingerprint, '2527287DEDE53DC1FC1CD68F416FFE5ED11C78DF')
+        self.assertEqual(certs[0].subkeys, ['E40779F5BCB8723B'])
+        self.assertEqual(certs[1].fingerprint, '916E19F0E0037CFCBE922F38BAA5B175E12CFA6A')
+        self.assertEqual(certs[1].subkeys, [])
+
+    def test_parse_keys_is_incremental(self):
+        kc = KeyCompletion()
+        lines = iter(COLONS.splitlines(True))
+        certs = kc.parse_keys(lines)
+        self.assertEqual(next(certs).keyid, 'D11C78DF')
+        self.assertEqual(len(list(lines)), 2)
+
+
+SECRET_COLONS = b"""\
+sec:u:1024:1:416FFE5ED11C78DF:1792274500:::u:::scESC:::+:::::0:
+fpr:::::::::2527287DEDE53DC1FC1CD68F416FFE5ED11C78DF:
+uid:u::::1792274500::4A80C31B2E76EE98556467C4F514786A02EBD79E::Alice Example <alice@example.org>::::::::::0:
+ssb:u:255:18:E40779F5BCB8723B:1792274500::::::e:::+::cv25519::
+fpr:::::::::A8B60AD877D476D28B1604F3E40779F5BCB8723B:
+sec:u:1024:1:BAA5B175E12CFA6A:1792274500:::u:::scSC:::#:::::0:
+fpr:::::::::916E19F0E0037CFCBE922F38BAA5B175E12CFA6A:
+uid:u::::1792274500::F9E2D418174C448B080D1F7318954AAA429477AE::Bob <bob@example.com>::::::::::0:
+sec:e:255:22:698F7F98F2D5CAFD:1592274500:1692274500::u:::sc:::+::ed25519:::0:
+fpr:::::::::B48207F64CF7C7AB404A87D9698F7F98F2D5CAFD:
+uid:e::::1592274500::DB6D2BFBBC2741864B2B15402EF195B08C1069B4::Carol <carol@example.net>::::::::::0:
+sec:u:255:18:1234567890ABCDEF:1792274500:::u:::eE:::+::cv25519:::0:
+fpr:::::::::0123456789ABCDEF01234567890ABCDEF1234567:
+uid:u::::1792274500::0B1F0A2C4E6D8F9A1B3C5D7E9F0A2B4C6D8E0F1A::Dave <dave@example.org>::::::::::0:
+"""
+
+
+class SecretKeyTests(KeyringSetup):
+
+    def keycompletion(self):
+        kc = SecretKeyCompletion()
+        kc.home = self.tempdir
+        return kc
+
+    def test_parse_keys(self):
+        kc = self.keycompletion()
+        certs = list(kc.parse_keys(SECRET_COLONS.splitlines(True)))
+        self.assertEqual([x.keyid for x in certs], ['D11C78DF'])
+        self.assertEqual(certs[0].userids, [('Alice Example <alice@example.org>', 'utf-8')])
+        self.assertEqual(certs[0].subkeys, ['E40779F5BCB8723B'])
+
+    def test_public_keys_unfiltered(self):
+        kc = KeyCompletion()
+        certs = list(kc.parse_keys(SECRET_COLONS.splitlines(True)))
+        self.assertEqual([x.keyid for x in certs], ['D11C78DF', 'E12CFA6A', 'F2D5CAFD', '90ABCDEF'])
+
+    def test_private_keys_changed(self):
+        kc = self.keycompletion()
+        kc.list_keys = lambda: kc.parse_keys(SECRET_COLONS.splitlines(True))
+        kc.update()
+        kc.index = KeyIndex()
+        kc.update()
+        self.assertEqual(len(kc.by_keyid), 0)
+        os.mkdir('private-keys-v1.d')
+        kc.update()
+        self.assertEqual(len(kc.by_keyid), 1)
+        kc.index = KeyIndex()
+        self.write(join('private-keys-v1.d', 'ABCD.key'), b'')
+        kc.update()
+        self.assertEqual(len(kc.by_keyid), 1)
+
+    def test_update(self):
+        kc = self.keycompletion()
+        kc.list_keys = lambda: kc.parse_keys(SECRET_COLONS.splitlines(True))
+        self.assertEqual(kc(''), ['D11C78DF'])
+        self.assertEqual(kc('B'), [])
+
+
+class UpdateTests(KeyringSetup):
+
+    def test_keybox_only(self):
+        os.remove('pubring.gpg')
+        os.remove('secring.gpg')
+        self.write('pubring.kbx', keybox(keyblock(userids=(b'Bob Jones',))))
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Bob Jones')
+
+    def test_keyboxd(self):
+        self.write('common.conf', b'use-keyboxd\n')
+        kc = self.keycompletion()
+        kc.list_keys = lambda: kc.parse_keys(COLONS.splitlines())
+        kc.update()
+        self.assertEqual(kc.by_keyid['D11C78DF'], 'Alice Example <alice@example.org>')
+        self.assertEqual(kc.by_keyid.get(KEYID), None)
+        # Keys added through keyboxd invalidate the cache
+        self.assertEqual(kc.changed(), False)
+        os.mkdir('public-keys.d')
+        self.assertEqual(kc.changed(), True)
+
+    def test_update(self):
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+        self.assertEqual(kc.by_userid['alice smith <alice@example.org>'], 'Alice Smith <alice@example.org>')
+        self.assertEqual(kc.by_name['alice'], 'Alice')
+        self.assertEqual(kc.by_name['smith'], 'Smith')
+        self.assertEqual(kc.index.encoding('Alice'), 'utf-8')
+
+    def test_update_key_ids(self):
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith',), subkeys=(SUBKEY,)))
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.by_longid[FPR[-16:]], 'Alice Smith')
+        self.assertEqual(kc.by_fingerprint[FPR], 'Alice Smith')
+        self.assertEqual(kc.by_subkey[SUBFPR[-16:]], 'Alice Smith')
+
+    def test_complete_key_ids(self):
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith',), subkeys=(SUBKEY,)))
+        kc = self.keycompletion()
+        self.assertEqual(kc(KEYID[:4]), [KEYID])
+        self.assertEqual(kc(FPR[-16:-4]), [FPR[-16:]])
+        self.assertEqual(kc(FPR[:10].lower()), [FPR])
+        self.assertEqual(kc(SUBFPR[-16:-4]), [SUBFPR[-16:]])
+
+    def test_update_only_if_changed(self):
+        kc = self.keycompletion()
+        kc.update()
+        kc.index = KeyIndex()
+        kc.update()
+        self.assertEqual(len(kc.by_name), 0)
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith <alice@example.org>',)))
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(len(kc.by_name), 2)
+
+
+class PatchTests(KeyringSetup):
+
+    def setUp(self):
+        KeyringSetup.setUp(self)
+        self.alice = keyblock(userids=(b'Alice Smith <alice@example.org>',))
+        self.bob = keyblock(userids=(b'Bob Jones',), key=SUBKEY)
+
+    def keycompletion(self):
+        kc = KeyringSetup.keycompletion(self)
+        kc.update()
+        kc.rebuild = self.fail # Not called
+        return kc
+
+    def test_key_added(self):
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.alice + self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(kc.by_keyid[SUBFPR[-8:]], 'Bob Jones')
+        self.assertEqual(kc.by_fingerprint[SUBFPR], 'Bob Jones')
+        self.assertEqual(kc.by_name['jones'], 'Jones')
+        self.assertEqual(kc(''), sorted([KEYID, SUBFPR[-8:]]))
+
+    def test_key_added_keybox(self):
+        os.remove('pubring.gpg')
+        os.remove('secring.gpg')
+        self.write('pubring.kbx', keybox(self.alice))
+        kc = self.keycompletion()
+        self.write('pubring.kbx', keybox(self.alice, self.bob))
+        self.touch('pubring.kbx')
+        kc.update()
+        self.assertEqual(kc.by_keyid[SUBFPR[-8:]], 'Bob Jones')
+
+    def test_signature_changed(self):
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.alice.replace(b'signature', b'signaturf'))
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+
+    def test_patch_saved(self):
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.alice + self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        kc = self.keycompletion()
+        self.assertEqual(kc.by_keyid[SUBFPR[-8:]], 'Bob Jones')
+
+    def test_key_removed(self):
+        self.write('pubring.gpg', self.alice + self.bob)
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(kc(''), [SUBFPR[-8:]])
+        self.assertEqual(kc.by_keyid.get(KEYID), None)
+        self.assertEqual(kc.by_fingerprint.get(FPR), None)
+        self.assertEqual(kc.by_userid.startswith('a'), [])
+        self.assertEqual(kc.by_name.startswith(''), ['bob', 'jones'])
+        self.assertEqual(kc.find('alice'), [])
+        self.assertEqual(len(kc.index.certs), 1)
+
+    def test_key_removed_saved(self):
+        self.write('pubring.gpg', self.alice + self.bob)
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        kc = self.keycompletion()
+        self.assertEqual(kc(''), [SUBFPR[-8:]])
+
+    def test_key_removed_and_added(self):
+        self.write('pubring.gpg', self.alice + self.bob)
+        kc = self.keycompletion()
+        self.write('pubring.gpg', self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        self.write('pubring.gpg', self.bob + self.alice)
+        self.touch('pubring.gpg', 20)
+        kc.update()
+        self.assertEqual(kc(''), sorted([KEYID, SUBFPR[-8:]]))
+        self.assertEqual(kc.by_name['smith'], 'Smith')
+
+    def test_userid_changed(self):
+        kc = self.keycompletion()
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith <alice@example.org>', b'Alice Jones')))
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(kc.by_userid.startswith('alice'),
+                         ['alice jones', 'alice smith <alice@example.org>'])
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Jones',)))
+        self.touch('pubring.gpg', 20)
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Jones')
+        self.assertEqual(kc.by_fingerprint[FPR], 'Alice Jones')
+        self.assertEqual(kc.by_userid.startswith('alice'), ['alice jones'])
+        self.assertEqual(kc.by_name.startswith(''), ['alice', 'jones'])
+        self.assertEqual(kc.find('smith'), [])
+
+    def test_subkey_changed(self):
+        kc = self.keycompletion()
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith <alice@example.org>',), subkeys=(SUBKEY,)))
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(kc.by_subkey[SUBFPR[-16:]], 'Alice Smith <alice@example.org>')
+        self.write('pubring.gpg', keyblock(userids=(b'Alice Smith <alice@example.org>',)))
+        self.touch('pubring.gpg', 20)
+        kc.update()
+        self.assertEqual(kc.by_subkey.get(SUBFPR[-16:]), None)
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+
+    def test_too_many_changes(self):
+        kc = self.keycompletion()
+        kc.rebuild = lambda: self.rebuilt.append(True)
+        self.rebuilt = []
+        userids = tuple(b'User %d' % i for i in range(1001))
+        self.write('pubring.gpg', self.alice + keyblock(userids=userids, key=SUBKEY))
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(self.rebuilt, [True])
+
+    def test_too_many_certificates(self):
+        kc = self.keycompletion()
+        kc.max_patch = 0
+        kc.rebuild = lambda: self.rebuilt.append(True)
+        self.rebuilt = []
+        self.write('pubring.gpg', self.alice + self.bob)
+        self.touch('pubring.gpg')
+        kc.update()
+        self.assertEqual(self.rebuilt, [True])
+
+
+class SnapshotTests(KeyringSetup):
+
+    def test_snapshot_written(self):
+        kc = self.keycompletion()
+        kc.update()
+        self.assertTrue(isfile(kc.snapshot))
+
+    def test_snapshot_loaded(self):
+        self.keycompletion().update()
+        kc = self.keycompletion()
+        kc.rebuild = None # Not called
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+        self.assertEqual(kc.by_userid.startswith('alice'), ['alice smith <alice@example.org>'])
+        self.assertEqual(kc.by_name.startswith('s'), ['smith'])
+        self.assertEqual(kc.index.encoding('Alice'), 'utf-8')
+
+    def test_stale_snapshot(self):
+        self.keycompletion().update()
+        self.write('pubring.gpg', keyblock(userids=(b'Bob Jones',)))
+        self.touch('pubring.gpg')
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Bob Jones')
+        self.assertEqual(kc.by_name.startswith('a'), [])
+
+    def test_corrupt_snapshot(self):
+        kc = self.keycompletion()
+        kc.update()
+        self.write(kc.snapshot, b'\x00garbage')
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+
+
+class SnapshotFileTests(JailSetup):
+
+    def test_identity(self):
+        self.mkfile('foo')
+        ident = identity('foo', 'bar')
+        st = os.stat('foo')
+        self.assertEqual(ident, (('foo', st.st_ino, st.st_size, st.st_mtime),
+                                 ('bar', 0, 0, 0.0)))
+
+    def test_roundtrip(self):
+        self.assertEqual(save_snapshot(join('cache', 'snap'), ('x',), {'a': (1, 2)}), True)
+        self.assertEqual(load_snapshot(join('cache', 'snap'), ('x',)), {'a': (1, 2)})
+
+    def test_identity_mismatch(self):
+        save_snapshot('snap', ('x',), {'a': 1})
+        self.assertEqual(load_snapshot('snap', ('y',)), None)
+
+    def test_missing(self):
+        self.assertEqual(load_snapshot('snap', ('x',)), None)
+
+    def test_no_temp_files_left(self):
+        save_snapshot('snap', ('x',), {'a': 1})
+        save_snapshot('snap', ('x',), {'a': 2})
+        self.assertEqual(os.listdir('.'), ['snap'])
+
+
+class WarmupTests(KeyringSetup):
+
+    def test_warmup(self):
+        kc = self.keycompletion()
+        kc.warmup()
+        self.assertEqual(kc.wait(5), True)
+        self.assertEqual(kc.thread, None)
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+
+    def test_warmup_timeout(self):
+        kc = self.keycompletion()
+        kc.lock.acquire()
+        try:
+            kc.warmup()
+            self.assertEqual(kc.wait(0.01), False)
+            self.assertEqual(len(kc.by_keyid), 0)
+        finally:
+            kc.lock.release()
+        self.assertEqual(kc.wait(5), True)
+        self.assertEqual(len(kc.by_keyid), 1)
+
+    def test_warmup_error(self):
+        def fail():
+            raise OSError('failed')
+        kc = self.keycompletion()
+        kc.load = fail
+        kc.warmup()
+        self.assertEqual(kc.wait(5), True)
+        self.assertRaises(OSError, kc.update)
+        del kc.load
+        kc.update()
+        self.assertEqual(len(kc.by_keyid), 1)
+
+
+class LatencyBudgetTests(KeyringSetup):
+
+    def setUp(self):
+        KeyringSetup.setUp(self)
+        self.kc = self.keycompletion()
+        self.kc.latency_budget = 0.01
+        self.kc.update()
+        self.kc.watcher.interval = 0
+        self.write('pubring.gpg', keyblock(userids=(b'Bob Jones',)))
+        self.touch('pubring.gpg')
+
+    def test_within_budget(self):
+        self.assertEqual(self.kc(''), [KEYID])
+        self.kc.wait(5)
+        self.assertEqual(self.kc.by_keyid[KEYID], 'Bob Jones')
+
+    def test_over_budget(self):
+        kc = self.kc
+        event = threading.Event()
+        load = kc.load
+        def slow_load():
+            event.wait(5)
+            load()
+        kc.load = slow_load
+        self.assertEqual(kc.by_keyid[KEYID], 'Alice Smith <alice@example.org>')
+        self.assertEqual(kc('bo'), [])
+        self.assertEqual(kc('al'), ['Alice'])
+        self.assertNotEqual(kc.thread, None)
+        event.set()
+        self.assertEqual(kc.wait(5), True)
+        self.assertEqual(kc('bo'), ['Bob'])
+
+    def test_no_previous_cache(self):
+        kc = self.keycompletion()
+        kc.latency_budget = 0.01
+        self.assertEqual(kc('bo'), ['Bob'])
+
+    def test_index_swapped(self):
+        kc = self.kc
+        kc.update()
+        format = kc.format
+        def swapping_format(index, map, text):
+            # A warmup finishing in the middle of a completion
+            kc.index = kc.index.copy()
+            return format(index, map, text)
+        kc.format = swapping_format
+        kc.refresh = lambda: None
+        self.assertEqual(kc('bo'), ['Bob'])
+
+
+class FindTests(KeyringSetup):
+
+    def test_find(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc.find('example.org'), [(KEYID, 'Alice Smith <alice@example.org>')])
+        self.assertEqual(kc.find('jones'), [])
+
+    def test_find_similar(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc.find('smyth <alice'), [])
+        self.assertEqual(kc.find('smyth <alice', similar=True),
+                         [(KEYID, 'Alice Smith <alice@example.org>')])
+
+    def test_complete_substring(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc('mith'), [])
+        kc.substring = True
+        self.assertEqual(len(kc('mith')), 1)
+        self.assertEqual(kc.quote_results, True)
+
+    def test_prefix_matches_first(self):
+        kc = self.keycompletion()
+        kc.substring = True
+        self.assertEqual(kc('smi'), ['Smith'])
+
+    def test_substring_index_built_on_find(self):
+        kc = self.keycompletion()
+        kc.update()
+        self.assertEqual(kc.index.trigrams, None)
+        kc.find('example.org')
+        self.assertNotEqual(kc.index.trigrams, None)
+
+    def test_substring_index_built_on_update(self):
+        kc = self.keycompletion()
+        kc.substring = True
+        kc.update()
+        self.assertNotEqual(kc.index.trigrams, None)
+
+    def test_substring_index_added_to_snapshot(self):
+        self.keycompletion().update()
+        kc = self.keycompletion()
+        kc.substring = True
+        kc.rebuild = None # Not called
+        kc.load()
+        self.assertNotEqual(kc.index.trigrams, None)
+        kc = self.keycompletion()
+        kc.load()
+        self.assertNotEqual(kc.index.trigrams, None)
+
+    def test_substring_index_in_snapshot(self):
+        kc = self.keycompletion()
+        kc.substring = True
+        kc.update()
+        kc = self.keycompletion()
+        kc.rebuild = None # Not called
+        kc.load()
+        self.assertNotEqual(kc.index.trigrams, None)
+        self.assertEqual(kc.find('example.org'), [(KEYID, 'Alice Smith <alice@example.org>')])
+
+
+class BoundedTests(KeyringSetup):
+
+    def keycompletion(self):
+        kc = KeyringSetup.keycompletion(self)
+        kc.update()
+        builder = KeyIndexBuilder()
+        for i in range(5):
+            builder.add('AAAA000%d' % i, 'User%d <user%d@example.org>' % (i, i), 'utf-8', ['User%d' % i])
+        kc.index = builder.build()
+        kc.max_matches = 3
+        return kc
+
+    def test_bounded(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc(''), ['AAAA0000', 'AAAA0001', 'AAAA0004'])
+        self.assertEqual(kc.omitted[0], 5)
+
+    def test_expand(self):
+        kc = self.keycompletion()
+        kc('user')
+        self.assertEqual(kc.omitted[0], 5)
+        self.assertEqual(len(kc.expand()), 5)
+
+    def test_not_bounded(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc('AAAA0003'), ['AAAA0003'])
+        self.assertEqual(kc.omitted, None)
+        kc.max_matches = 5
+        self.assertEqual(len(kc('')), 5)
+        self.assertEqual(kc.omitted, None)
+
+    def test_bounded_substring(self):
+        kc = self.keycompletion()
+        kc.substring = True
+        self.assertEqual(len(kc('example')), 3)
+        self.assertEqual(kc.omitted[0], 5)
+        self.assertEqual(len(kc.expand()), 5)
+
+    def test_shell_display_matches(self):
+        shell = GPGKeys(stdout=StringIO(), stderr=StringIO())
+        shell.completekeyid = self.keycompletion()
+        shell.completesecretkeyid = self.keycompletion()
+        shell.completekeyid('')
+        shell.completesecretkeyid('')
+        shell.complete('', 0)
+        self.assertEqual(shell.completekeyid.omitted, None)
+        self.assertEqual(shell.completesecretkeyid.omitted, None)
+        shell.completesecretkeyid('')
+        displayed = []
+        shell.completekeyid.display_matches = lambda *args: displayed.append('key')
+        shell.completesecretkeyid.display_matches = lambda *args: displayed.append('secret')
+        shell.display_matches('', ['AAAA0000'], 8)
+        shell.completesecretkeyid.omitted = None
+        shell.display_matches('', ['AAAA0000'], 8)
+        self.assertEqual(displayed, ['secret', 'key'])
+
+    def test_shell_display_hook(self):
+        shell = GPGKeys(stdout=StringIO(), stderr=StringIO())
+        shell.completekeyid = self.keycompletion()
+        shell.completesecretkeyid = self.keycompletion()
+        try:
+            shell.completekeyid('')
+            shell.setdisplayhook()
+            self.assertEqual(completer.display_matches_hook, shell.display_matches)
+            shell.completekeyid('AAAA0000')
+            shell.setdisplayhook()
+            self.assertEqual(completer.display_matches_hook, None)
+        finally:
+            completer.display_matches_hook = None
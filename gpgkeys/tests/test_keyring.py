@@ -0,0 +1,160 @@
+import unittest
+import os
+import struct
+import hashlib
+
+from gpgkeys.testing import JailSetup
+from gpgkeys.keyring import KeyringError
+from gpgkeys.keyring import find_keyring
+from gpgkeys.keyring import read_keyring
+from gpgkeys.keyring import scan_keyring
+from gpgkeys.keyring import parse_keyblock
+
+# A V4 RSA public key with fake key material
+N = b'\xc5' * 128
+E = b'\x01\x00\x01'
+KEY = b'\x04\x5c\x92\x4a\x00\x01' + struct.pack('>H', 1024) + N + struct.pack('>H', 17) + E
+FPR = hashlib.sha1(b'\x99' + struct.pack('>H', len(KEY)) + KEY).hexdigest().upper()
+
+# A subkey with different key material
+SUBKEY = KEY[:8] + b'\x3a' * 128 + KEY[136:]
+SUBFPR = hashlib.sha1(b'\x99' + struct.pack('>H', len(SUBKEY)) + SUBKEY).hexdigest().upper()
+
+
+def old_packet(tag, body):
+    return struct.pack('>BH', 0x80 | (tag << 2) | 1, len(body)) + body
+
+
+def new_packet(tag, body):
+    if len(body) < 192:
+        return struct.pack('>BB', 0xc0 | tag, len(body)) + body
+    return struct.pack('>BBI', 0xc0 | tag, 0xff, len(body)) + body
+
+
+def keyblock(packet=new_packet, userids=(b'Alice <alice@example.org>',), subkeys=(), key=KEY):
+    data = packet(6, key)
+    data += packet(2, b'signature')
+    for userid in userids:
+        data += packet(13, userid)
+        data += packet(2, b'signature')
+    for subkey in subkeys:
+        data += packet(14, subkey)
+        data += packet(2, b'signature')
+    return data
+
+
+def keybox(*keyblocks):
+    data = struct.pack('>IBBH', 32, 1, 1, 0) + b'KBXf' + b'\0' * 20
+    for block in keyblocks:
+        header = struct.pack('>IBBHII', 0, 2, 1, 0, 16, len(block))
+        blob = header + block
+        data += struct.pack('>I', len(blob)) + blob[4:]
+    return data
+
+
+class ParseKeyblockTests(unittest.TestCase):
+
+    def test_new_format(self):
+        data = keyblock(new_packet)
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual(len(certs), 1)
+        self.assertEqual(certs[0].fingerprint, FPR)
+        self.assertEqual(certs[0].longid, FPR[-16:])
+        self.assertEqual(certs[0].keyid, FPR[-8:])
+        self.assertEqual(certs[0].userids, [b'Alice <alice@example.org>'])
+
+    def test_subkeys(self):
+        data = keyblock(subkeys=(SUBKEY,))
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual(certs[0].fingerprint, FPR)
+        self.assertEqual(certs[0].subkeys, [SUBFPR[-16:]])
+        self.assertEqual(certs[0].userids, [b'Alice <alice@example.org>'])
+
+    def test_old_format(self):
+        data = keyblock(old_packet)
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual(len(certs), 1)
+        self.assertEqual(certs[0].fingerprint, FPR)
+
+    def test_multiple_userids(self):
+        data = keyblock(userids=(b'Alice', b'Alice Smith', b'Al'))
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual(certs[0].userids, [b'Alice', b'Alice Smith', b'Al'])
+
+    def test_multiple_keys(self):
+        data = keyblock(userids=(b'Alice',)) + keyblock(userids=(b'Bob',))
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual([x.userids for x in certs], [[b'Alice'], [b'Bob']])
+
+    def test_long_userid(self):
+        userid = b'A' * 500
+        data = keyblock(userids=(userid,))
+        certs = list(parse_keyblock(data, 0, len(data)))
+        self.assertEqual(certs[0].userids, [userid])
+
+    def test_truncated(self):
+        data = keyblock()[:-5]
+        self.assertRaises(KeyringError, list, parse_keyblock(data, 0, len(data)))
+
+    def test_garbage(self):
+        data = b'garbage'
+        self.assertRaises(KeyringError, list, parse_keyblock(data, 0, len(data)))
+
+
+class ReadKeyringTests(JailSetup):
+
+    def write(self, name, data):
+        f = open(name, 'wb')
+        f.write(data)
+        f.close()
+
+    def test_read_gpg(self):
+        self.write('pubring.gpg', keyblock(old_packet) + keyblock(new_packet))
+        certs = list(read_keyring('pubring.gpg'))
+        self.assertEqual([x.fingerprint for x in certs], [FPR, FPR])
+
+    def test_read_kbx(self):
+        self.write('pubring.kbx', keybox(keyblock(userids=(b'Alice',)),
+                                         keyblock(userids=(b'Bob',))))
+        certs = list(read_keyring('pubring.kbx'))
+        self.assertEqual([x.fingerprint for x in certs], [FPR, FPR])
+        self.assertEqual([x.userids for x in certs], [[b'Alice'], [b'Bob']])
+
+    def test_read_empty(self):
+        self.write('pubring.gpg', b'')
+        self.assertEqual(list(read_keyring('pubring.gpg')), [])
+
+    def test_read_truncated_kbx(self):
+        self.write('pubring.kbx', keybox(keyblock())[:-10])
+        self.assertRaises(KeyringError, list, read_keyring('pubring.kbx'))
+
+    def test_scan_known(self):
+        for name, data in (('pubring.gpg', keyblock(userids=(b'Alice',)) + keyblock(userids=(b'Bob',))),
+                           ('pubring.kbx', keybox(keyblock(userids=(b'Alice',)), keyblock(userids=(b'Bob',))))):
+            self.write(name, data)
+            digests = [x for x, cert in scan_keyring(name)]
+            self.assertEqual(len(set(digests)), 2)
+            scanned = list(scan_keyring(name, known=digests[:1]))
+            self.assertEqual([x[0] for x in scanned], digests)
+            self.assertEqual(scanned[0][1], None)
+            self.assertEqual(scanned[1][1].userids, [b'Bob'])
+            self.assertEqual(scanned[1][1].digest, digests[1])
+
+    def test_find_keyring(self):
+        self.assertEqual(find_keyring(self.tempdir), None)
+        self.write('pubring.gpg', b'')
+        self.assertEqual(find_keyring(self.tempdir), os.path.join(self.tempdir, 'pubring.gpg'))
+        self.write('pubring.kbx', b'')
+        self.assertEqual(find_keyring(self.tempdir), os.path.join(self.tempdir, 'pubring.kbx'))
+
+    def test_find_keyring_additional_keyrings(self):
+        self.write('pubring.kbx', b'')
+        self.write('gpg.conf', b'keyring /some/other/pubring.gpg\n')
+        self.assertEqual(find_keyring(self.tempdir), None)
+
+    def test_find_keyring_keyboxd(self):
+        self.write('pubring.kbx', b'')
+        self.write('common.conf', b'use-keyboxd\n')
+        self.assertEqual(find_keyring(self.tempdir), None)
+        self.write('common.conf', b'# use-keyboxd\n')
+        self.assertEqual(find_keyring(self.tempdir), os.path.join(self.tempdir, 'pubring.kbx'))
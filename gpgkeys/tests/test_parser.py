@@ -0,0 +1,109 @@
+import unittest
+import os
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gpgkeys.testing import JailSetup
+from gpgkeys.parser import parseargs
+from gpgkeys.parser import splitcommand
+from gpgkeys.parser import splitbackground
+
+
+class SplitCommandTests(unittest.TestCase):
+
+    def test_simple(self):
+        self.assertEqual(splitcommand('gpg --list-keys'), ['gpg', '--list-keys'])
+        self.assertEqual(splitcommand('gpg  --output foo.asc --export'),
+                         ['gpg', '--output', 'foo.asc', '--export'])
+
+    def test_quoted(self):
+        self.assertEqual(splitcommand('gpg --list-keys "Alice <alice@example.org>"'),
+                         ['gpg', '--list-keys', 'Alice <alice@example.org>'])
+        self.assertEqual(splitcommand("gpg --local-user 'Bob | Jones' --sign"),
+                         ['gpg', '--local-user', 'Bob | Jones', '--sign'])
+        self.assertEqual(splitcommand("gpg '$HOME'"), ['gpg', '$HOME'])
+        self.assertEqual(splitcommand('gpg Alice\\ Smith'), ['gpg', 'Alice Smith'])
+
+    def test_needs_shell(self):
+        for command in ('gpg --export | less',
+                        'gpg --export >foo.asc',
+                        'gpg --import <foo.asc',
+                        'gpg --list-keys; ls',
+                        'gpg --list-keys &',
+                        'gpg --output $HOME/foo.asc',
+                        'gpg --output "$HOME/foo.asc"',
+                        'gpg --import *.asc',
+                        'gpg --import ~/foo.asc',
+                        'gpg --list-keys `whoami`',
+                        'gpg "Alice\\"s key"',
+                        'gpg "unclosed',
+                        'gpg unclosed\\'):
+            self.assertEqual(splitcommand(command), None, command)
+
+
+class SplitBackgroundTests(unittest.TestCase):
+
+    def test_background(self):
+        self.assertEqual(splitbackground('refresh &'), ('refresh', True))
+        self.assertEqual(splitbackground('recv 0x1234ABCD&  '), ('recv 0x1234ABCD', True))
+        self.assertEqual(splitbackground('export A >a.gpg 2>&1 &'), ('export A >a.gpg 2>&1', True))
+
+    def test_foreground(self):
+        for line in ('refresh', 'find "Smith &"', 'find Smith \\&', 'list && ls',
+                     'list >&', 'list |&', '&', '  &', ''):
+            self.assertEqual(splitbackground(line), (line, False), line)
+
+
+class ExpandTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        with open('keys.txt', 'wt') as f:
+            f.write('0x1111\n\n# comment\n  0x2222  \nAlice Smith\n')
+
+    def test_expand(self):
+        args = parseargs('--armor A @keys.txt B', files=True)
+        self.assertEqual(args.args, ('A', '0x1111', '0x2222', "'Alice Smith'", 'B'))
+        self.assertEqual(args.options, ('--armor',))
+
+    def test_expand_pipe(self):
+        args = parseargs('@keys.txt | less', files=True)
+        self.assertEqual(args.tuple, ('0x1111', '0x2222', "'Alice Smith'", '|', 'less'))
+
+    def test_expand_quoted(self):
+        os.rename('keys.txt', 'my keys.txt')
+        args = parseargs('@my\\ keys.txt', files=True)
+        self.assertEqual(args.args, ('0x1111', '0x2222', "'Alice Smith'"))
+
+    def test_expand_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = StringIO('0x3333\n')
+        try:
+            args = parseargs('@-', files=True)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(args.args, ('0x3333',))
+
+    def test_expand_stdin_disabled(self):
+        args = parseargs('A @-', files=True, stdin=False)
+        self.assertEqual(args.ok, False)
+        self.assertEqual(args.error, '@-: commands are read from stdin')
+
+    def test_no_file(self):
+        args = parseargs('@example.org @', files=True)
+        self.assertEqual(args.args, ('@example.org', '@'))
+
+    def test_not_enabled(self):
+        args = parseargs('@keys.txt')
+        self.assertEqual(args.args, ('@keys.txt',))
+
+    def test_unreadable(self):
+        os.chmod('keys.txt', 0)
+        if os.access('keys.txt', os.R_OK):
+            self.skipTest('running as root')
+        args = parseargs('@keys.txt', files=True)
+        self.assertEqual(args.ok, False)
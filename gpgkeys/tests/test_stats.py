@@ -0,0 +1,120 @@
+import unittest
+import json
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from os.path import join
+
+from gpgkeys.gpgkeys import GPGKeys
+from gpgkeys.stats import Stats
+from gpgkeys.stats import stats
+from gpgkeys.stats import percentile
+from gpgkeys.completions.keyserver import KeyserverCompletion
+
+from gpgkeys.tests.test_keycompletion import KeyringSetup
+from gpgkeys.tests.test_keycompletion import KEYID
+
+
+class StatsTests(unittest.TestCase):
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summary(self):
+        s = Stats()
+        for ms in (1, 2, 3, 4):
+            s.add('key', ms / 1000.0)
+        s.count('key.update', 'hits')
+        s.count('key.update', 'hits')
+        s.count('key.update', 'hits')
+        s.count('key.update', 'misses')
+        s.count('key.update', 'rebuilds')
+        summary = s.summary()
+        self.assertEqual(summary['key']['calls'], 4)
+        self.assertAlmostEqual(summary['key']['p50'], 2)
+        self.assertAlmostEqual(summary['key']['p99'], 4)
+        self.assertEqual('hit_ratio' in summary['key'], False)
+        self.assertEqual(summary['key.update']['hit_ratio'], 0.75)
+        self.assertEqual(summary['key.update']['rebuilds'], 1)
+
+    def test_measure(self):
+        s = Stats()
+        with s.measure('completebase'):
+            pass
+        self.assertEqual(s.summary()['completebase']['calls'], 1)
+
+    def test_bounded(self):
+        s = Stats()
+        for i in range(s.counter('key').max_samples + 10):
+            s.add('key', 0.001)
+        self.assertEqual(s.summary()['key']['calls'], s.counter('key').max_samples + 10)
+        self.assertEqual(len(s.counter('key').samples), s.counter('key').max_samples)
+
+    def test_format(self):
+        s = Stats()
+        s.add('completebase', 0.001)
+        s.add('key.update', 0.002)
+        s.count('key.update', 'misses')
+        lines = s.format()
+        self.assertEqual(lines[0].split(), ['completer', 'calls', 'hits', 'misses', 'hit%',
+                                            'rebuilds', 'p50', 'p95', 'p99'])
+        self.assertEqual(lines[1].split(), ['completebase', '1', '-', '-', '-', '-',
+                                            '1.00ms', '1.00ms', '1.00ms'])
+        self.assertEqual(lines[2].split(), ['key.update', '1', '0', '1', '0%', '0',
+                                            '2.00ms', '2.00ms', '2.00ms'])
+
+    def test_dump(self):
+        s = Stats()
+        s.add('key', 0.001)
+        f = StringIO()
+        s.dump(f, '2.3')
+        data = json.loads(f.getvalue())
+        self.assertEqual(data['version'], '2.3')
+        self.assertEqual(data['completers']['key']['calls'], 1)
+
+
+class CompletionStatsTests(KeyringSetup):
+
+    def setUp(self):
+        KeyringSetup.setUp(self)
+        stats.reset()
+
+    def test_key_completion(self):
+        kc = self.keycompletion()
+        self.assertEqual(kc(KEYID[:4]), [KEYID])
+        self.assertEqual(kc(KEYID[:4]), [KEYID])
+        summary = stats.summary()
+        self.assertEqual(summary['key']['calls'], 2)
+        self.assertEqual(summary['key.update']['calls'], 2)
+        self.assertEqual(summary['key.update']['hits'], 1)
+        self.assertEqual(summary['key.update']['misses'], 1)
+        self.assertEqual(summary['key.update']['rebuilds'], 1)
+
+    def test_keyserver_completion(self):
+        self.write('gpg.conf', b'keyserver hkp://keys.example.org\n')
+        ksc = KeyserverCompletion()
+        ksc.gpgconf = join(self.tempdir, 'gpg.conf')
+        self.assertEqual(ksc('hkp'), ['hkp://keys.example.org'])
+        self.assertEqual(ksc('hkp'), ['hkp://keys.example.org'])
+        summary = stats.summary()
+        self.assertEqual(summary['keyserver.update']['calls'], 2)
+        self.assertEqual(summary['keyserver.update']['hit_ratio'], 0.5)
+
+    def test_stats_command(self):
+        stdout = StringIO()
+        shell = GPGKeys(stdout=stdout, stderr=StringIO())
+        stats.add('completebase', 0.001)
+        shell.onecmd('stats')
+        self.assertEqual(stdout.getvalue().splitlines()[1].split()[:2], ['completebase', '1'])
+        stdout.seek(0)
+        stdout.truncate()
+        shell.onecmd('stats --json')
+        self.assertEqual(json.loads(stdout.getvalue())['completers']['completebase']['calls'], 1)
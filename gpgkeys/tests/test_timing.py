@@ -0,0 +1,103 @@
+import unittest
+import sys
+import re
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gpgkeys.gpgkeys import GPGKeys
+from gpgkeys.timing import Timing
+from gpgkeys.timing import Process
+from gpgkeys.timing import current
+from gpgkeys.timing import timed
+
+timing_re = re.compile(r'^gpgkeys: real \S+s  user \S+s  sys \S+s  maxrss \d+K  processes (\d+)  '
+                       r'parse \S+ms  refresh \S+ms$')
+
+BUSY = '%s -c "sum(range(3000000))"' % sys.executable
+
+
+class ProcessTests(unittest.TestCase):
+
+    def test_rusage(self):
+        process = Process([sys.executable, '-c', 'sum(range(3000000))'])
+        process.communicate()
+        self.assertEqual(process.returncode, 0)
+        self.assertTrue(process.rusage.ru_utime > 0)
+        self.assertTrue(process.rusage.ru_maxrss > 0)
+
+    def test_returncode(self):
+        process = Process([sys.executable, '-c', 'raise SystemExit(3)'])
+        self.assertEqual(process.wait(), 3)
+        process = Process([sys.executable, '-c', 'import os; os.kill(os.getpid(), 9)'])
+        self.assertEqual(process.wait(), -9)
+
+
+class TimingTests(unittest.TestCase):
+
+    def test_active(self):
+        self.assertEqual(current(), None)
+        with Timing() as outer:
+            self.assertTrue(current() is outer)
+            with Timing() as inner:
+                self.assertTrue(current() is inner)
+            self.assertTrue(current() is outer)
+        self.assertEqual(current(), None)
+        self.assertTrue(outer.real >= inner.real)
+
+    def test_timed(self):
+        @timed('parse')
+        def parse(x):
+            return x
+        self.assertEqual(parse(1), 1)
+        with Timing() as timing:
+            parse(2)
+        self.assertTrue(timing.parts['parse'] > 0)
+        self.assertEqual(timing.parts['refresh'], 0)
+
+
+class TimeCommandTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stderr = StringIO()
+
+    def shell(self, **kw):
+        shell = GPGKeys(stdout=StringIO(), stderr=self.stderr, **kw)
+        # Keep subprocesses away from the terminal
+        shell.captured = []
+        return shell
+
+    def lines(self):
+        return self.stderr.getvalue().splitlines()
+
+    def test_time(self):
+        shell = self.shell()
+        shell.onecmd('time shell ' + BUSY)
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        m = timing_re.match(lines[0])
+        self.assertTrue(m, lines[0])
+        self.assertEqual(m.group(1), '1')
+        self.assertNotEqual(lines[0].split()[4], '0.000s')
+
+    def test_time_builtin(self):
+        shell = self.shell()
+        shell.onecmd('time help')
+        self.assertEqual(timing_re.match(self.lines()[0]).group(1), '0')
+
+    def test_timing_option(self):
+        shell = self.shell(timing=True)
+        shell.onecmd('shell true')
+        shell.onecmd('')
+        shell.onecmd('time shell true')
+        lines = self.lines()
+        self.assertEqual(len(lines), 2)
+        for line in lines:
+            self.assertTrue(timing_re.match(line), line)
+
+    def test_no_timing(self):
+        shell = self.shell()
+        shell.onecmd('shell true')
+        self.assertEqual(self.lines(), [])
@@ -0,0 +1,108 @@
+import unittest
+import os
+import sys
+import json
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gpgkeys.gpgkeys import main
+from gpgkeys.trace import Trace
+from gpgkeys.timing import Timing
+from gpgkeys.timing import Process
+
+from gpgkeys.tests.test_batch import FakeGPGKeys
+from gpgkeys.tests.test_keycompletion import KeyringSetup
+
+HELLO = '%s -c "print(\'hello\')"' % sys.executable
+
+
+class TraceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.umask = os.umask(0o022)
+        self.file = StringIO()
+        self.shell = FakeGPGKeys(stdout=StringIO(), stderr=StringIO())
+        self.shell.trace = Trace(self.file)
+
+    def tearDown(self):
+        os.umask(self.umask)
+
+    def records(self):
+        return [json.loads(x) for x in self.file.getvalue().splitlines()]
+
+    def test_record(self):
+        self.shell.results['--export'] = 2
+        self.shell.onecmd('exp --armor "Alice Smith" | less')
+        record, = self.records()
+        self.assertEqual(record['line'], 'exp --armor "Alice Smith" | less')
+        self.assertEqual(record['command'], 'export')
+        self.assertEqual(record['args'], {'options': ['--armor'], 'args': ['"Alice Smith"'],
+                                          'pipe': ['|', 'less']})
+        self.assertEqual(record['rc'], 2)
+        self.assertTrue(record['start'] <= record['end'])
+        self.assertEqual(record['argv'], [])
+        self.assertEqual(record['cache_updates'], [])
+
+    def test_one_record_per_command(self):
+        self.shell.onecmd('list')
+        self.shell.onecmd('')
+        self.shell.onecmd('time list')
+        self.shell.onecmd('unknown')
+        self.assertEqual([x['command'] for x in self.records()], ['list', 'list', None])
+        self.assertEqual(self.records()[2]['rc'], 1)
+
+    def test_subprocess(self):
+        self.shell.captured = []
+        self.shell.onecmd('shell ' + HELLO)
+        record, = self.records()
+        self.assertEqual(record['argv'], [['/bin/sh', '-c', HELLO]])
+        self.assertEqual(record['args'], None)
+        self.assertTrue(record['maxrss'] > 0)
+        if os.path.exists('/proc/self/io'):
+            self.assertTrue(record['written'] >= len('hello\n'))
+
+    def test_no_trace(self):
+        self.shell.trace = None
+        self.shell.onecmd('list')
+        self.assertEqual(self.file.getvalue(), '')
+
+
+class ProcessTests(unittest.TestCase):
+
+    @unittest.skipUnless(os.path.exists('/proc/self/io'), 'requires /proc/PID/io')
+    def test_written(self):
+        args = [sys.executable, '-c', 'import os; os.write(1, b"x" * 1000)']
+        with open(os.devnull, 'wb') as devnull:
+            process = Process(args, stdout=devnull)
+            process.wait()
+            self.assertEqual(process.written, None)
+            with Timing():
+                process = Process(args, stdout=devnull)
+                self.assertEqual(process.wait(), 0)
+        self.assertTrue(process.written >= 1000)
+
+
+class CacheUpdateTests(KeyringSetup):
+
+    def test_cache_updates(self):
+        kc = self.keycompletion()
+        with Timing() as timing:
+            kc.update()
+            kc.update()
+        self.assertEqual(timing.updates, ['key'])
+
+
+class MainTests(unittest.TestCase):
+
+    def test_bad_trace_file(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            rc = main(['--trace', '/nonexistent/trace.jsonl', 'version'])
+            self.assertEqual(rc, 1)
+            self.assertTrue(sys.stderr.getvalue().startswith('gpgkeys: /nonexistent/trace.jsonl:'))
+        finally:
+            sys.stderr = stderr
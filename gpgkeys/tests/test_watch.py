@@ -0,0 +1,169 @@
+import unittest
+import os
+
+from os.path import join
+
+from gpgkeys.testing import JailSetup
+from gpgkeys.watch import Watcher
+from gpgkeys.watch import libc
+from gpgkeys.completions.keyserver import KeyserverCompletion
+
+
+class WatcherTests(JailSetup):
+
+    inotify = False
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.mkfile('pubring.kbx')
+        self.mkfile('other')
+
+    def watcher(self):
+        watcher = Watcher(self.tempdir, ('pubring.kbx', 'private-keys-v1.d'), self.inotify)
+        watcher.interval = 0
+        self.assertEqual(watcher.inotify, self.inotify)
+        return watcher
+
+    def changed(self, watcher):
+        result = watcher.changed()
+        watcher.reset()
+        return result
+
+    def test_first_call(self):
+        watcher = self.watcher()
+        self.assertEqual(self.changed(watcher), True)
+        self.assertEqual(self.changed(watcher), False)
+
+    def test_modified(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        with open('pubring.kbx', 'ab') as f:
+            f.write(b'x')
+        self.assertEqual(self.changed(watcher), True)
+        self.assertEqual(self.changed(watcher), False)
+
+    def test_replaced(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        self.mkfile('pubring.kbx.tmp', 'xx')
+        os.rename('pubring.kbx.tmp', 'pubring.kbx')
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_removed(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        os.remove('pubring.kbx')
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_other_file(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        with open('other', 'ab') as f:
+            f.write(b'x')
+        self.assertEqual(self.changed(watcher), False)
+
+    def test_directory_contents(self):
+        os.mkdir('private-keys-v1.d')
+        watcher = self.watcher()
+        self.changed(watcher)
+        self.mkfile(join('private-keys-v1.d', 'ABCD.key'))
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_directory_created(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        os.mkdir('private-keys-v1.d')
+        self.assertEqual(self.changed(watcher), True)
+        self.mkfile(join('private-keys-v1.d', 'ABCD.key'))
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_symlink_target(self):
+        os.mkdir('dotfiles')
+        self.mkfile(join('dotfiles', 'pubring.kbx'))
+        self.mkfile(join('dotfiles', 'other.kbx'))
+        os.remove('pubring.kbx')
+        os.symlink(join(self.tempdir, 'dotfiles', 'pubring.kbx'), 'pubring.kbx')
+        watcher = self.watcher()
+        self.changed(watcher)
+        with open(join('dotfiles', 'other.kbx'), 'ab') as f:
+            f.write(b'x')
+        self.assertEqual(self.changed(watcher), False)
+        with open(join('dotfiles', 'pubring.kbx'), 'ab') as f:
+            f.write(b'x')
+        self.assertEqual(self.changed(watcher), True)
+        # Point the link elsewhere
+        os.remove('pubring.kbx')
+        os.symlink(join(self.tempdir, 'dotfiles', 'other.kbx'), 'pubring.kbx')
+        self.assertEqual(self.changed(watcher), True)
+        with open(join('dotfiles', 'other.kbx'), 'ab') as f:
+            f.write(b'xx')
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_changes_kept_until_reset(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        os.remove('pubring.kbx')
+        self.assertEqual(watcher.changed(), True)
+        self.assertEqual(watcher.changed(), True)
+
+
+@unittest.skipIf(libc is None, 'inotify not available')
+class InotifyWatcherTests(WatcherTests):
+
+    inotify = True
+
+    def test_home_removed(self):
+        os.mkdir('home')
+        watcher = Watcher(join(self.tempdir, 'home'), ('pubring.kbx',))
+        self.changed(watcher)
+        os.rmdir('home')
+        self.assertEqual(self.changed(watcher), True)
+        self.assertEqual(watcher.inotify, False)
+
+    def test_missing_home(self):
+        watcher = Watcher(join(self.tempdir, 'home'), ('pubring.kbx',))
+        self.assertEqual(watcher.inotify, False)
+        self.assertEqual(self.changed(watcher), True)
+
+    def test_attributes(self):
+        watcher = self.watcher()
+        self.changed(watcher)
+        os.utime('pubring.kbx', (0, 0))
+        os.chmod('pubring.kbx', 0o600)
+        self.assertEqual(self.changed(watcher), False)
+
+    def test_close(self):
+        watcher = self.watcher()
+        fd = watcher.fd
+        watcher.close()
+        self.assertRaises(OSError, os.fstat, fd)
+
+
+@unittest.skipIf(libc is None, 'inotify not available')
+class KeyserverTests(JailSetup):
+
+    def test_symlinked_gpgconf(self):
+        os.mkdir('home')
+        with open('gpg.conf', 'wt') as f:
+            f.write('keyserver a\n')
+        os.symlink(join(self.tempdir, 'gpg.conf'), join('home', 'gpg.conf'))
+        ksc = KeyserverCompletion()
+        ksc.gpgconf = join(self.tempdir, 'home', 'gpg.conf')
+        self.assertEqual(ksc(''), ['a'])
+        with open('gpg.conf', 'at') as f:
+            f.write('keyserver b\n')
+        self.assertEqual(ksc(''), ['a', 'b'])
+
+
+class ThrottleTests(JailSetup):
+
+    def test_throttled(self):
+        self.mkfile('pubring.kbx')
+        watcher = Watcher(self.tempdir, ('pubring.kbx',), False)
+        watcher.interval = 3600
+        watcher.changed()
+        watcher.reset()
+        os.remove('pubring.kbx')
+        self.assertEqual(watcher.changed(), False)
+        watcher.checked = 0
+        self.assertEqual(watcher.changed(), True)
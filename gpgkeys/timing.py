@@ -0,0 +1,148 @@
+"""Measure the time and resources used by commands."""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import threading
+import functools
+import subprocess
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+_local = threading.local()
+
+
+def current():
+    """Return the Timing active on this thread or None."""
+    return getattr(_local, 'timing', None)
+
+
+def timed(name):
+    """Add the time spent in the decorated function to the active
+    Timing under ``name``.
+    """
+    def decorator(func):
+        def wrapper(*args, **kw):
+            timing = current()
+            if timing is None:
+                return func(*args, **kw)
+            start = clock()
+            try:
+                return func(*args, **kw)
+            finally:
+                timing.add(name, clock() - start)
+        return functools.wraps(func)(wrapper)
+    return decorator
+
+
+def exitstatus(status):
+    """Return the return code for a wait status like Popen does."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def readwchar(pid):
+    """Return the number of bytes written by process ``pid`` and its
+    reaped children, or None if the system does not tell.
+    """
+    try:
+        with open('/proc/%d/io' % pid, 'rt') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except (EnvironmentError, ValueError):
+        pass
+
+
+class Process(subprocess.Popen):
+    """Popen which records the resource usage of the child in rusage.
+
+    If a Timing is active, the bytes written by the child are
+    recorded in written.
+    """
+
+    rusage = None
+    written = None
+
+    def wait(self, *args, **kw):
+        if self.returncode is None and hasattr(os, 'wait4'):
+            if current() is not None and hasattr(os, 'waitid'):
+                # Look at the child before it is reaped
+                try:
+                    os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+                except OSError:
+                    pass
+                else:
+                    self.written = readwchar(self.pid)
+            try:
+                pid, status, self.rusage = os.wait4(self.pid, 0)
+            except OSError:
+                # Already reaped; Popen knows what to do
+                pass
+            else:
+                self.returncode = exitstatus(status)
+        return super(Process, self).wait(*args, **kw)
+
+
+class Timing(object):
+    """Time and resources used by a command.
+
+    Entering the Timing makes it the active Timing of the thread.
+    """
+
+    def __init__(self):
+        self.start = None
+        self.started = None
+        self.ended = None
+        self.real = 0.0
+        self.user = 0.0
+        self.sys = 0.0
+        self.maxrss = 0
+        self.processes = 0
+        self.parts = {'parse': 0.0, 'refresh': 0.0}
+        self.commands = []
+        self.written = None
+        self.updates = []
+
+    def __enter__(self):
+        self.saved = current()
+        _local.timing = self
+        self.started = time.time()
+        self.start = clock()
+        return self
+
+    def __exit__(self, *ignored):
+        self.real = clock() - self.start
+        self.ended = time.time()
+        _local.timing = self.saved
+
+    def add(self, name, seconds):
+        self.parts[name] = self.parts.get(name, 0.0) + seconds
+
+    def add_process(self, args, process):
+        """Account for a child process executing ``args``."""
+        self.processes += 1
+        self.commands.append(list(args))
+        if process.written is not None:
+            self.written = (self.written or 0) + process.written
+        rusage = process.rusage
+        if rusage is not None:
+            self.user += rusage.ru_utime
+            self.sys += rusage.ru_stime
+            maxrss = rusage.ru_maxrss
+            if sys.platform == 'darwin':
+                # Bytes instead of kilobytes
+                maxrss //= 1024
+            self.maxrss = max(self.maxrss, maxrss)
+
+    def format(self):
+        return ('real %.3fs  user %.3fs  sys %.3fs  maxrss %dK  processes %d  '
+                'parse %.2fms  refresh %.2fms' % (
+                    self.real, self.user, self.sys, self.maxrss, self.processes,
+                    self.parts['parse'] * 1000, self.parts['refresh'] * 1000))
@@ -0,0 +1,27 @@
+"""Write a JSON record per command."""
+
+from __future__ import absolute_import
+
+import json
+import threading
+
+
+class Trace(object):
+    """Append JSON lines to ``file``.
+
+    Records may be written from several threads.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
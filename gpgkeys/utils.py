@@ -1,11 +1,30 @@
+import os
 import sys
 import locale
 import signal
 import termios
+import threading
 import functools
 
+from collections import deque
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+try:
+    from functools import lru_cache
+except ImportError:
+    lru_cache = None
+    from collections import OrderedDict
+
 preferrederrors = 'replace'
 
+# Linux limits the length of a single argument, and thus of the
+# command line passed to 'sh -c', to 128 KiB
+MAX_ARG_STRLEN = 131072
+
 
 def memoize(func):
     """Cache forever."""
@@ -17,6 +36,137 @@ def memoize(func):
     return functools.wraps(func)(memoizer)
 
 
+def lrucache(maxsize=128):
+    """Cache the ``maxsize`` most recently used results."""
+    if lru_cache is not None:
+        return lru_cache(maxsize)
+    def decorator(func):
+        cache = OrderedDict()
+        def wrapper(*args):
+            try:
+                result = cache.pop(args)
+            except KeyError:
+                result = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = result
+            return result
+        return functools.wraps(func)(wrapper)
+    return decorator
+
+
+@memoize
+def getargmax():
+    """Return the number of bytes available for a command line."""
+    try:
+        argmax = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        argmax = -1
+    if argmax <= 0:
+        argmax = 4096 # POSIX minimum
+    # The environment counts against the limit, including pointers
+    env = sum(len(k) + len(v) + 10 for k, v in os.environ.items())
+    return max(min(argmax - env, MAX_ARG_STRLEN) - 2048, 1024)
+
+
+def chunkargs(args, limit):
+    """Split ``args`` into tuples whose joined length does not exceed
+    ``limit`` bytes. Arguments longer than ``limit`` form a chunk of
+    their own.
+    """
+    chunk = []
+    size = 0
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg_bytes = arg.encode('utf-8', 'surrogateescape')
+        else:
+            arg_bytes = arg
+        # Argument plus separator or terminator
+        length = len(arg_bytes) + 1
+        if chunk and size + length > limit:
+            yield tuple(chunk)
+            chunk = []
+            size = 0
+        chunk.append(arg)
+        size += length
+    if chunk:
+        yield tuple(chunk)
+
+
+def parallel_map(func, items, workers):
+    """Call ``func`` for each of ``items`` on up to ``workers`` threads.
+
+    Yields the results in the order of ``items`` as soon as they are
+    available. Exceptions are raised when their result is due.
+    ``items`` is consumed lazily; at most twice ``workers`` items are
+    taken ahead of the results yielded.
+    """
+    workers = max(workers, 1)
+    items = iter(items)
+    queue = Queue(2 * workers)
+    pending = deque()
+    threads = []
+
+    def work():
+        while True:
+            task = queue.get()
+            if task is None:
+                return
+            task.run()
+
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                task = _Task(func, item)
+                pending.append(task)
+                if len(threads) < workers:
+                    thread = threading.Thread(target=work, name='gpgkeys-worker-%d' % len(threads))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+                queue.put(task)
+            if not pending:
+                return
+            task = pending.popleft()
+            # Wait in slices so KeyboardInterrupt gets through
+            while not task.done.wait(0.1):
+                pass
+            if task.error is not None:
+                raise task.error
+            yield task.result
+    finally:
+        # Drop tasks nobody waits for and stop the workers
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+        for thread in threads:
+            queue.put(None)
+
+
+class _Task(object):
+
+    def __init__(self, func, item):
+        self.func = func
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(self.item)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
 @memoize
 def getpreferredencoding():
     """Return preferred encoding for text I/O."""
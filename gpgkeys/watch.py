@@ -0,0 +1,221 @@
+"""Detect changes to files in a directory.
+
+Uses inotify on Linux so that checking for changes does no file
+system I/O. Elsewhere, or if inotify is unavailable, falls back to
+comparing stat results no more often than every few seconds.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import errno
+import struct
+import ctypes
+
+# inotify_init1 flags
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# inotify event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+# IN_ATTRIB is left out; gpg touches files without changing them
+IN_CHANGES = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT = struct.Struct('iIII')
+
+
+def load_inotify():
+    """Return libc if it supports inotify, None otherwise."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+libc = load_inotify()
+
+
+def fsencode(name):
+    """Encode a file name for the operating system."""
+    if isinstance(name, bytes):
+        return name
+    return name.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+class Watcher(object):
+    """Watch files in a directory for changes.
+
+    ``names`` are file or directory names relative to ``directory``.
+    Directories are watched for changes of their contents too. Names
+    which are symbolic links to files also change with their targets.
+    """
+
+    # Seconds between stat calls in fallback mode
+    interval = 2.0
+
+    def __init__(self, directory, names, inotify=True):
+        self.directory = directory
+        self.names = tuple(names)
+        self.fd = -1
+        self.wds = {}
+        self.links = {}
+        self.encoded = {}
+        self.dirty = True
+        self.checked = 0
+        self.stats = None
+        if inotify and libc is not None:
+            self.start()
+
+    @property
+    def inotify(self):
+        """True if changes are detected by inotify."""
+        return self.fd >= 0
+
+    def changed(self):
+        """Return True if a watched file changed since the last reset.
+
+        Returns True before the first reset.
+        """
+        if self.fd >= 0:
+            self.read_events()
+        else:
+            now = time.time()
+            if now - self.checked >= self.interval:
+                self.checked = now
+                stats = self.stat()
+                if stats != self.stats:
+                    self.stats = stats
+                    self.dirty = True
+        return self.dirty
+
+    def reset(self):
+        """Mark all changes as seen."""
+        self.dirty = False
+
+    def close(self):
+        """Stop using inotify and fall back to stat."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.wds = {}
+            self.links = {}
+            self.checked = 0
+            self.dirty = True
+
+    def __del__(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+
+    def stat(self):
+        stats = []
+        for name in self.names:
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                stats.append(None)
+            else:
+                stats.append((st.st_ino, st.st_size, st.st_mtime))
+        return stats
+
+    def start(self):
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return
+        self.fd = fd
+        self.encoded = dict((fsencode(x), x) for x in self.names)
+        if self.add_watch(None) < 0:
+            self.close()
+            return
+        for name in self.names:
+            if os.path.isdir(os.path.join(self.directory, name)):
+                self.add_watch(name)
+            else:
+                self.add_link(name)
+
+    def add_watch(self, name):
+        path = self.directory
+        if name is not None:
+            path = os.path.join(path, name)
+        wd = libc.inotify_add_watch(self.fd, fsencode(path), IN_CHANGES | IN_ONLYDIR)
+        if wd >= 0:
+            self.wds[wd] = name
+        return wd
+
+    def add_link(self, name):
+        """Watch the target of ``name`` if it is a symbolic link."""
+        path = os.path.join(self.directory, name)
+        if not os.path.islink(path):
+            return
+        # The link itself is covered by the watch on the directory,
+        # so watch the directory containing the final target
+        directory, target = os.path.split(os.path.realpath(path))
+        wd = libc.inotify_add_watch(self.fd, fsencode(directory), IN_CHANGES | IN_ONLYDIR)
+        if wd >= 0:
+            self.links.setdefault(wd, set()).add(fsencode(target))
+
+    def read_events(self):
+        while self.fd >= 0:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if not data:
+                return
+            self.parse_events(data)
+
+    def parse_events(self, data):
+        pos, end = 0, len(data)
+        while pos < end:
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            name = data[pos+EVENT.size:pos+EVENT.size+length].rstrip(b'\0')
+            pos += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.dirty = True
+                continue
+            if wd in self.links:
+                if name in self.links[wd] or mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.dirty = True
+                if mask & IN_IGNORED:
+                    del self.links[wd]
+            if wd not in self.wds:
+                continue
+            elif self.wds[wd] is None:
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The directory itself is gone
+                    self.close()
+                    return
+                if name in self.encoded:
+                    self.dirty = True
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        name = self.encoded[name]
+                        if os.path.isdir(os.path.join(self.directory, name)):
+                            self.add_watch(name)
+                        else:
+                            self.add_link(name)
+            else:
+                self.dirty = True
+                if mask & IN_IGNORED:
+                    del self.wds[wd]